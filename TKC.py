@@ -3,7 +3,9 @@ from rbk import MoveStatus, BasicModule, ParamServer
 from rbkSim import SimModule
 from datetime import datetime
 from robot import ModuleTool
-import math, time, json, goPath
+import math, os, time, json, goPath
+import mid360_cloud
+import path_geometry
 
 # Version:20251106-1
 """
@@ -78,6 +80,94 @@ class GoodsAreaDetect:
     z_up = 0.6                      #0.5
     z_down = 0.25                   #0.25
     """
+    voxel_size，点云体素降采样分辨率(m)，每个体素只保留离机器人最近的点，0 表示不降采样
+    先拟合货箱(用原始点云)，再裁剪到检测范围和 polygon1，最后降采样，范围内的点不会被范围外同一体素的点挤掉
+    降采样在 rec_good 之前执行，point_num 和 min_point_num 统计的是被占用的体素个数
+    """
+    voxel_size = 0.05
+    """
+    多帧累积：保留最近 accumulate_frames 帧(里程坐标系)，每帧间隔 frame_interval(s)，超过 frame_max_age(s) 的帧丢弃
+    点数 >= min_point_num 的帧记为有货，有货帧占比 >= min_confidence 判定为有货，避免单帧噪声触发后退重扫
+    min_point_num 按 voxel_size 的体素计数：3 个 5cm 体素约为货物正面 15cm 宽的一条，比 3 个原始点更严，
+    同一位置的噪点只占一个体素；改 voxel_size 时按同样的面积换算
+    """
+    accumulate_frames = 3
+    frame_interval = 0.1
+    frame_max_age = 2.0
+    min_point_num = 3
+    min_confidence = 0.5
+    """tick_budget，每个周期点云处理的时间预算(s)，按实测速度决定每周期处理多少点"""
+    tick_budget = 0.02
+    """
+    worker，点云读取、降采样和拟合放到后台执行，周期内只提交和查询结果，避免扫描时拖慢其他任务
+    "" 在周期内按 tick_budget 分块处理，"thread" 后台线程，"process" 后台进程(需要把原始点云传给子进程)
+    """
+    worker = ""
+    """
+    多传感器融合：fuse_devices 中各设备的点云合并成一帧，默认只有 mid360；其中任一设备没有点云时报错，不用其他相机凑数
+    加入其他设备前先确认它在 allCameraCloud 中的坐标系：已经是机器人坐标系的直接加入，
+    传感器坐标系的同时填入 sensor_frame_devices {allCameraCloud 设备名: 标定文件中的设备名}，
+    用 calibration_file 中的外参(x, y, z, roll, pitch, yaw，角度单位度)转到机器人坐标系，例如 {"VZense-TCP": "palletCamera"}
+    None 表示 allCameraCloud 中的所有设备，托盘相机等也会参与检测和拟合，不建议使用
+    """
+    fuse_devices = ("DJI-mid360-TCP",)
+    sensor_frame_devices = {}
+    calibration_file = "robot_calibrationfile.cp"
+    """
+    scan_dir，每帧原始点云按毫米量化(int16)写入诊断目录，用 mid360_cloud.read_scan 读回，空字符串不保存
+    scan_compress 打开差分+zlib，scan_keep 目录中最多保留的帧数
+    """
+    scan_dir = "/usr/local/etc/.SeerRobotics/rbk/diagnosis/mid360/"
+    scan_compress = True
+    scan_keep = 200
+    """
+    auto_fit，用 RANSAC 拟合货箱地面和两侧墙面，得到货箱坐标系和检测范围，代替 ap_loc/site_length 和上面的固定范围：
+    x 从货箱口(两侧墙开始处，不近于 x_min)到看到的墙面末端(至少到 x_max)，y/z 由墙面和地面决定
+    墙面点沿 x 按 wall_bin 分箱，每箱只保留最外侧 wall_outer 以内的点，靠墙的货物侧面不参与墙面拟合
+    拟合失败(宽度与 a 相差超过 fit_width_tol 等)时退回固定范围
+    """
+    auto_fit = True
+    fit_iterations = 150            # 每个平面的假设数 hypotheses per plane
+    fit_tolerance = 0.03            # 内点距离 inlier distance (m)
+    fit_max_points = 4000           # 参与拟合的最大点数 points used for fitting
+    fit_min_inliers = 50
+    fit_max_angle = 10              # 地面/墙面与理想方向的最大偏角 max plane tilt (deg)
+    fit_floor_band = 0.3            # 地面点 |z| 范围 floor candidates (m)
+    fit_width_tol = 0.3             # 墙间距与 a 的允许偏差 allowed wall distance error (m)
+    wall_band = (0.3, 2.0)          # 墙面点离地高度 wall candidates above floor (m)
+    wall_margin = 0.1               # 检测范围离墙距离 search volume clearance to walls (m)
+    wall_bin = 0.2                  # 墙面点沿 x 分箱 wall candidates binned along x (m)
+    wall_outer = 0.05               # 每箱保留离最外侧点的距离 kept within this of the outermost point (m)
+    """
+    货物正面提取：沿 x 按 face_bin 分箱找最近的货物正面，正面厚度 face_depth，
+    横向按 pallet_width 和间隙 column_gap 统计这一排有几列栈板
+    """
+    face_bin = 0.05
+    face_depth = 0.15
+    pallet_width = 1.1              # 与 p0001.palletobject 的 pallet_width 一致
+    column_gap = 0.1
+    """
+    货箱占用栅格：按 cargo_width/cargo_length 划分栈板位，每格宽 pallet_width、深为 pallet_file 中的 pallet_length，
+    读不到 pallet_file 时用 slot_depth；由 360 检测、识别和插齿更新并存入 GData，记录每排实测的正面深度，
+    同一货箱内下一排已知时跳过 360 检测
+    """
+    use_grid = True
+    pallet_file = "p0001.palletobject"
+    slot_depth = 1.3                # 与 p0001.palletobject 的 pallet_length 一致
+    """
+    渐进检测窗口：按上一托位置 good_location 或已取栈板数 pallet_count 估计下一排在机器人后方的位置，
+    只检测 [下一排 + search_margin, 下一排 - search_rows 排深 - search_margin] 这一段，代替固定的 x_min~x_max，
+    货箱越空窗口越往里，不用多次 GoToPre(r, 0) 后退再扫；第一托没有这些信息时用固定范围
+    """
+    progressive_window = True
+    search_rows = 2
+    search_margin = 0.5
+    """
+    货箱记忆(托数、栅格、上一托位置)只在同一个货箱内使用：入口点变了、距上一次取货超过 memory_max_age(s)、
+    栅格全空或托数达到货箱容量时清掉；窗口前面(按记忆已取空的一段)检测到货物时也认为换了货箱，清掉记忆按完整范围检测
+    """
+    memory_max_age = 600
+    """
     goods_pre_dist，使用360检测货物后，移动机器人，和货物保持一定距离,默认3m，
     根据实际调整，只要相机能识别栈板即可，超过3.5可能识别不到，小于1m，可能识别不到
     """
@@ -107,6 +197,28 @@ class CubicBezierPar:
     extend_factor = 0.7
     odo_2_pallet_dist = 0.45  # 允许的 里程中心 -> 栈板 的最大距离，用于限制车子在车厢内的 y 方向的移动范围，值越大，y 方向能移动的距离越大
     backDist = 0.02  # 后退距离
+    """
+    optimize，按当前栈板偏移批量评估 opt_steps x opt_steps 组 t 和 d(横向偏移 d*extend_factor，符号按取货方向)，
+    选起点、终点切向与进叉方向偏差 <= heading_tol、最小转弯半径 >= min_radius、全程不超出 safe_y 范围
+    (开启 PathPlanningConfig.corridor_check_enabled 时为整车轮廓不碰墙)中最快的曲线；
+    没有可行解时用上面的固定参数，超出 opt_budget 时用已评估部分的最优解。d 和 extend_factor 只以乘积出现，所以只搜索 d
+    """
+    optimize = True
+    opt_t = (-0.3, 0.45)  # t 搜索范围
+    opt_d = (0.05, 0.5)  # |d| 搜索范围
+    opt_steps = 16
+    opt_samples = 201  # 评估每条候选曲线的采样点数
+    opt_budget = 0.01  # 搜索时间预算(s)
+    min_radius = 0.5  # 最小转弯半径(m)
+    heading_tol = 3  # 两端切向与进叉方向的最大偏差(度)
+    lateral_acc = 0.3  # 横向加速度上限，估算通过时间(m/s^2)
+    """
+    搜索结果按 栈板->机器人 相对位置、车体横向位置(量化到 cache_grid)和当前参数缓存到 cache_file，脚本重启后仍可复用；
+    命中时只在精确位置上复核这一组参数，复核不通过才重新搜索。cache_file 为空时只缓存在内存
+    """
+    cache_file = "bezier_curve_cache.json"  # 与脚本同目录
+    cache_size = 256  # 最多缓存条数，超出时丢弃最久未用的
+    cache_grid = 0.01  # 位置量化步长(m)
 
 
 class PathPlanningConfig:
@@ -160,6 +272,65 @@ class PathPlanningConfig:
     ramp_safe_y_min = -0.4              # Safe Y position on ramp (meters)
                                         # LOG: Ramp narrower than container, stricter Y limits
     
+    # ============ Planner ============
+    planner = "bezier"                  # Curve family of pickup and retreat paths: "bezier", "clothoid" or "dubins"
+                                        # LOG: bezier keeps the hand-tuned cubics, planner_bench.py compares them
+                                        # LOG: An unsolvable pose pair falls back to bezier
+    planner_radius = 1.5                # Turning radius of the dubins planner (m)
+
+    # ============ Single Cusp Pickup ============
+    cusp_pickup_enabled = True          # New logic drives retreat and approach as one forward-then-reverse maneuver
+                                        # LOG: The reverse leg is sent as soon as the cusp is reached and the
+                                        # LOG: side-shifter moves during both legs. False: retreat, stop, straight approach
+    cusp_reach_dist = 0.05              # Distance to the cusp that starts the reverse leg (m)
+    cusp_lateral_splits = (1.0, 0.75, 0.5, 0.25, 0.0)  # Share of the sideways move done on the forward leg
+                                        # LOG: The split with the most wall clearance is driven, a short forward
+                                        # LOG: leg cannot turn much in the container. (1.0,) = align fully, then straight in
+    cusp_straight_in = 1.0              # Straight run into the pallet at the end of the reverse leg (m)
+
+    # ============ Path Upload ============
+    path_tolerance = 0.002              # Max lateral error of the uploaded path from the planned curve (m)
+                                        # LOG: Curves are thinned to the fewest points within this bound before
+                                        # LOG: setPathOnWorld, straight parts need 2 points. 0 sends every point
+
+    # ============ Live Collision Check ============
+    collision_check_enabled = True      # Check planned paths against the live camera cloud before sending them
+                                        # LOG: A blocked path fails the task at planning time instead of driving into it
+    footprint_head = 1.79               # Footprint ahead of odom centre (m), devicemodel chassis head
+    footprint_tail = 1.6                # Footprint behind odom centre incl. forks (m), devicemodel chassis tail
+    footprint_width = 1.263             # Body width (m), devicemodel chassis width
+    fork_length = 1.15                  # Rear part of the tail that is forks only (m)
+    fork_width = 1.0                    # Outer fork width (m), devicemodel fork width
+                                        # LOG: Forks are narrower than the body, so pallets next to the target are not hits
+    collision_margin = 0.05             # Clearance added around the footprint (m)
+    obstacle_z_min = 0.1                # Cloud points between these heights are obstacles (m)
+    obstacle_z_max = 2.2                # LOG: below is floor, above is container roof
+    collision_step = 0.05               # Footprint station spacing along the path (m)
+
+    # ============ Speed Profile ============
+    speed_profile_enabled = True        # Per-point speed limits along script paths instead of one fixed max speed
+                                        # LOG: rbk takes one max speed per path, so the limit follows the robot's progress
+    path_max_speed = 0.3                # Top speed on straight, clear stretches (m/s)
+    path_min_speed = 0.1                # Speed at path ends and in the tightest bends (m/s), the old fixed speed
+    path_lateral_acc = 0.2              # Bends are limited to sqrt(path_lateral_acc / curvature) (m/s^2)
+    path_acc = 0.2                      # Acceleration bound (m/s^2)
+    path_dec = 0.2                      # Deceleration bound (m/s^2)
+    path_jerk = 0.5                     # Jerk bound (m/s^3)
+    insert_slow_dist = 1.2              # Slow zone before the recognized pallet pose (path end) on pallet approaches (m)
+                                        # LOG: Cruise at the profile speed, ramp down with path_dec, enter at insert_speed
+    insert_speed = 0.1                  # Speed in the slow zone while the forks enter the pallet (m/s)
+                                        # LOG: DI 16/17 stops the robot, the overshoot past the path end is logged
+    speed_update_step = 0.01            # Resend a higher limit only when it rises by this much (m/s)
+    map_speed_enabled = True            # Use the maxspeed of map areas (smap advancedAreaList) as the top speed
+                                        # LOG: Inside an area with maxspeed it replaces path_max_speed, also when higher
+    map_file = "map/usa_eric_test_1_new.smap"  # Map with the areas, relative to this script or absolute
+
+    # ============ Corridor Check ============
+    corridor_check_enabled = True       # Sweep the footprint along planned paths against the container / ramp walls
+                                        # LOG: Walls at +-container_width/2 (+-ramp_width/2 on the ramp) around world Y=0
+    corridor_min_clearance = 0.02       # Minimum gap between the swept footprint and a wall (m)
+                                        # LOG: Curve search uses this free width instead of the centre-only safe_y band
+
     # ============ Debug Parameters ============
     verbose_logging = True              # Verbose logging output
                                         # LOG: Set to True to see detailed path planning logs
@@ -242,6 +413,142 @@ class MotorName(str):
     tilt = "tilt6"
 
 
+class ContainerGrid:
+    """
+    货箱占用栅格，每格一个栈板位，保存在 GData 中
+    原点在货箱口中心，x 指向货箱里面，y 横向；格子状态 "?" 未知，"." 空，"#" 有货
+    """
+    UNKNOWN, EMPTY, GOODS = "?", ".", "#"
+
+    _depth = None  # pallet_depth() 的缓存
+
+    def __init__(self, origin, rows, cols, slot_depth, slot_width, cells=None, faces=None, container=None):
+        self.origin = origin  # 世界坐标 [x, y, yaw]
+        self.rows, self.cols = rows, cols
+        self.slot_depth, self.slot_width = slot_depth, slot_width
+        self.cells = list(cells or self.UNKNOWN * (rows * cols))
+        self.faces = list(faces or [None] * rows)  # 每排实测的正面深度 measured face depth per row
+        self.container = container  # 建栅格的货箱 RecOutput.container["start"] of the container
+
+    @classmethod
+    def pallet_depth(cls):
+        """
+        栈板位深度，取 pallet_file 中的 pallet_length，读不到时用 slot_depth
+        slot depth from pallet_length of the pallet model
+        """
+        if cls._depth is None:
+            path = os.path.join(os.path.dirname(os.path.abspath(__file__)), GoodsAreaDetect.pallet_file)
+            try:
+                cls._depth = mid360_cloud.load_pallet_model(path)["pallet_length"]
+            except (OSError, ValueError, KeyError) as e:
+                PathPlanningConfig.log(f"Pallet model not read, slot depth {GoodsAreaDetect.slot_depth}m: {e}", "WARN")
+                cls._depth = GoodsAreaDetect.slot_depth
+        return cls._depth
+
+    @classmethod
+    def size(cls, m):
+        """货箱的排数和列数，12.45m x 2m 为 10 排 2 列 rows and columns of the container"""
+        rows = max(1, round(m.cargo_width / cls.pallet_depth()))
+        cols = max(1, round(m.cargo_length / GoodsAreaDetect.pallet_width))
+        return rows, cols
+
+    @classmethod
+    def create(cls, origin, m):
+        """按货箱尺寸建栅格，记下所属的货箱"""
+        return cls(origin, *cls.size(m), cls.pallet_depth(), GoodsAreaDetect.pallet_width,
+                   container=(m.GData.container or {}).get("start"))
+
+    def to_dict(self):
+        return {"origin": [round(v, 3) for v in self.origin], "size": [self.rows, self.cols],
+                "slot": [self.slot_depth, self.slot_width], "cells": "".join(self.cells),
+                "faces": self.faces, "container": self.container}
+
+    @classmethod
+    def from_dict(cls, d):
+        if not d:
+            return None
+        return cls(d["origin"], *d["size"], *d["slot"], d["cells"], d.get("faces"), d.get("container"))
+
+    def get(self, row, col):
+        return self.cells[row * self.cols + col]
+
+    def set(self, row, col, state):
+        if 0 <= row < self.rows and 0 <= col < self.cols:
+            self.cells[row * self.cols + col] = state
+
+    def local(self, world):
+        """世界坐标转栅格坐标 (深度, 横向)"""
+        p = RBK.Pos2Base([world[0], world[1], 0], self.origin)
+        return p[0], p[1]
+
+    def col_range(self, y_min, y_max):
+        """横向范围 [y_min, y_max] 覆盖的列"""
+        half = self.cols * self.slot_width / 2
+        c0 = max(0, int((y_min + half) // self.slot_width))
+        c1 = min(self.cols - 1, int((y_max + half) // self.slot_width))
+        return range(c0, c1 + 1)
+
+    def mark_face(self, world, state, width=None):
+        """
+        标记栈板正面所在的格子
+        Args:
+            world: 正面中心(世界坐标)，如识别结果或 360 检测的货物正面
+            width: 正面宽度，None 表示一个栈板
+        """
+        d, y = self.local(world)
+        row = int((d + self.slot_depth / 2) // self.slot_depth)
+        half = (width or self.slot_width) / 2 - self.slot_width / 4
+        for col in self.col_range(y - half, y + half):
+            self.set(row, col, state)
+        if 0 <= row < self.rows:
+            self.faces[row] = round(d, 3)
+        return row
+
+    def face_depth(self, row):
+        """
+        一排货物正面离货箱口的深度：有实测用实测，否则从最近一排实测按 slot_depth 推算
+        face depth of a row, measured or extrapolated from the nearest measured row
+        """
+        known = [(k, d) for k, d in enumerate(self.faces) if d is not None]
+        if not known:
+            return row * self.slot_depth
+        k, d = min(known, key=lambda kd: abs(kd[0] - row))
+        return d + (row - k) * self.slot_depth
+
+    def mark_depth(self, d0, d1, state):
+        """标记栈板正面落在深度 [d0, d1] 内的各排，与 mark_face 的取整一致"""
+        r0 = max(0, round(d0 / self.slot_depth))
+        r1 = min(self.rows, round(d1 / self.slot_depth))
+        for row in range(r0, r1):
+            for col in range(self.cols):
+                self.set(row, col, state)
+
+    def next_row(self):
+        """
+        前面各排都为空时最近一排有货的格子
+        Returns:
+            (row, [col, ...])，这一排还有未知格子或前面有未知格子时返回 None
+        """
+        for row in range(self.rows):
+            states = [self.get(row, col) for col in range(self.cols)]
+            if self.UNKNOWN in states:
+                return None
+            if self.GOODS in states:
+                return row, [col for col, s in enumerate(states) if s == self.GOODS]
+        return None
+
+    def row_face(self, row, cols):
+        """一排货物正面中心的世界坐标，朝向与在货箱口扫描时的机器人一致"""
+        half = self.cols * self.slot_width / 2
+        y = (min(cols) + max(cols) + 1) / 2 * self.slot_width - half
+        x, y, yaw = RBK.Pos2World([self.face_depth(row), y, math.pi], self.origin)
+        return [x, y, math.atan2(math.sin(yaw), math.cos(yaw))]
+
+    def remaining(self):
+        """有货和未知格子数"""
+        return sum(s != self.EMPTY for s in self.cells)
+
+
 class RecOutput:
     """全局变量"""
     valid = False  # 栈板识别是否有效
@@ -250,6 +557,12 @@ class RecOutput:
     currentPoint = None  # 如果有数据，表示当前最近栈板的坐标
     good_location = []  # 360识别是否有货后，输出货物的坐标（大概）
     has_goods = False  # 360识别是否有货
+    goods_face = None  # 360识别的最近一排货物正面(世界坐标)及列数 nearest goods face and its column count
+    grid = None  # 货箱占用栅格 ContainerGrid
+    pallet_count = 0  # 本货箱已开始取的托数，load 时加 1 loads started in this container
+    container = None  # 记忆所属的货箱 {"entry": 入口点, "stamp": 最近一次取货时间} owner of the memory
+    # 货箱记忆，同一货箱内 360 检测时不清 container memory, kept across use360 loads of one container
+    persistent = ("pallet_count", "grid", "good_location", "container")
 
     def to_dict(self):
         # 由于类属性是共享的，我们只序列化实例属性（如果有的话）
@@ -261,7 +574,11 @@ class RecOutput:
             'nextPoint': self.nextPoint,
             'currentPoint': self.currentPoint,
             'good_location': self.good_location,
-            'has_goods': self.has_goods
+            'has_goods': self.has_goods,
+            'goods_face': self.goods_face,
+            'grid': self.grid.to_dict() if self.grid else None,
+            'pallet_count': self.pallet_count,
+            'container': self.container
         }
 
     def to_object(self, d={}):
@@ -279,12 +596,48 @@ class RecOutput:
             self.good_location = d["good_location"]
         if "has_goods" in d:
             self.has_goods = d["has_goods"]
+        if "goods_face" in d:
+            self.goods_face = d["goods_face"]
+        if "grid" in d:
+            self.grid = ContainerGrid.from_dict(d["grid"])
+        if "pallet_count" in d:
+            self.pallet_count = d["pallet_count"]
+        if "container" in d:
+            self.container = d["container"]
+
+    def touch_container(self, entry):
+        """
+        记录记忆所属的货箱和时间，start 为这个货箱的第一次取货时间，标记栅格属于哪个货箱
+        stamp the memory with the container entry point and time, start tells the containers apart
+        """
+        now = time.time()
+        self.container = {"entry": entry, "stamp": now, "start": (self.container or {}).get("start", now)}
+
+    def grid_row(self):
+        """
+        本货箱栅格中下一排有货的格子，栅格不是本货箱建的时返回 None
+        next goods row of the grid, None unless the grid was built in this container
+        """
+        if not GoodsAreaDetect.use_grid or not self.grid:
+            return None
+        if self.grid.container is None or self.grid.container != (self.container or {}).get("start"):
+            return None
+        return self.grid.next_row()
+
+    def forget_container(self):
+        """换了货箱，清掉上一个货箱的记忆 a new container, drop the memory of the last one"""
+        self.pallet_count = 0
+        self.grid = None
+        self.good_location = []
+        self.container = None
 
     def currentPoint_switch_nextPoint(self):
         """
         当 currentPoint 的栈板任务完成，调用此函数，更新 currentPoint
-
+        插齿完成，栅格中这个栈板位记为空
         """
+        if self.grid:
+            self.grid.mark_face([self.currentPoint["x"], self.currentPoint["y"]], ContainerGrid.EMPTY)
         self.good_location = [self.currentPoint["x"], self.currentPoint["y"], self.currentPoint["yaw"]]
         self.currentPoint = None
         if self.nextPoint:
@@ -390,14 +743,38 @@ class Module(BasicModule):
         self.init_loc = [r.loc()['x'], r.loc()['y'], r.loc()['angle']]
         self.is_clear_GB_data = args.get("clearGBData", None)
         self.report_info["args"] = args
-        # 清理全局数据
-        if any([self.is_clear_GB_data, self.use360, not self.truckLoad]):
+        """==== 初始化操作，获取导航任务参数，按需取用 ==== """
+        self.get_move_task_params(r)  # 获取任务的货物 goodsId 和入口点
+        # 清理全局数据：clearGBData 或换了货箱全部清除；360 检测或非装车只清识别结果，保留同一货箱的托数、栅格和上一托位置
+        # clearGBData or another container clears everything, use360 / no truckLoad keep RecOutput.persistent
+        g_data = r.getGData() or {}
+        if self.is_clear_GB_data or not self.same_container(g_data):
             for _ in range(3):
                 r.setGData({})
+        elif self.use360 or not self.truckLoad:
+            kept = {k: v for k, v in g_data.items() if k in RecOutput.persistent}
+            for _ in range(3):
+                r.setGData(kept)
         if g_data := r.getGData():
             self.GData.to_object(g_data)
-        """==== 初始化操作，获取导航任务参数，按需取用 ==== """
-        self.get_move_task_params(r)  # 获取任务的货物 goodsId
+
+    def same_container(self, g_data):
+        """
+        GData 中的货箱记忆是否属于当前货箱：入口点相同、距上一次取货不超过 memory_max_age、货箱还没取完
+        whether the container memory in GData belongs to the container loaded now
+        """
+        container = g_data.get("container")
+        if not container:
+            return True
+        if self.entry_point_id and container.get("entry") and container["entry"] != self.entry_point_id:
+            return False
+        if time.time() - container.get("stamp", 0) > GoodsAreaDetect.memory_max_age:
+            return False
+        grid = ContainerGrid.from_dict(g_data.get("grid"))
+        if grid and grid.remaining() == 0:
+            return False
+        rows, cols = (grid.rows, grid.cols) if grid else ContainerGrid.size(self)
+        return g_data.get("pallet_count", 0) < rows * cols
 
     def handle_robot(self, r: SimModule):
         if self.operation_status == MoveStatus.NONE:
@@ -472,6 +849,10 @@ class Module(BasicModule):
         
         pallet_count = g_data_dict.get('pallet_count', 0) + 1
         g_data_dict['pallet_count'] = pallet_count
+        # 放进 GData 对象，之后 setGData(m.GData.to_dict()) 不会把计数冲掉
+        self.GData.pallet_count = pallet_count
+        self.GData.touch_container(self.entry_point_id)
+        g_data_dict['container'] = self.GData.container
         r.setGData(g_data_dict)
         
         PathPlanningConfig.log(f"开始取货操作 Starting load operation, 托盘编号 Pallet number: {pallet_count}", "INFO")
@@ -522,10 +903,17 @@ class Module(BasicModule):
         current_point = self.GData.currentPoint
         good_location = self.GData.good_location
         has_goods = self.GData.has_goods
-        if not has_goods and not current_point and not good_location:
-            self.load_type = LoadType.first
-        elif current_point and good_location:
+        grid_row = self.GData.grid_row()
+        if current_point and good_location:
             self.load_type = LoadType.in_not_rec
+        elif grid_row:
+            # 本货箱的栅格中还有未取的一排货物，不用 360 检测，到这一排前识别
+            # the grid of this container has an unpicked row, skip the scan; other grids fall through to use360
+            self.GData.good_location = self.GData.grid.row_face(*grid_row)
+            self.load_type = LoadType.in_rec
+        elif self.use360 or not self.truckLoad or (not has_goods and not current_point and not good_location):
+            # 360 检测或非装车每托都从检测/识别开始，上一托位置只用来缩小检测范围
+            self.load_type = LoadType.first
         elif not current_point and good_location:
             self.load_type = LoadType.in_rec
         else:
@@ -769,6 +1157,9 @@ class Rec:
             m.GData.results = self.results
             m.GData.valid = True
             m.GData.currentPoint, m.GData.nextPoint = self.get_currentPoint(r)
+        if m.GData.grid:
+            for res in self.results:
+                m.GData.grid.mark_face([res["x"], res["y"]], ContainerGrid.GOODS)
 
     def calculate_distance(self, rec, point2):
         """# 定义一个函数来计算两个点之间的欧几里得距离"""
@@ -831,6 +1222,10 @@ class ForkMotor:
 
 
 class Mid360AreaDetect:
+    cloud = mid360_cloud.CloudBuffer()  # 所有扫描共用一个点云缓存 one buffer reused by every scan
+    frames = mid360_cloud.FrameRing(GoodsAreaDetect.accumulate_frames)  # 最近几帧(里程坐标系) last frames in odom frame
+    budget = mid360_cloud.TickBudget(GoodsAreaDetect.tick_budget)  # 每周期点云处理时间 per-tick time budget
+
     def __init__(self, r: SimModule, site_id=None):
         """
         通过mid360检测货箱是否有货物以及返回最近货物的坐标
@@ -840,15 +1235,28 @@ class Mid360AreaDetect:
         self.status = MoveStatus.NONE
         self.polygon1 = []  # 车厢在平面投影的四个顶点坐标
         self.init = False
-        self.count_num = 0
-        self.nodes = []
+        self.xs, self.ys, self.zs = None, None, None  # 点云 x/y/z 视图 views into cloud
         self.point = []
         self.id = site_id
-        self.node_slice = None
         self.site_length = 0.475
         self.ap_loc = None  # ap点坐标
         self.cur_state = dict()
         self.start_time = None
+        self.frame_time = 0  # 上一帧采集时间 time of the last captured frame
+        self.frame_num = 0  # 本次检测采集的帧数 frames captured by this detection
+        self.confidence = 0
+        self.area = GoodsAreaDetect  # 检测范围，拟合成功后换成货箱坐标系下的范围 search volume
+        self.base_area, self.base_polygon = None, None  # 缩小成窗口之前的范围 search volume before the window
+        self.container_loc = None  # 拟合出的货箱坐标系(世界坐标) fitted container frame in world
+        self.door = None  # 拟合出的货箱口在货箱坐标系中的 x fitted door x in the container frame
+        self.reading = False  # 一帧点云读取中 a frame is being read
+        self.frame_loc = None  # 当前帧的机器人位姿 robot pose of the frame being read
+        self.frame_ready = False  # 新的一帧待检测 a new frame waits for detection
+        self.ticks = 0
+        self.future = None  # 后台处理中的一帧 frame being built by the worker
+        self.extrinsics = None  # 传感器坐标系点云的外参 extrinsics of sensor-frame clouds
+        self.window = None  # 渐进检测窗口 (下一排 x, 深度, 余量) progressive search slab
+        self.scan_future = None  # 后台写入中的诊断点云 diagnostic scan being written
 
     def reset(self, r: SimModule):
 
@@ -867,104 +1275,566 @@ class Mid360AreaDetect:
                 ((self.ap_loc[0] + self.site_length - m.cargo_width / 2), self.ap_loc[1] - m.cargo_length / 2)
             )
             # self.cur_state["self.polygon1"] = self.polygon1
-            self.read_cloud(r)
-        self.rec_good(r, m)
+            self.frames.clear()  # 上一次扫描的帧不参与本次投票 frames of an earlier scan must not vote in this one
+            self.extrinsics = self.load_extrinsics(r)
+            if GoodsAreaDetect.progressive_window:
+                self.set_window(m, [r.loc()['x'], r.loc()['y'], r.loc()['angle']])
+            grid_row = m.GData.grid_row()
+            if grid_row and self.status == MoveStatus.RUNNING:
+                self.goods_from_grid(r, m, grid_row)
+        self.budget.start()
+        self.ticks += 1
+        # 先检测已读完的帧，再用剩余时间读下一帧 detect a finished frame first, then read with the time left
+        if self.frame_ready and self.budget.fits("detect", self.frames.points):
+            t = time.perf_counter()
+            self.frame_ready = False
+            self.rec_good(r, m)
+            self.budget.record("detect", self.frames.points, time.perf_counter() - t)
+        if self.status == MoveStatus.RUNNING and not self.frame_ready:
+            if GoodsAreaDetect.worker:
+                self.poll_frame(r, m)
+            elif self.reading or time.time() - self.frame_time >= GoodsAreaDetect.frame_interval:
+                self.read_cloud(r, m)
+        self.cur_state["ticks"] = self.ticks
         self.cur_state["status"] = self.status
         self.cur_state["take_time"] = time.time() - self.start_time
         a = "Mid360AreaDetect" + str(m.task_id)
         m.report_info[a] = self.cur_state
 
-    def read_cloud(self, r):
-        all_cloud = r.allCameraCloud()["allcloud"]  # 机器人坐标系
-        # self.cur_state["all_cloud"] = all_cloud
-        for i in all_cloud:
-            if i["device"]["device_name"] == "DJI-mid360-TCP":
-                self.nodes = self.nodes + i["cloud"]
-        # self.cur_state["nodes"] = self.nodes
-        if len(self.nodes) > 0:
-            self.node_slice = [self.nodes[i:i + 4000] for i in range(0, len(self.nodes), 4000)]
-        else:
+    def read_cloud(self, r, m):
+        """
+        按每个周期的时间预算分块读取一帧点云，可能跨多个周期
+        read one frame in chunks that fit the per-tick budget, may take several ticks
+        """
+        if not self.reading:
+            all_cloud = r.allCameraCloud()["allcloud"]  # 机器人坐标系
+            self.frame_time = time.time()
+            self.frame_loc = [r.loc()['x'], r.loc()['y'], r.loc()['angle']]
+            # 原地填充，不再拼接列表 filled in place, no list concatenation
+            self.cloud.begin_fill(all_cloud, GoodsAreaDetect.fuse_devices, self.extrinsics)
+            if not self.check_devices(r, self.cloud.devices):
+                return
+            self.cur_state["devices"] = self.cloud.devices
+            self.reading = True
+        while self.cloud.pending:
+            n = self.budget.chunk("read")
+            if n == 0:
+                return
+            t = time.perf_counter()
+            n = self.cloud.fill_step(n)
+            self.budget.record("read", n, time.perf_counter() - t)
+        # 降采样、拟合、入环一次完成，本周期剩余时间不够就下个周期做
+        # downsample, fit and push run together, deferred to the next tick when they do not fit
+        if not self.budget.fits("frame", self.cloud.size):
+            return
+        t = time.perf_counter()
+        self.reading = False
+        self.cur_state["raw_num"] = raw_num = self.cloud.size
+        self.save_scan()
+        if GoodsAreaDetect.auto_fit and self.frame_num == 0:
+            self.fit_container(self.frame_loc, m)
+        # 先裁剪再降采样 crop to the goods first, then downsample
+        self.cur_state["crop_num"] = self.cloud.crop(*self.crop_args(self.frame_loc))
+        self.cur_state["voxel_num"] = self.cloud.voxel_downsample(GoodsAreaDetect.voxel_size)
+        self.xs, self.ys, self.zs = self.cloud.x, self.cloud.y, self.cloud.z
+        self.add_frame()
+        self.budget.record("frame", raw_num, time.perf_counter() - t)
+
+    def scan_args(self):
+        """write_scan 的参数(不含点)，不保存时返回 None write_scan() arguments without the points"""
+        if not GoodsAreaDetect.scan_dir:
+            return None
+        return dict(directory=GoodsAreaDetect.scan_dir, pose=self.frame_loc, stamp=self.frame_time,
+                    compress=GoodsAreaDetect.scan_compress, keep=GoodsAreaDetect.scan_keep)
+
+    def save_scan(self):
+        """
+        原始帧写入诊断目录，周期内只做量化，压缩和写文件在后台线程；上一帧还没写完时丢弃本帧，写失败只记录
+        save the raw frame: quantize on the tick, compress and write in a thread, skip it while the
+        previous write is pending, a failed write is only reported
+        """
+        scan = self.scan_args()
+        if scan is None:
+            return
+        if self.scan_future is not None:
+            if not self.scan_future.done():
+                self.cur_state["scan_skipped"] = self.cur_state.get("scan_skipped", 0) + 1
+                return
+            try:
+                self.cur_state["scan"] = self.scan_future.result()
+            except OSError as e:
+                self.cur_state["scan"] = f"scan not saved: {e}"
+        self.scan_future = mid360_cloud.submit_scan(x=self.cloud.x, y=self.cloud.y, z=self.cloud.z, **scan)
+
+    def load_extrinsics(self, r):
+        """
+        读取 sensor_frame_devices 的外参，标定文件只读一次
+        Returns:
+            {allCameraCloud 设备名: (R, t)}，没有传感器坐标系的设备时返回 None
+        """
+        try:
+            return mid360_cloud.sensor_extrinsics(GoodsAreaDetect.sensor_frame_devices,
+                                                   GoodsAreaDetect.calibration_file)
+        except (OSError, ValueError, KeyError) as e:
+            self.status = MoveStatus.FAILED
+            r.setError(f"标定文件读取失败 cannot load sensor extrinsics: {e}")
+            return None
+
+    def poll_frame(self, r, m):
+        """
+        点云在后台线程/进程中处理，本周期只提交一帧或查询结果
+        the frame is built by a worker, the tick only submits it or polls the future
+        """
+        if self.future is None:
+            if time.time() - self.frame_time < GoodsAreaDetect.frame_interval:
+                return
+            all_cloud = r.allCameraCloud()["allcloud"]  # 机器人坐标系
+            self.frame_time = time.time()
+            self.frame_loc = [r.loc()['x'], r.loc()['y'], r.loc()['angle']]
+            fit_par = None
+            if GoodsAreaDetect.auto_fit and self.frame_num == 0:
+                fit_par = mid360_cloud.snapshot(GoodsAreaDetect)
+            area, polygon, frame = self.crop_args(self.frame_loc)
+            self.future = mid360_cloud.submit_frame(GoodsAreaDetect.worker, all_cloud, GoodsAreaDetect.fuse_devices,
+                                                    GoodsAreaDetect.voxel_size,
+                                                    (mid360_cloud.snapshot(area), polygon, frame), fit_par,
+                                                    self.extrinsics, self.scan_args())
+            return
+        if not self.future.done():
+            return
+        future, self.future = self.future, None
+        try:
+            xyz, fit, devices, crop_num, self.cur_state["scan"] = future.result()
+        except Exception as e:
             self.status = MoveStatus.FAILED
-            r.setError("DJI-mid360-TCP camera has no data")
-            r.logInfo(f"no DJI-mid360-TCP camera")
+            r.setError(f"Mid360 cloud worker failed: {e}")
+            return
+        if not self.check_devices(r, devices):
+            return
+        self.cur_state["devices"] = devices
+        self.cur_state["raw_num"] = sum(devices.values())
+        self.cur_state["crop_num"] = crop_num
+        self.cur_state["voxel_num"] = xyz.shape[1]
+        self.xs, self.ys, self.zs = xyz
+        if GoodsAreaDetect.auto_fit and self.frame_num == 0:
+            self.set_container(fit, self.frame_loc, m)
+        self.add_frame()
+
+    def check_devices(self, r, devices):
+        """
+        fuse_devices 中的每个设备都要有点云，缺少时报错，不在其余相机上检测
+        every fused device must report points, a missing one fails the scan
+        Args:
+            devices: {设备名: 点数} 本帧读到的设备 devices read for this frame
+        """
+        missing = [d for d in GoodsAreaDetect.fuse_devices or () if d not in devices]
+        if devices and not missing:
+            return True
+        name = ", ".join(missing) or "all"
+        self.status = MoveStatus.FAILED
+        r.setError(f"{name} camera has no data")
+        r.logInfo(f"no {name} camera")
+        return False
+
+    def add_frame(self):
+        """当前帧转到里程坐标系存入环形缓存 store the current frame in the ring in odom frame"""
+        self.frames.push(self.xs, self.ys, self.zs, self.frame_loc, self.frame_time)
+        self.frame_num += 1
+        self.frame_ready = True
+
+    def crop_args(self, frame_loc):
+        """
+        当前检测范围，用于裁剪在 frame_loc 采集的一帧 goods region for a frame taken at frame_loc
+        Returns:
+            (area, polygon, frame)，frame 为货箱坐标系相对 frame_loc 的位姿，未拟合时为 None，见 mid360_cloud.goods_crop
+        """
+        frame = RBK.Pos2Base(self.container_loc, frame_loc) if self.container_loc else None
+        slab = self.memory_slab()
+        if slab is None:
+            return self.area, self.polygon1, frame
+        # 窗口前面的一段也要保留，用来检查记忆 keep the slab in front of the window to check the memory
+        a = self.area
+        area = mid360_cloud.SearchArea(slab.x_min, a.x_max, a.y_min, a.y_max, a.z_up, a.z_down)
+        return area, area.polygon(), frame
+
+    def memory_slab(self):
+        """
+        窗口前面、完整检测范围以内的一段，按货箱记忆这里已经取空
+        the slab between the full search volume and the window, emptied according to the container memory
+        """
+        if not self.window or self.area.x_min >= self.base_area.x_min:
+            return None
+        a = self.area
+        return mid360_cloud.SearchArea(self.base_area.x_min, a.x_min, a.y_min, a.y_max, a.z_up, a.z_down)
+
+    def forget_memory(self, m):
+        """
+        窗口前面有货：记忆来自上一个货箱，清掉记忆，本次按完整范围检测
+        goods in front of the window: the memory is from another container, drop it and search the full volume
+        """
+        m.GData.forget_container()
+        if m.operation == "load":
+            m.GData.pallet_count = 1
+            m.GData.touch_container(m.entry_point_id)
+        self.window = None
+        self.area, self.polygon1 = self.base_area, self.base_polygon
+        self.cur_state["window"] = None
+        self.cur_state["stale_memory"] = True
+
+    def fit_container(self, loc, m):
+        """拟合货箱地面和墙面，成功后在货箱坐标系下检测 fit floor and walls, then detect in the container frame"""
+        fit = mid360_cloud.fit_container(self.cloud.x, self.cloud.y, self.cloud.z, GoodsAreaDetect)
+        self.set_container(fit, loc, m)
+
+    def set_container(self, fit, loc, m):
+        """
+        使用拟合结果，None 表示拟合失败保持固定范围；检测窗口在货箱坐标系下按货箱口重新计算
+        apply a fit, None keeps the fixed search volume; the window is recomputed from the fitted door
+        """
+        if fit is None:
+            self.cur_state["container"] = None
+            return
+        self.container_loc = RBK.Pos2World(fit.frame, loc)
+        self.door = fit.door
+        self.area = fit.area
+        self.polygon1 = self.area.polygon()
+        self.window = None
+        if GoodsAreaDetect.progressive_window:
+            self.set_window(m, self.container_loc, fit.area)
+        self.cur_state["container"] = fit.to_dict()
 
     def rec_good(self, r, m):
-        print("rec_good:", self.count_num)
-        if self.count_num != len(self.node_slice):
-            for n in self.node_slice[self.count_num]:
-                if GoodsAreaDetect.z_up > n["z"] > GoodsAreaDetect.z_down and GoodsAreaDetect.x_max < n[
-                    "x"] < GoodsAreaDetect.x_min and GoodsAreaDetect.y_min < n["y"] < GoodsAreaDetect.y_max:
-                    if self.is_point_inside_rectangle((n["x"], n["y"]), self.polygon1):  # 剔除斜坡的点和多余的点
-                        if not self.point:
-                            self.point = [n["x"], n["y"], n["z"]]
-                        else:
-
-                            if abs(n["x"]) < abs(self.point[0]):
-                                self.point = [n["x"], n["y"], n["z"]]
-                        self.point_num += 1
-            self.count_num = self.count_num + 1
+        loc = self.container_loc or [r.loc()['x'], r.loc()['y'], r.loc()['angle']]
+        self.frames.expire(time.time() - GoodsAreaDetect.frame_max_age)
+        # 有货帧数达到 need 即有货；剩余帧全部有货也达不到 need 即无货；否则再采一帧
+        # goods once enough frames agree, empty once the missing frames cannot reach need, else wait a frame
+        total = GoodsAreaDetect.accumulate_frames
+        need = max(1, math.ceil(GoodsAreaDetect.min_confidence * total))
+        slab = self.memory_slab()
+        if slab and self.frames.detect(loc, slab, slab.polygon(), GoodsAreaDetect.min_point_num)[1] >= need:
+            self.forget_memory(m)
+        self.point_num, hits, self.point = self.frames.detect(loc, self.area, self.polygon1,
+                                                              GoodsAreaDetect.min_point_num)
+        self.confidence = hits / max(len(self.frames), 1)
+        self.cur_state["num"] = self.point_num
+        self.cur_state["frames"] = len(self.frames)
+        self.cur_state["confidence"] = self.confidence
+        if hits >= need:
+            # 有货物，输出最近的坐标
+            self.cur_state["has_goods"] = True
+            self.cur_state["good_location"] = [self.point[0], 0, 0]
+            self.cur_state["point"] = self.point
+            m.GData.has_goods = True
+            m.GData.good_location = RBK.Pos2World([self.point[0], 0, 0], loc)
+            face = self.get_front_face(loc)
+            self.cur_state["face"] = face
+            if face:
+                # 正对这一排的中心，识别时能同时看到这一排的栈板 aim at the row centre so Rec sees the whole row
+                face_world = RBK.Pos2World([face["x"], face["y"], 0], loc)
+                m.GData.good_location = face_world
+                m.GData.goods_face = {"x": face_world[0], "y": face_world[1], "yaw": face_world[2],
+                                      "width": face["y_max"] - face["y_min"], "columns": face["columns"]}
+            self.update_grid(m, loc, face)
+            m.task_list.insert(m.task_id, GoToPre(r, 4))
+            r.setGData(m.GData.to_dict())
+            self.status = MoveStatus.FINISHED
+        elif hits + total - len(self.frames) < need:
+            m.GData.has_goods = False
+            self.update_grid(m, loc, None)
+            self.status = MoveStatus.FINISHED
+            r.setGData(m.GData.to_dict())
+            m.task_list.insert(m.task_id, GoToPre(r, 0))
+
+    def update_grid(self, m, loc, face):
+        """
+        按检测结果更新货箱栅格：货物正面之前的各排为空，正面这一排有货；无货时整个检测范围为空
+        Args:
+            loc: 检测所用的坐标系(世界坐标)
+            face: get_front_face() 的结果，None 且有货时用最近的点
+        """
+        if not GoodsAreaDetect.use_grid:
+            return
+        if m.GData.grid is None:
+            m.GData.grid = ContainerGrid.create(RBK.Pos2World([self.entrance(), 0, math.pi], loc), m)
+        grid = m.GData.grid
+        d0 = grid.local(RBK.Pos2World([self.area.x_min, 0, 0], loc))[0]
+        if not m.GData.has_goods:
+            grid.mark_depth(d0, grid.local(RBK.Pos2World([self.area.x_max, 0, 0], loc))[0], ContainerGrid.EMPTY)
         else:
-            # self.cur_state["point"] = self.point
-            self.cur_state["num"] = len(self.point)
-            self.cur_state["num"] = self.point_num
-            # print("符合条件的点:", len(self.point))
-            if self.point_num >= 3:
-                # 有货物，输出最近的坐标
-                self.cur_state["has_goods"] = True
-                self.cur_state["good_location"] = [self.point[0], 0, 0]
-                self.cur_state["point"] = self.point
-                m.GData.has_goods = True
-                loc = [r.loc()['x'], r.loc()['y'], r.loc()['angle']]
-                m.GData.good_location = RBK.Pos2World([self.point[0], 0, 0], loc)
-                m.task_list.insert(m.task_id, GoToPre(r, 4))
-                r.setGData(m.GData.to_dict())
-                self.status = MoveStatus.FINISHED
+            if face:
+                face_world, width = RBK.Pos2World([face["x"], face["y"], 0], loc), face["y_max"] - face["y_min"]
             else:
-                m.GData.has_goods = False
-                self.status = MoveStatus.FINISHED
-                r.setGData(m.GData.to_dict())
-                m.task_list.insert(m.task_id, GoToPre(r, 0))
+                face_world, width = RBK.Pos2World([self.point[0], self.point[1], 0], loc), None
+            grid.mark_depth(d0, grid.local(face_world)[0], ContainerGrid.EMPTY)
+            row = grid.mark_face(face_world, ContainerGrid.GOODS, width)
+            for col in range(grid.cols):
+                if grid.get(row, col) != ContainerGrid.GOODS:
+                    grid.set(row, col, ContainerGrid.EMPTY)
+        self.cur_state["grid"] = "".join(grid.cells)
+
+    def expected_row(self, m, loc):
+        """
+        下一排货物正面在检测坐标系(loc)中的 x，上一托位置优先，其次按 pallet_count 从货箱口推算
+        Returns:
+            x，第一托且没有上一托位置时返回 None
+        """
+        if m.GData.good_location:
+            return RBK.Pos2Base(m.GData.good_location, loc)[0]
+        grid = m.GData.grid
+        cols = grid.cols if grid else max(1, round(m.cargo_length / GoodsAreaDetect.pallet_width))
+        done = max(m.GData.pallet_count - 1, 0)  # 这一托之前已取的托数 pallets taken before this one
+        if done == 0:
+            return None
+        if grid:
+            return RBK.Pos2Base(RBK.Pos2World([grid.face_depth(done // cols), 0, 0], grid.origin), loc)[0]
+        return self.entrance() - done // cols * ContainerGrid.pallet_depth()
+
+    def entrance(self):
+        """货箱口在检测坐标系中的 x，拟合出货箱口时用拟合结果 container door x in the detection frame"""
+        return self.door if self.door is not None else self.ap_loc[0] + self.site_length
+
+    def set_window(self, m, loc, area=GoodsAreaDetect):
+        """
+        只在下一排可能出现的一段内检测 search only the slab where the next row can be
+        Args:
+            loc: 检测坐标系(世界坐标) detection frame
+            area: 要缩小的检测范围，拟合后为货箱坐标系下的范围 search volume to narrow
+        """
+        x_next = self.expected_row(m, loc)
+        if x_next is None:
+            return
+        depth = GoodsAreaDetect.search_rows * ContainerGrid.pallet_depth()
+        self.window = (x_next, depth, GoodsAreaDetect.search_margin)
+        self.base_area, self.base_polygon = area, self.polygon1
+        self.area = mid360_cloud.search_window(area, *self.window)
+        self.polygon1 = self.area.polygon()
+        self.cur_state["window"] = [self.area.x_min, self.area.x_max]
+
+    def goods_from_grid(self, r, m, grid_row):
+        """栅格中已知下一排货物，不再扫描，直接到这一排前 the grid knows the next row, skip the scan"""
+        m.GData.has_goods = True
+        m.GData.good_location = m.GData.grid.row_face(*grid_row)
+        self.cur_state["has_goods"] = True
+        self.cur_state["grid_row"] = grid_row
+        m.task_list.insert(m.task_id, GoToPre(r, 4))
+        r.setGData(m.GData.to_dict())
+        self.status = MoveStatus.FINISHED
+
+    def get_front_face(self, loc):
+        """
+        最近一排货物的正面：距离、横向范围、这一排有几列栈板
+        nearest goods face of the accumulated frames, see mid360_cloud.extract_front_face
+        """
+        xs, ys, zs = self.frames.stack(loc)
+        return mid360_cloud.extract_front_face(xs, ys, zs, self.area, self.polygon1,
+                                               GoodsAreaDetect.face_bin, GoodsAreaDetect.face_depth,
+                                               GoodsAreaDetect.min_point_num, GoodsAreaDetect.pallet_width,
+                                               GoodsAreaDetect.column_gap)
 
-    def is_point_inside_rectangle(self, point, rectangle):
-        """判断一个点是否在矩形内部
+
+class PathGuard:
+    """
+    Live Cloud Path Check
+    Sweep the robot footprint along a planned path and test it against the current camera cloud
+
+    LOG: Returns the first colliding station, so planners can use tight paths and still stop before a hit
+    """
+    cloud = mid360_cloud.CloudBuffer()
+
+    @classmethod
+    def check(cls, r: SimModule, xs, ys, back_mode, into_pallet=False, side_shift=0.0):
+        """
         Args:
-        point: tuple，表示点的坐标，例如(x，y)
-        rectangle: list，表示矩形的四个顶点坐标，例如[(x1，y1)，(x2，y2),(x3，y3)，(x4，y4)
-        return:
-        boo1:表示点是否在矩形内部或者边缘
-        """
-        x, y = point
-        x1, y1 = rectangle[0]
-        x2, y2 = rectangle[1]
-        x3, y3 = rectangle[2]
-        x4, y4 = rectangle[3]
-        # 点在矩形内部的条件是:点的横坐标在矩形的最小横坐标和最大横坐标之间
-        # 点的纵坐标在矩形的最小纵坐标和最大纵坐标之间
-        return min(x1, x2, x3, x4) <= x <= max(x1, x2, x3, x4) and min(y1, y2, y3, y4) <= y <= max(y1, y2, y3, y4)
-
-    def get_latest_point(self):
-        result = []
-        current_streak = 0
-        for i, point in enumerate(self.point):
-            if i == 0:
-                # 处理第一个点，无法与前一个点比较
-                prev_point = None
-            else:
-                prev_point = self.point[i - 1]
-            # 检查当前点和前一点的y值是否相同
-            if point.y != prev_point.y:
-                current_streak = 0
-            else:
-                # 计算x差值，考虑浮点精度问题
-                dx = abs(point.x - prev_point.x)
-                if dx < 0.1:  # 根据实际需求调整阈值
-                    current_streak += 1
-                    # 如果达到或超过50个连续点，则认为是直线提取子数组并添加到result中
-                    if current_streak >= 50:
-                        # 确保子数组包含前50个连续的满足条件的点
-                        line_points = self.point[i - 49:i + 1]
-                        result.append(line_points)
-        return result
+            xs, ys: path in world coordinates
+            back_mode: path driven in back mode, the robot heading is the tangent + pi
+            into_pallet: the forks enter a pallet at the end of the path, its points are not obstacles
+            side_shift: fork side-shift (m, robot y) while driving the path
+        Returns:
+            (path index, [x, y] obstacle point) of the first collision, (-1, None) if free or not checked
+        """
+        if not PathPlanningConfig.collision_check_enabled:
+            return -1, None
+        try:
+            extrinsics = mid360_cloud.sensor_extrinsics(GoodsAreaDetect.sensor_frame_devices,
+                                                        GoodsAreaDetect.calibration_file)
+        except (OSError, ValueError, KeyError) as e:
+            PathPlanningConfig.log(f"Collision check skipped, no extrinsics: {e}", "WARN")
+            return -1, None
+        if cls.cloud.fill(r.allCameraCloud()["allcloud"], GoodsAreaDetect.fuse_devices, extrinsics) == 0:
+            PathPlanningConfig.log(f"Collision check skipped, no camera cloud", "WARN")
+            return -1, None
+
+        # Obstacle points in world, floor and roof removed, then one point per voxel as for goods detection
+        # (the point nearest to the robot in each voxel is kept, so the first collision is not lost)
+        cls.cloud.band(PathPlanningConfig.obstacle_z_min, PathPlanningConfig.obstacle_z_max)
+        cls.cloud.voxel_downsample(GoodsAreaDetect.voxel_size)
+        loc = [r.loc()['x'], r.loc()['y'], r.loc()['angle']]
+        x, y = cls.cloud.x, cls.cloud.y
+        c, s = math.cos(loc[2]), math.sin(loc[2])
+        px = loc[0] + c * x - s * y
+        py = loc[1] + s * x + c * y
+
+        margin = PathPlanningConfig.collision_margin
+        headings = mid360_cloud.path_headings(xs, ys, back_mode)
+        if into_pallet and len(xs):
+            # Pallet behind the forks at the end pose
+            end = [xs[-1], ys[-1], headings[-1]]
+            half = GoodsAreaDetect.pallet_width / 2 + margin
+            keep = ~mid360_cloud.footprint_mask(px, py, end, -PathPlanningConfig.footprint_tail - margin, margin,
+                                                side_shift - half, side_shift + half)
+            px, py = px[keep], py[keep]
+
+        hit, point = mid360_cloud.first_collision(xs, ys, headings, px, py, cls.footprint(side_shift, margin),
+                                                  PathPlanningConfig.collision_step)
+        if hit >= 0:
+            PathPlanningConfig.log(f"Path blocked at point {hit}/{len(xs)}, obstacle X={point[0]:.3f}, "
+                                  f"Y={point[1]:.3f}", "WARN")
+        return hit, point
+
+    @staticmethod
+    def footprint(side_shift=0.0, margin=0.0):
+        """Body and fork rectangles (x_min, x_max, y_min, y_max) in the robot frame, grown by margin"""
+        body_tail = PathPlanningConfig.footprint_tail - PathPlanningConfig.fork_length
+        body = PathPlanningConfig.footprint_width / 2 + margin
+        fork = PathPlanningConfig.fork_width / 2 + margin
+        return [(-body_tail, PathPlanningConfig.footprint_head + margin, -body, body),  # 车身后沿贴托盘面 body meets pallet faces
+                (-PathPlanningConfig.footprint_tail - margin, -body_tail, side_shift - fork, side_shift + fork)]
+
+    @staticmethod
+    def walls(ramp=False):
+        """World Y of the container (or ramp) walls"""
+        half = (PathPlanningConfig.ramp_width if ramp else PathPlanningConfig.container_width) / 2
+        return -half, half
+
+    @classmethod
+    def corridor(cls, xs, ys, back_mode, side_shift=0.0, ramp=False):
+        """
+        Swept footprint against the walls
+        Args:
+            xs, ys, back_mode, side_shift: as check()
+            ramp: the path runs on the ramp, which is narrower than the container
+        Returns:
+            (minimum wall clearance (m), path index where it occurs), (inf, -1) if not checked
+        """
+        if not PathPlanningConfig.corridor_check_enabled or len(xs) == 0:
+            return math.inf, -1
+        headings = mid360_cloud.path_headings(xs, ys, back_mode)
+        gap = path_geometry.corridor_clearance(xs, ys, headings, cls.footprint(side_shift), cls.walls(ramp))
+        i = int(gap.argmin())
+        level = "WARN" if gap[i] < PathPlanningConfig.corridor_min_clearance else "INFO"
+        PathPlanningConfig.log(f"Wall clearance {gap[i]:.3f}m at point {i}/{len(xs)}", level)
+        return float(gap[i]), i
+
+
+class PathSpeed:
+    """
+    Path Speed Profile
+    Speed limits along a script path from curvature, remaining distance and acceleration/jerk bounds
+
+    LOG: setPathMaxSpeed is resent from the robot's progress along the path, so straight parts run at
+    LOG: path_max_speed and only bends, path ends and pallet insertion slow down
+    """
+
+    def __init__(self, xs, ys, into_pallet=False):
+        """
+        Args:
+            xs, ys: the dense planned path in world coordinates
+            into_pallet: the forks enter a pallet at the end, the last insert_slow_dist metres run slow
+        """
+        self.profile = None
+        self.index = 0
+        self.speed = None
+        if not PathPlanningConfig.speed_profile_enabled or len(xs) < 2:
+            return
+        areas = self.map_areas()
+        top = PathPlanningConfig.path_max_speed
+        if areas is not None:
+            top = lambda x, y: areas.speed(x, y, PathPlanningConfig.path_max_speed)
+        self.profile = path_geometry.velocity_profile(
+            xs, ys, top, PathPlanningConfig.path_min_speed,
+            PathPlanningConfig.path_lateral_acc, PathPlanningConfig.path_acc, PathPlanningConfig.path_dec,
+            PathPlanningConfig.path_jerk, PathPlanningConfig.insert_slow_dist if into_pallet else 0.0,
+            tail_speed=PathPlanningConfig.insert_speed)
+        length = self.profile.s[-1]
+        PathPlanningConfig.log(f"  Speed profile: {length:.2f}m in {path_geometry.profile_time(self.profile):.1f}s "
+                              f"(fixed {PathPlanningConfig.path_min_speed}m/s: "
+                              f"{length / PathPlanningConfig.path_min_speed:.1f}s)", "INFO")
+        if areas is not None:
+            for name, props in areas.areas_on(self.profile.x, self.profile.y):
+                PathPlanningConfig.log(f"  Map area {name}: maxspeed={props.get('maxspeed')}, "
+                                      f"virtualLaser={props.get('virtualLaser')}, "
+                                      f"3DCameraObstacle={props.get('3DCameraObstacle')}", "INFO")
+
+    @staticmethod
+    def map_areas():
+        """Area index of map_file, parsed once per file version; None if disabled or unreadable"""
+        if not PathPlanningConfig.map_speed_enabled or not PathPlanningConfig.map_file:
+            return None
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), PathPlanningConfig.map_file)
+        try:
+            return path_geometry.MapAreas.load(path)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            PathPlanningConfig.log(f"Map areas not used, cannot read {path}: {e}", "WARN")
+            return None
+
+    def update(self, r: SimModule):
+        """Set the speed limit for the current position, returns it"""
+        if self.profile is None:
+            v = PathPlanningConfig.path_min_speed
+        else:
+            self.index = path_geometry.progress(self.profile, r.loc()['x'], r.loc()['y'], self.index)
+            v = float(self.profile.v[self.index])
+        # 减速立即下发，加速按 speed_update_step 节流 slow-downs are sent at once, speed-ups throttled
+        if self.speed is None or v < self.speed - 1e-3 or v - self.speed >= PathPlanningConfig.speed_update_step:
+            r.setPathMaxSpeed(v)
+            self.speed = v
+        return v
+
+
+class ForkInsertion:
+    """
+    Fork Insertion Stop
+    Watch DI 16/17 while approaching a pallet, stop on the edge and measure how far the robot went past
+    the expected insertion point (the path end)
+
+    LOG: Checked before goPath each tick, so no path command is sent after the forks are in
+    """
+
+    def __init__(self, r: SimModule, xs, ys):
+        """
+        Args:
+            xs, ys: the approach path in world coordinates, its end is the expected insertion point
+        """
+        self.end = [xs[-1], ys[-1]]
+        dx, dy = xs[-1] - xs[-2], ys[-1] - ys[-2]
+        norm = math.hypot(dx, dy) or 1.0
+        self.direction = [dx / norm, dy / norm]
+        self.started_on = self.last = self.active(r)
+        self.overshoot = None
+        if self.started_on:
+            PathPlanningConfig.log(f"DI 16/17 already on at approach start", "WARN")
+
+    @staticmethod
+    def active(r: SimModule):
+        return any(node['status'] for node in r.Di().get('node', []) if node['id'] in (16, 17))
+
+    def triggered(self, r: SimModule):
+        """True on the tick DI 16/17 turns on, or whenever it is on if it already was at the start"""
+        on = self.active(r)
+        edge = on and not self.last
+        self.last = on
+        return edge or (on and self.started_on)
+
+    def stop(self, r: SimModule):
+        """Stop path following, returns the overshoot along the approach direction (m, negative = short)"""
+        r.resetPath()
+        r.setNextSpeed(json.dumps({"x": 0, "y": 0, "rotate": 0}))
+        loc = r.loc()
+        self.overshoot = ((loc['x'] - self.end[0]) * self.direction[0] +
+                          (loc['y'] - self.end[1]) * self.direction[1])
+        PathPlanningConfig.log(f"Fork insertion detected (DI 16/17), {self.overshoot * 1000:.0f}mm "
+                              f"{'past' if self.overshoot >= 0 else 'before'} the expected insertion point", "INFO")
+        return self.overshoot
 
 
 class BezierRetreat:
@@ -980,6 +1850,7 @@ class BezierRetreat:
         self.init = False
         self.retreat_distance = PathPlanningConfig.retreat_distance
         self.xs, self.ys = [], []
+        self.path_speed = None
         self.target_world = [0, 0, 0]
         self.start_time = None
         self.pallet_pos = None
@@ -1097,6 +1968,18 @@ class BezierRetreat:
         
         PathPlanningConfig.log(f"  Distance: {length:.3f}m", "DEBUG")
         
+        if PathPlanningConfig.planner != "bezier":
+            # Pose-to-pose planner, the retreat keeps the robot heading at both ends
+            heading = self.robot_start_pos[2]
+            try:
+                path = path_geometry.plan_path(PathPlanningConfig.planner, [P0[0], P0[1], heading],
+                                               [P3[0], P3[1], heading], PathPlanningConfig.planner_radius)
+                PathPlanningConfig.log(f"  {PathPlanningConfig.planner} path, max curvature "
+                                      f"{abs(path.curvature).max():.3f}/m", "INFO")
+                return path.x.tolist(), path.y.tolist()
+            except ValueError as e:
+                PathPlanningConfig.log(f"  {PathPlanningConfig.planner} planner failed ({e}), using Bezier", "WARN")
+        
         # Control points design: gentle curve, avoid large turning angles
         # Use retreat_curve_factor to control bend amount
         factor = PathPlanningConfig.retreat_curve_factor
@@ -1111,12 +1994,14 @@ class BezierRetreat:
         PathPlanningConfig.log(f"  Curve factor: {factor}", "DEBUG")
         
         # Generate curve points
-        xs = self._bezier_curve(P0[0], P1[0], P2[0], P3[0])
-        ys = self._bezier_curve(P0[1], P1[1], P2[1], P3[1])
+        curve = path_geometry.cubic_bezier(P0, P1, P2, P3)
+        xs, ys = curve.x.tolist(), curve.y.tolist()
         
         # Verify curve doesn't cause large turns
-        max_angle_change = self._calculate_max_angle_change(xs, ys)
-        PathPlanningConfig.log(f"  Max angle change: {max_angle_change:.1f}°", "INFO")
+        stats = path_geometry.analyze([P0, P1, P2, P3], path=curve)
+        max_angle_change = math.degrees(stats.max_heading_change)
+        PathPlanningConfig.log(f"  Max angle change: {max_angle_change:.1f}°, "
+                              f"min turning radius: {stats.min_radius:.2f}m", "INFO")
         
         if max_angle_change > 45:
             PathPlanningConfig.log(f"  WARNING: Large angle change detected! "
@@ -1124,43 +2009,6 @@ class BezierRetreat:
         
         return xs, ys
     
-    def _bezier_curve(self, p0, p1, p2, p3):
-        """Cubic Bezier curve formula"""
-        return [p0 * (1 - t) ** 3 + 3 * p1 * (1 - t) ** 2 * t + 
-                3 * p2 * (1 - t) * t ** 2 + p3 * t ** 3
-                for t in (i * 0.001 for i in range(1001))]
-    
-    def _calculate_max_angle_change(self, xs, ys):
-        """
-        Calculate maximum angle change in path
-        To verify curve doesn't cause sharp turns
-        """
-        if len(xs) < 3:
-            return 0
-        
-        max_angle = 0
-        step = 50  # Check every 50 points
-        
-        for i in range(step, len(xs) - step, step):
-            # Calculate forward and backward vectors
-            dx1 = xs[i] - xs[i - step]
-            dy1 = ys[i] - ys[i - step]
-            dx2 = xs[i + step] - xs[i]
-            dy2 = ys[i + step] - ys[i]
-            
-            # Calculate angle change
-            angle1 = math.atan2(dy1, dx1)
-            angle2 = math.atan2(dy2, dx2)
-            angle_change = abs(math.degrees(angle2 - angle1))
-            
-            # Normalize to 0-180
-            if angle_change > 180:
-                angle_change = 360 - angle_change
-            
-            max_angle = max(max_angle, angle_change)
-        
-        return max_angle
-    
     def run(self, r: SimModule, m: Module):
         """Execute retreat path"""
         if not self.init:
@@ -1168,16 +2016,30 @@ class BezierRetreat:
             self.start_time = time.time()
             r.resetPath()
             
+            hit, point = PathGuard.check(r, self.xs, self.ys, back_mode=False)
+            if hit >= 0:
+                self.status = MoveStatus.FAILED
+                r.setError(f"Retreat path blocked at point {hit}, obstacle {point}")
+                return
+            gap, i = PathGuard.corridor(self.xs, self.ys, back_mode=False)
+            if gap < PathPlanningConfig.corridor_min_clearance:
+                self.status = MoveStatus.FAILED
+                r.setError(f"Retreat path leaves the container at point {i}, wall clearance {gap:.3f}m")
+                return
+
             # Set path parameters
             r.setPathReachAngle(0.1)
-            r.setPathMaxSpeed(0.1)
+            self.path_speed = PathSpeed(self.xs, self.ys)
+            self.path_speed.update(r)
             r.setPathBackMode(False)  # Forward mode
-            r.setPathOnWorld(self.xs, self.ys, self.target_world[2])
+            xs, ys = path_geometry.sparse_path(self.xs, self.ys, PathPlanningConfig.path_tolerance)
+            r.setPathOnWorld(xs, ys, self.target_world[2])
             
-            PathPlanningConfig.log(f"  Path set, points: {len(self.xs)}", "INFO")
+            PathPlanningConfig.log(f"  Path set, points: {len(xs)}/{len(self.xs)}", "INFO")
             self.init = True
         
         # Execute path
+        self.path_speed.update(r)
         r.goPath()
         
         # Check if finished
@@ -1212,6 +2074,8 @@ class StraightApproachWithSideShift:
         self.target_world = [0, 0, 0]
         self.sideshifter_target = 0
         self.side_motor = None
+        self.path_speed = None
+        self.insertion = None
         self.start_time = None
         self.approach_distance = 0
         self.pallet_pos = None
@@ -1303,7 +2167,6 @@ class StraightApproachWithSideShift:
             
             # Set straight path (backward mode)
             r.setPathBackMode(True)
-            r.setPathMaxSpeed(0.1)
             r.setPathReachDist(0.02)
             r.setPathReachAngle(0.1)
             
@@ -1311,6 +2174,20 @@ class StraightApproachWithSideShift:
             current_pos = [r.loc()['x'], r.loc()['y']]
             xs = [current_pos[0], self.target_world[0]]
             ys = [current_pos[1], self.target_world[1]]
+            hit, point = PathGuard.check(r, xs, ys, back_mode=True, into_pallet=True,
+                                         side_shift=self.sideshifter_target)
+            if hit >= 0:
+                self.status = MoveStatus.FAILED
+                r.setError(f"Approach path blocked, obstacle {point}")
+                return
+            gap, i = PathGuard.corridor(xs, ys, back_mode=True, side_shift=self.sideshifter_target)
+            if gap < PathPlanningConfig.corridor_min_clearance:
+                self.status = MoveStatus.FAILED
+                r.setError(f"Approach path leaves the container, wall clearance {gap:.3f}m")
+                return
+            self.path_speed = PathSpeed(xs, ys, into_pallet=True)
+            self.path_speed.update(r)
+            self.insertion = ForkInsertion(r, xs, ys)
             r.setPathOnWorld(xs, ys, self.target_world[2])
             
             PathPlanningConfig.log(f"  Path set: from ({current_pos[0]:.3f}, {current_pos[1]:.3f}) "
@@ -1330,19 +2207,18 @@ class StraightApproachWithSideShift:
                 return
             self.side_motor.run(r, m, self.sideshifter_target)
         
+        # Check for fork insertion signal before driving on
+        if not self.reatch and self.insertion.triggered(r):
+            self.reatch = True
+            self.insertion.stop(r)
+        
         # Execute straight path
-        if self.status != MoveStatus.FAILED:
+        if self.status != MoveStatus.FAILED and not self.reatch:
+            self.path_speed.update(r)
             r.goPath()
         
-        # Check for fork insertion signal
-        if any(node['status'] for node in r.Di().get('node', [])
-               if node['id'] in (16, 17)):
-            self.reatch = True
-            PathPlanningConfig.log(f"Fork insertion detected (DI 16/17)", "INFO")
-        
         # Completion condition
         if self.reatch:
-            r.resetPath()
             self.status = MoveStatus.FINISHED
             elapsed = time.time() - self.start_time
             current_pos = [r.loc()['x'], r.loc()['y']]
@@ -1362,8 +2238,183 @@ class StraightApproachWithSideShift:
 
 
 
+class CuspPickup:
+    """
+    Single Cusp Pickup
+    Retreat and approach planned as one maneuver: forward onto the pallet lane, one cusp, straight back in
+
+    LOG: The robot only stops at the cusp, where the reverse leg is sent at once. The side-shifter starts with
+    LOG: the forward leg, so it is in place before the forks reach the pallet
+    """
+
+    def __init__(self, r: SimModule):
+        self.status = MoveStatus.NONE
+        self.init = False
+        self.legs = []  # [(xs, ys, back_mode)] 前进段, 倒车段 forward leg, reverse leg
+        self.leg = 0
+        self.path_finished = False  # goPath 报告当前段结束 goPath reported the current leg finished
+        self.cusp_world = [0, 0, 0]
+        self.target_world = [0, 0, 0]
+        self.sideshifter_target = 0
+        self.side_motor = None
+        self.path_speed = None
+        self.insertion = None
+        self.start_time = None
+        self.reatch = False
+
+        PathPlanningConfig.log("CuspPickup initialized", "INFO")
+
+    def calculate_pickup_path(self, pallet_pos, robot_pos):
+        """
+        Plan both legs
+        Args:
+            pallet_pos: [x, y, yaw] pallet position from recognition
+            robot_pos: [x, y, yaw] current robot position
+        Returns:
+            target_world: end of the reverse leg
+            sideshifter_adjustment: side-shift applied while driving
+        """
+        PathPlanningConfig.log(f"Planning single cusp pickup", "INFO")
+        pallet_to_robot = RBK.Pos2Base(pallet_pos, robot_pos)
+
+        # 侧移先补偿, 余量由车体横移 the side-shifter covers what it can, the robot moves sideways for the rest
+        max_shift = PathPlanningConfig.sideshifter_max
+        self.sideshifter_target = max(-max_shift, min(pallet_to_robot[1], max_shift))
+        target = RBK.Pos2World([pallet_to_robot[0] + CubicBezierPar.backDist,
+                                pallet_to_robot[1] - self.sideshifter_target, 0], robot_pos)
+        self.target_world = [target[0], target[1], robot_pos[2]]
+        if not PathPlanningConfig.safe_y_min <= target[1] <= PathPlanningConfig.safe_y_max:
+            PathPlanningConfig.log(f"  Target Y {target[1]:.3f}m outside the safe range "
+                                  f"[{PathPlanningConfig.safe_y_min:.3f}, {PathPlanningConfig.safe_y_max:.3f}]", "WARN")
+
+        # 横移在两段间分配, 取离墙最远者 sideways move split between the legs, the one furthest from the walls
+        splits = PathPlanningConfig.cusp_lateral_splits if PathPlanningConfig.corridor_check_enabled else (1.0,)
+        best = None
+        for split in splits:
+            cusp = RBK.Pos2World([PathPlanningConfig.retreat_distance, split * (pallet_to_robot[1] - self.sideshifter_target), 0],
+                                 robot_pos)
+            cusp = [cusp[0], cusp[1], robot_pos[2]]
+            first, second = self._plan(robot_pos, cusp)
+            gap = min(self._clearance(first, False), self._clearance(second, True)) if len(splits) > 1 else math.inf
+            if best is None or gap > best[0] + 1e-3:
+                best = (gap, split, cusp, first, second)
+        gap, split, self.cusp_world, first, second = best
+        self.legs = [(first.x.tolist(), first.y.tolist(), False), (second.x.tolist(), second.y.tolist(), True)]
+
+        PathPlanningConfig.log(f"  Cusp: X={self.cusp_world[0]:.3f}, Y={self.cusp_world[1]:.3f}, "
+                              f"{split:.0%} of the sideways move before it"
+                              f"{f', wall clearance {gap:.3f}m' if gap < math.inf else ''}", "INFO")
+        PathPlanningConfig.log(f"  Target: X={self.target_world[0]:.3f}, Y={self.target_world[1]:.3f}", "INFO")
+        PathPlanningConfig.log(f"  Side-shift adjustment: {self.sideshifter_target:.3f}m", "INFO")
+        return self.target_world, self.sideshifter_target
+
+    def _plan(self, robot_pos, cusp):
+        """Both legs through cusp with the configured planner, Bezier if it has no path"""
+        try:
+            return path_geometry.cusp_path(robot_pos, cusp, self.target_world, PathPlanningConfig.planner,
+                                           PathPlanningConfig.planner_radius,
+                                           straight_in=PathPlanningConfig.cusp_straight_in)
+        except ValueError as e:
+            PathPlanningConfig.log(f"  {PathPlanningConfig.planner} planner failed ({e}), using Bezier", "WARN")
+            return path_geometry.cusp_path(robot_pos, cusp, self.target_world,
+                                           straight_in=PathPlanningConfig.cusp_straight_in)
+
+    def _clearance(self, leg, back_mode):
+        """Smallest wall clearance of the swept footprint along one leg (m)"""
+        headings = leg.heading + (math.pi if back_mode else 0.0)
+        return float(path_geometry.corridor_clearance(leg.x, leg.y, headings,
+                                                      PathGuard.footprint(self.sideshifter_target),
+                                                      PathGuard.walls()).min())
+
+    def run(self, r: SimModule, m: Module):
+        """Execute forward leg, cusp and reverse leg into the pallet"""
+        if not self.init:
+            PathPlanningConfig.log(f"Starting single cusp pickup", "INFO")
+            self.start_time = time.time()
+            r.resetPath()
+            if not self._check(r):
+                self.status = MoveStatus.FAILED
+                return
+            self.side_motor = ForkMotor(r, MotorName.side, self.sideshifter_target, 0.5)
+            r.setPathReachAngle(0.1)
+            self._set_leg(r, 0)
+            self.init = True
+
+        # 侧移与行驶并行 side-shifter moves while driving
+        if PathPlanningConfig.dynamic_sideshifter_enabled:
+            if self.side_motor.status == MoveStatus.FAILED:
+                self.status = MoveStatus.FAILED
+                PathPlanningConfig.log(f"Side-shifter failed!", "ERROR")
+                return
+            self.side_motor.run(r, m, self.sideshifter_target)
+
+        if self.leg == 0:
+            loc = r.loc()
+            miss = math.hypot(loc['x'] - self.cusp_world[0], loc['y'] - self.cusp_world[1])
+            if self.path_finished and miss > PathPlanningConfig.cusp_reach_dist:
+                self.status = MoveStatus.FAILED
+                r.setError(f"Forward leg ended {miss:.3f}m from the cusp, more than {PathPlanningConfig.cusp_reach_dist}m")
+                return
+            if self.path_finished or miss < PathPlanningConfig.cusp_reach_dist:
+                PathPlanningConfig.log(f"Cusp reached after {time.time() - self.start_time:.2f}s, "
+                                      f"reversing into the pallet", "INFO")
+                r.resetPath()
+                self._set_leg(r, 1)
+        elif not self.reatch and self.insertion.triggered(r):
+            self.reatch = True
+            self.insertion.stop(r)
+
+        if self.reatch:
+            self.status = MoveStatus.FINISHED
+            PathPlanningConfig.log(f"Single cusp pickup finished, time: {time.time() - self.start_time:.2f}s", "INFO")
+            PathPlanningConfig.log(f"  Final pos: X={r.loc()['x']:.3f}, Y={r.loc()['y']:.3f}", "INFO")
+            return
+        self.path_speed.update(r)
+        self.path_finished = r.goPath() == MoveStatus.FINISHED
+        self.status = MoveStatus.RUNNING
+
+    def _check(self, r: SimModule):
+        """Both legs against the live cloud and the container walls before moving"""
+        for i, (xs, ys, back_mode) in enumerate(self.legs):
+            name = ("Forward leg", "Approach leg")[i]
+            hit, point = PathGuard.check(r, xs, ys, back_mode, into_pallet=i == 1, side_shift=self.sideshifter_target)
+            if hit >= 0:
+                r.setError(f"{name} blocked at point {hit}, obstacle {point}")
+                return False
+            gap, j = PathGuard.corridor(xs, ys, back_mode, side_shift=self.sideshifter_target)
+            if gap < PathPlanningConfig.corridor_min_clearance:
+                r.setError(f"{name} leaves the container at point {j}, wall clearance {gap:.3f}m")
+                return False
+        return True
+
+    def _set_leg(self, r: SimModule, leg):
+        """Send one leg as the current path"""
+        xs, ys, back_mode = self.legs[leg]
+        self.leg = leg
+        self.path_finished = False
+        self.path_speed = PathSpeed(xs, ys, into_pallet=leg == 1)
+        self.path_speed.update(r)
+        if leg == 0:
+            # 到点距离不大于 cusp_reach_dist，停下时一定能换向 the leg cannot end outside cusp_reach_dist
+            r.setPathReachDist(min(GOPAthPar.reachDist, PathPlanningConfig.cusp_reach_dist))
+        if leg == 1:
+            self.insertion = ForkInsertion(r, xs, ys)
+            r.setPathReachDist(0.02)
+        r.setPathBackMode(back_mode)
+        sparse_xs, sparse_ys = path_geometry.sparse_path(xs, ys, PathPlanningConfig.path_tolerance)
+        r.setPathOnWorld(sparse_xs, sparse_ys, (self.target_world if leg else self.cusp_world)[2])
+        PathPlanningConfig.log(f"  Leg {leg + 1}/2 set ({'back' if back_mode else 'forward'}), "
+                              f"points: {len(sparse_xs)}/{len(xs)}", "INFO")
+
+    def reset(self, r: SimModule):
+        self.status = MoveStatus.RUNNING
+
+
 class CubicBezier2Load:
     """3阶贝塞尔曲线进叉取货"""
+    curve_cache = path_geometry.CurveCache(
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), CubicBezierPar.cache_file)
+        if CubicBezierPar.cache_file else "", CubicBezierPar.cache_size, CubicBezierPar.cache_grid)
 
     def __init__(self, r: SimModule):
         self.status = MoveStatus.NONE
@@ -1377,13 +2428,16 @@ class CubicBezier2Load:
         self.target_world = [0, 0, 0]
         self.control_point = None
         self.xs, self.ys = [], []  # 添加贝塞尔曲线点集存储
+        self.path_speed = None  # 按进度限速 speed limit by progress
+        self.insertion = None  # 进叉到位检测 fork insertion stop
         
         # 新路径规划相关 New path planning related
         self.pallet_number = 0  # 托盘编号 Pallet number
         self.use_new_logic = False  # 是否使用新逻辑 Whether to use new logic
         self.retreat_phase = None  # 后退阶段 Retreat phase
         self.approach_phase = None  # 接近阶段 Approach phase
-        self.current_phase = "none"  # 当前阶段 Current phase: none, retreat, approach, old_logic
+        self.cusp_phase = None  # 单次换向取货 Single cusp pickup
+        self.current_phase = "none"  # 当前阶段 Current phase: none, retreat, approach, cusp, old_logic
         
         PathPlanningConfig.log("CubicBezier2Load 初始化 initialized", "INFO")
 
@@ -1427,20 +2481,40 @@ class CubicBezier2Load:
         self.target_world = RBK.Pos2World(target_local, loc_robot)
 
         # 生成贝塞尔曲线
-        curve_params = self._get_curve_params(pallet_to_lm)
         P0, P3 = loc_robot[:2], self.target_world[:2]
-        self.xs, self.ys, self.control_point = self._generate_bezier_curve(P0, P3, curve_params)
+        path = self._planned_curve(P0, P3)
+        if path is not None:
+            self.xs, self.ys, self.control_point = path.x.tolist(), path.y.tolist(), None
+            curve_params = {"planner": PathPlanningConfig.planner}
+        else:
+            curve_params = self._optimize_curve_params(P0, P3, pallet_to_lm)
+            self.xs, self.ys, self.control_point = self._generate_bezier_curve(P0, P3, curve_params)
+
+        # 实时点云检查路径 check the curve against the live cloud
+        hit, point = PathGuard.check(r, self.xs, self.ys, back_mode=True, into_pallet=True, side_shift=self.side)
+        if hit >= 0:
+            self.status = MoveStatus.FAILED
+            r.setError(f"取货曲线第 {hit} 点会碰到障碍物 pickup path blocked, obstacle {point}")
+            return
+        gap, i = PathGuard.corridor(self.xs, self.ys, back_mode=True, side_shift=self.side, ramp=self._on_ramp())
+        if gap < PathPlanningConfig.corridor_min_clearance:
+            self.status = MoveStatus.FAILED
+            r.setError(f"取货曲线第 {i} 点车体离墙 {gap:.3f}m pickup path leaves the container, wall clearance {gap:.3f}m")
+            return
 
         # 设置路径参数 - 修复：添加缺失的路径设置
         r.setPathReachAngle(0.1)
-        r.setPathMaxSpeed(0.1)
+        self.path_speed = PathSpeed(self.xs, self.ys, into_pallet=True)
+        self.path_speed.update(r)
+        self.insertion = ForkInsertion(r, self.xs, self.ys)
         r.setPathBackMode(True)
-        r.setPathOnWorld(self.xs, self.ys, self.target_world[2])  # 修复：设置贝塞尔曲线路径
+        xs, ys = path_geometry.sparse_path(self.xs, self.ys, PathPlanningConfig.path_tolerance)
+        r.setPathOnWorld(xs, ys, self.target_world[2])  # 修复：设置贝塞尔曲线路径
 
         self.C_msg = {
             # "栈板坐标": pallet_pos, "栈板2机器人": pallet_to_lm,
             "target_world": self.target_world, "control_point": self.control_point,
-            # **curve_params
+            **curve_params
         }
         self.init = True
 
@@ -1464,27 +2538,102 @@ class CubicBezier2Load:
             "c_extend_factor": CubicBezierPar.extend_factor
         }
 
+    def _planned_curve(self, P0, P3):
+        """
+        PathPlanningConfig.planner 不是 bezier 时按位姿规划，失败返回 None 用贝塞尔
+        pose-to-pose path of the selected planner, None keeps the Bezier
+        """
+        if PathPlanningConfig.planner == "bezier" or P0 == P3:
+            return None
+        heading = self.target_world[2] + math.pi  # 倒车进叉，行驶方向与车头相反 backing in, travel = heading + pi
+        try:
+            path = path_geometry.plan_path(PathPlanningConfig.planner, [P0[0], P0[1], heading],
+                                           [P3[0], P3[1], heading], PathPlanningConfig.planner_radius)
+        except ValueError as e:
+            PathPlanningConfig.log(f"{PathPlanningConfig.planner} 规划失败，使用贝塞尔 planner failed ({e}), "
+                                  f"using Bezier", "WARN")
+            return None
+        PathPlanningConfig.log(f"{PathPlanningConfig.planner} 曲线 path, max curvature "
+                              f"{abs(path.curvature).max():.3f}/m", "INFO")
+        return path
+
+    def _optimize_curve_params(self, P0, P3, pallet_to_robot):
+        """
+        按当前栈板偏移搜索曲线参数，居中取货或关闭 optimize 时返回 _get_curve_params
+        search t/d for the current pallet offset, the hand-tuned setting is scored first as the fallback
+        """
+        params = self._get_curve_params(pallet_to_robot)
+        if not CubicBezierPar.optimize or params["d"] == 0 or P0 == P3:
+            return params
+        extend = params["c_extend_factor"]
+        sign = 1 if params["d"] > 0 else -1
+        steps = CubicBezierPar.opt_steps
+        t_grid = [CubicBezierPar.opt_t[0] + (CubicBezierPar.opt_t[1] - CubicBezierPar.opt_t[0]) * i / (steps - 1)
+                  for i in range(steps)]
+        d_grid = [CubicBezierPar.opt_d[0] + (CubicBezierPar.opt_d[1] - CubicBezierPar.opt_d[0]) * i / (steps - 1)
+                  for i in range(steps)]
+        ts = [params["t"]] + [t for t in t_grid for _ in d_grid]
+        ds = [params["d"]] + [sign * d for _ in t_grid for d in d_grid]
+        if PathPlanningConfig.corridor_check_enabled:
+            # 整车轮廓对墙，而不是只限制车体中心 whole footprint against the walls, not just the centre
+            low, high = PathGuard.walls(self._on_ramp())
+            y_band = (low + PathPlanningConfig.corridor_min_clearance, high - PathPlanningConfig.corridor_min_clearance)
+            footprint = PathGuard.footprint(self.side)
+        else:
+            y_band = (min(PathPlanningConfig.safe_y_min, P0[1], P3[1]), max(PathPlanningConfig.safe_y_max, P0[1], P3[1]))
+            footprint = None
+
+        def search(ts, ds):
+            return path_geometry.search_offset_curve(
+                P0, P3, ts, [d * extend for d in ds], y_band, CubicBezierPar.min_radius, GOPAthPar.max_speed,
+                CubicBezierPar.lateral_acc, self.target_world[2] + math.pi, math.radians(CubicBezierPar.heading_tol),
+                CubicBezierPar.opt_samples, CubicBezierPar.opt_budget, footprint=footprint, reverse=True)
+
+        # 相近的相对位置复用上次的搜索结果 reuse the result found for a nearby relative pose
+        key = self.curve_cache.key(self._cache_params(), pallet_to_robot[0], pallet_to_robot[1], P0[1])
+        cached = self.curve_cache.get(key)
+        if cached is not None:
+            best, info, _ = search([cached["t"]], [cached["d"]])
+            if best == 0:
+                PathPlanningConfig.log(f"曲线参数缓存命中 cached curve t={cached['t']:.3f}, d={cached['d']:.3f}, "
+                                      f"{info['length']:.2f}m, {info['time']:.1f}s", "INFO")
+                return {"t": cached["t"], "d": cached["d"], "c_extend_factor": extend}
+            self.curve_cache.discard(key)
+
+        best, info, scored = search(ts, ds)
+        if best < 0:
+            PathPlanningConfig.log(f"曲线参数搜索无可行解，使用固定参数 no feasible curve in {scored} candidates, "
+                                  f"using t={params['t']}, d={params['d']}", "WARN")
+            return params
+        PathPlanningConfig.log(f"曲线参数 curve t={ts[best]:.3f}, d={ds[best]:.3f}, {info['length']:.2f}m, "
+                              f"{info['time']:.1f}s, min radius {info['radius']:.2f}m, clearance {info['clearance']:.3f}m "
+                              f"({scored} candidates)", "INFO")
+        if not self.curve_cache.put(key, {"t": ts[best], "d": ds[best]}):
+            PathPlanningConfig.log(f"曲线缓存写入失败 could not write {self.curve_cache.path}", "WARN")
+        return {"t": ts[best], "d": ds[best], "c_extend_factor": extend}
+
+    def _cache_params(self):
+        """曲线搜索结果依赖的全部参数 every setting the searched curve depends on"""
+        return ([getattr(CubicBezierPar, k) for k in ("t", "d_l", "d_r", "extend_factor", "odo_2_pallet_dist", "backDist",
+                                                       "opt_t", "opt_d", "opt_steps", "opt_samples", "min_radius",
+                                                       "heading_tol", "lateral_acc")],
+                [getattr(PathPlanningConfig, k) for k in ("safe_y_min", "safe_y_max", "corridor_check_enabled",
+                                                           "corridor_min_clearance", "container_width", "ramp_width",
+                                                           "footprint_head", "footprint_tail", "footprint_width",
+                                                           "fork_length", "fork_width")],
+                GOPAthPar.max_speed, self._on_ramp())
+
     def _generate_bezier_curve(self, P0, P3, params):
         p1, p2 = self._compute_control_points(P0, P3, params)
-        xs = self._bezier_curve(P0[0], p1[0], p2[0], P3[0])
-        ys = self._bezier_curve(P0[1], p1[1], p2[1], P3[1])
-        return xs, ys, [P0, p1, p2, P3]
+        curve = path_geometry.cubic_bezier(P0, p1, p2, P3)
+        return curve.x.tolist(), curve.y.tolist(), [P0, p1, p2, P3]
 
     def _compute_control_points(self, P0, P3, params):
         dx, dy = P3[0] - P0[0], P3[1] - P0[1]
         length = math.hypot(dx, dy)
         if length == 0: return P0, P3
-        u_perp = [-dy / length, dx / length]
-        extend = params["c_extend_factor"]
-        P1_base = [P0[0] + dx * (0.5 - params["t"]), P0[1] + dy * (0.5 - params["t"])]
-        P2_base = [P3[0] - dx * (0.5 - params["t"]), P3[1] - dy * (0.5 - params["t"])]
-        P1 = [P1_base[0] + params["d"] * u_perp[0] * extend, P1_base[1] + params["d"] * u_perp[1] * extend]
-        P2 = [P2_base[0] - params["d"] * u_perp[0] * extend, P2_base[1] - params["d"] * u_perp[1] * extend]
-        return P1, P2
-
-    def _bezier_curve(self, p0, p1, p2, p3):
-        return [p0 * (1 - t) ** 3 + 3 * p1 * (1 - t) ** 2 * t + 3 * p2 * (1 - t) * t ** 2 + p3 * t ** 3
-                for t in (i * 0.001 for i in range(1001))]
+        ctrl = path_geometry.offset_controls(P0, P3, params["t"], params["d"] * params["c_extend_factor"])
+        return ctrl[1].tolist(), ctrl[2].tolist()
 
     def _execute_movement(self, r: SimModule, m: Module):
         if not self.init: return
@@ -1494,15 +2643,15 @@ class CubicBezier2Load:
                 self.status = MoveStatus.FAILED
                 return
             self.side_motor.run(r, m, self.side)
+        # 先检测到位信号，到位后不再下发路径 check DI 16/17 before driving on
+        if not self.reatch and self.insertion.triggered(r):
+            self.reatch = True
+            self.C_msg["overshoot"] = self.insertion.stop(r)
         # 执行路径跟踪
-        if self.status != MoveStatus.FAILED:
+        if self.status != MoveStatus.FAILED and not self.reatch:
+            self.path_speed.update(r)
             r.goPath()
-        # 检测到位信号
-        if any(node['status'] for node in r.Di().get('node', [])
-               if node['id'] in (16, 17)):
-            self.reatch = True
         if self.reatch:
-            r.resetPath()
             self.status = MoveStatus.FINISHED
             m.GData.currentPoint_switch_nextPoint()
             r.setGData(m.GData.to_dict())
@@ -1534,7 +2683,11 @@ class CubicBezier2Load:
         PathPlanningConfig.log(f"使用逻辑 Logic: {'新逻辑 NEW (后退+直线) (retreat+straight)' if self.use_new_logic else '旧逻辑 OLD (贝塞尔取货) (Bezier pickup)'}", "INFO")
         PathPlanningConfig.log(f"=" * 60, "INFO")
         
-        if self.use_new_logic:
+        if self.use_new_logic and PathPlanningConfig.cusp_pickup_enabled:
+            self.current_phase = "cusp"
+            PathPlanningConfig.log(f"开始新逻辑流程 Starting new logic flow", "INFO")
+            PathPlanningConfig.log(f"  前进-换向-倒车进叉 Forward, cusp, reverse into pallet", "INFO")
+        elif self.use_new_logic:
             self.current_phase = "retreat"
             PathPlanningConfig.log(f"开始新逻辑流程 Starting new logic flow", "INFO")
             PathPlanningConfig.log(f"  阶段1: 后退 Phase 1: Retreat", "INFO")
@@ -1543,6 +2696,10 @@ class CubicBezier2Load:
             self.current_phase = "old_logic"
             PathPlanningConfig.log(f"使用旧逻辑（贝塞尔取货）Using old logic (Bezier pickup)", "INFO")
     
+    def _on_ramp(self):
+        """前 N 个托盘在斜坡上取 the first N pallets are picked from the ramp"""
+        return self.pallet_number <= PathPlanningConfig.first_n_pallets_use_old_logic
+
     def _get_pallet_number(self, m: Module):
         """
         获取当前托盘编号 Get current pallet number
@@ -1558,13 +2715,31 @@ class CubicBezier2Load:
     def _execute_new_logic(self, r: SimModule, m: Module):
         """
         执行新路径规划逻辑 Execute new path planning logic
-        流程 Flow: 后退 Retreat -> 直线接近 Straight approach
+        流程 Flow: 后退 Retreat -> 直线接近 Straight approach, 或单次换向 or one cusp maneuver
         """
         if not self.init:
             PathPlanningConfig.log(f"初始化新逻辑 Initializing new logic", "INFO")
+            self.start_time = time.time()
             self._initialize_new_logic(r, m)
             self.init = True
         
+        # 单次换向 Single cusp: 前进段与倒车段连续 forward and reverse leg back to back
+        if self.current_phase == "cusp":
+            self.cusp_phase.run(r, m)
+            
+            if self.cusp_phase.status == MoveStatus.FINISHED:
+                self.status = MoveStatus.FINISHED
+                self.C_msg = {"overshoot": self.cusp_phase.insertion.overshoot}
+                m.GData.currentPoint_switch_nextPoint()
+                r.setGData(m.GData.to_dict())
+                PathPlanningConfig.log(f"换向取货完成 Cusp pickup finished, switched to next pallet", "INFO")
+            elif self.cusp_phase.status == MoveStatus.FAILED:
+                self.status = MoveStatus.FAILED
+                PathPlanningConfig.log(f"换向取货失败 Cusp pickup failed!", "ERROR")
+            else:
+                self.status = MoveStatus.RUNNING
+            return
+        
         # 阶段1: 后退 Phase 1: Retreat
         if self.current_phase == "retreat":
             if self.retreat_phase.status == MoveStatus.NONE:
@@ -1612,6 +2787,13 @@ class CubicBezier2Load:
         pallet_pos = [current_point['x'], current_point['y'], current_point['yaw']]
         robot_pos = [r.loc()['x'], r.loc()['y'], r.loc()['angle']]
         
+        if self.current_phase == "cusp":
+            # 一次规划两段 both legs planned at once
+            self.cusp_phase = CuspPickup(r)
+            self.cusp_phase.calculate_pickup_path(pallet_pos, robot_pos)
+            PathPlanningConfig.log(f"换向取货已初始化 Cusp pickup initialized", "INFO")
+            return
+        
         # 创建并初始化后退阶段 Create and initialize retreat phase
         self.retreat_phase = BezierRetreat(r)
         xs, ys, target = self.retreat_phase.calculate_retreat_path(pallet_pos, robot_pos)
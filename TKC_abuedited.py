@@ -4,6 +4,9 @@ from rbkSim import SimModule
 from datetime import datetime
 from robot import ModuleTool
 import math, time, json, goPath
+import numpy as np
+import mid360_cloud
+import path_geometry
 
 # Version:20251106-1
 """
@@ -78,6 +81,18 @@ class GoodsAreaDetect:
     z_up = 0.6                      #0.5
     z_down = 0.25                   #0.25
     """
+    Sensor fusion: clouds of the fuse_devices are merged into one frame, only the mid360 by default.
+    Check a device's allCameraCloud frame before adding it. Robot-frame devices are added as they are,
+    sensor-frame devices also go in sensor_frame_devices {allCameraCloud name: calibration name} and are moved
+    to the robot frame with the extrinsics (x, y, z, roll, pitch, yaw in degrees) of calibration_file,
+    e.g. {"VZense-TCP": "palletCamera"}. None takes every device in allCameraCloud, pallet camera included
+    """
+    fuse_devices = ("DJI-mid360-TCP",)
+    sensor_frame_devices = {}
+    calibration_file = "robot_calibrationfile.cp"
+    """pallet_width: Pallet width, same as pallet_width in p0001.palletobject"""
+    pallet_width = 1.1
+    """
     goods_pre_dist: After 360 detection, move robot to maintain distance from goods, default 3m.
     Adjust based on actual conditions: camera should be able to recognize pallet.
     If >3.5m may not recognize, if <1m may not recognize.
@@ -191,6 +206,46 @@ class PathPlanningConfig:
     ramp_center_scan_point = None       # Center point of ramp for scanning (will be set from map)
                                         # LOG: Robot scans at ramp center, then aligns to ramp width
     
+    # ============ Planner ============
+    planner = "bezier"                  # Curve family of the forward retreat: "bezier", "clothoid" or "dubins"
+                                        # LOG: bezier keeps the rotation-limited cubic, planner_bench.py compares them
+                                        # LOG: An unsolvable pose pair falls back to bezier
+    planner_radius = 1.5                # Turning radius of the dubins planner (m)
+
+    # ============ Single Cusp Pickup ============
+    cusp_pickup_enabled = True          # PrecisePalletPickup drives retreat and approach as one maneuver with one cusp
+                                        # LOG: No lateral alignment stop, the side-shifter moves during both legs
+                                        # LOG: False: forward retreat, lateral align, straight approach
+    cusp_reach_dist = 0.05              # Distance to the cusp that starts the approach leg (m)
+    cusp_lateral_splits = (1.0, 0.75, 0.5, 0.25, 0.0)  # Share of the sideways move done on the retreat leg
+                                        # LOG: The split with the most wall clearance is driven, a short retreat
+                                        # LOG: leg cannot turn much in the container. (1.0,) = align fully, then straight in
+    cusp_straight_in = 1.0              # Straight run into the pallet at the end of the approach leg (m)
+
+    # ============ Path Upload ============
+    path_tolerance = 0.002              # Max lateral error of the uploaded path from the planned curve (m)
+                                        # LOG: Curves are thinned to the fewest points within this bound before
+                                        # LOG: setPathOnWorld, straight parts need 2 points. 0 sends every point
+
+    # ============ Live Collision Check ============
+    collision_check_enabled = True      # Check planned paths against the live camera cloud before sending them
+                                        # LOG: A blocked path fails the task at planning time instead of driving into it
+    footprint_head = 1.79               # Footprint on the body side of odom centre (m), devicemodel chassis head
+    footprint_tail = 1.6                # Footprint on the fork side of odom centre incl. forks (m), devicemodel chassis tail
+    footprint_width = 1.263             # Body width (m), devicemodel chassis width
+    fork_length = 1.15                  # Outer part of the fork side that is forks only (m)
+    fork_width = 1.0                    # Outer fork width (m), devicemodel fork width
+                                        # LOG: Footprint is mirrored with forks_at_front
+    collision_margin = 0.05             # Clearance added around the footprint (m)
+    obstacle_z_min = 0.1                # Cloud points between these heights are obstacles (m)
+    obstacle_z_max = 2.2                # LOG: below is floor, above is container roof
+    collision_step = 0.05               # Footprint station spacing along the path (m)
+
+    # ============ Corridor Check ============
+    corridor_check_enabled = not outside_testing_mode  # Sweep the footprint along planned paths against the walls
+                                        # LOG: Walls at +-container_width/2 around world Y=0, off outside (no walls)
+    corridor_min_clearance = 0.02       # Minimum gap between the swept footprint and a wall (m)
+
     # ============ Debug Parameters ============
     verbose_logging = True              # Verbose logging output
                                         # LOG: Set to True to see detailed path planning logs
@@ -1204,12 +1259,14 @@ class BezierRetreat:
         PathPlanningConfig.log(f"  Curve factor: {factor}", "DEBUG")
         
         # Generate curve points
-        xs = self._bezier_curve(P0[0], P1[0], P2[0], P3[0])
-        ys = self._bezier_curve(P0[1], P1[1], P2[1], P3[1])
+        curve = path_geometry.cubic_bezier(P0, P1, P2, P3)
+        xs, ys = curve.x.tolist(), curve.y.tolist()
         
         # Verify curve doesn't cause large turns
-        max_angle_change = self._calculate_max_angle_change(xs, ys)
-        PathPlanningConfig.log(f"  Max angle change: {max_angle_change:.1f}°", "INFO")
+        stats = path_geometry.analyze([P0, P1, P2, P3], path=curve)
+        max_angle_change = math.degrees(stats.max_heading_change)
+        PathPlanningConfig.log(f"  Max angle change: {max_angle_change:.1f}°, "
+                              f"min turning radius: {stats.min_radius:.2f}m", "INFO")
         
         if max_angle_change > 45:
             PathPlanningConfig.log(f"  WARNING: Large angle change detected! "
@@ -1217,43 +1274,6 @@ class BezierRetreat:
         
         return xs, ys
     
-    def _bezier_curve(self, p0, p1, p2, p3):
-        """Cubic Bezier curve formula"""
-        return [p0 * (1 - t) ** 3 + 3 * p1 * (1 - t) ** 2 * t + 
-                3 * p2 * (1 - t) * t ** 2 + p3 * t ** 3
-                for t in (i * 0.001 for i in range(1001))]
-    
-    def _calculate_max_angle_change(self, xs, ys):
-        """
-        Calculate maximum angle change in path
-        To verify curve doesn't cause sharp turns
-        """
-        if len(xs) < 3:
-            return 0
-        
-        max_angle = 0
-        step = 50  # Check every 50 points
-        
-        for i in range(step, len(xs) - step, step):
-            # Calculate forward and backward vectors
-            dx1 = xs[i] - xs[i - step]
-            dy1 = ys[i] - ys[i - step]
-            dx2 = xs[i + step] - xs[i]
-            dy2 = ys[i + step] - ys[i]
-            
-            # Calculate angle change
-            angle1 = math.atan2(dy1, dx1)
-            angle2 = math.atan2(dy2, dx2)
-            angle_change = abs(math.degrees(angle2 - angle1))
-            
-            # Normalize to 0-180
-            if angle_change > 180:
-                angle_change = 360 - angle_change
-            
-            max_angle = max(max_angle, angle_change)
-        
-        return max_angle
-    
     def run(self, r: SimModule, m: Module):
         """Execute retreat path"""
         if not self.init:
@@ -1265,9 +1285,10 @@ class BezierRetreat:
             r.setPathReachAngle(0.1)
             r.setPathMaxSpeed(0.1)
             r.setPathBackMode(False)  # Forward mode
-            r.setPathOnWorld(self.xs, self.ys, self.target_world[2])
+            xs, ys = path_geometry.sparse_path(self.xs, self.ys, PathPlanningConfig.path_tolerance)
+            r.setPathOnWorld(xs, ys, self.target_world[2])
             
-            PathPlanningConfig.log(f"  Path set, points: {len(self.xs)}", "INFO")
+            PathPlanningConfig.log(f"  Path set, points: {len(xs)}/{len(self.xs)}", "INFO")
             self.init = True
         
         # Execute path
@@ -1413,6 +1434,18 @@ class StraightApproachWithSideShift:
             current_pos = [r.loc()['x'], r.loc()['y']]
             xs = [current_pos[0], self.target_world[0]]
             ys = [current_pos[1], self.target_world[1]]
+            hit, point = PathGuard.check(r, xs, ys, not PathPlanningConfig.forks_at_front, into_pallet=True,
+                                         side_shift=PathGuard.shift_left(self.sideshifter_target))
+            if hit >= 0:
+                self.status = MoveStatus.FAILED
+                r.setError(f"Approach path blocked, obstacle {point}")
+                return
+            gap, i = PathGuard.corridor(xs, ys, not PathPlanningConfig.forks_at_front,
+                                        side_shift=PathGuard.shift_left(self.sideshifter_target))
+            if gap < PathPlanningConfig.corridor_min_clearance:
+                self.status = MoveStatus.FAILED
+                r.setError(f"Approach path leaves the container, wall clearance {gap:.3f}m")
+                return
             r.setPathOnWorld(xs, ys, self.target_world[2])
             
             distance = math.hypot(xs[1] - xs[0], ys[1] - ys[0])
@@ -1484,6 +1517,102 @@ class StraightApproachWithSideShift:
         self.status = MoveStatus.RUNNING
 
 
+class PathGuard:
+    """
+    Live Cloud Path Check
+    Sweep the robot footprint along a planned path and test it against the current camera cloud
+
+    LOG: Returns the first colliding station, so planners can use tight paths and still stop before a hit
+    """
+    cloud = mid360_cloud.CloudBuffer()
+
+    @staticmethod
+    def fork_side(x0, x1):
+        """Footprint x range (fork side negative) in the robot frame, mirrored when the forks are at the front"""
+        return (-x1, -x0) if PathPlanningConfig.forks_at_front else (x0, x1)
+
+    @classmethod
+    def check(cls, r: SimModule, xs, ys, back_mode, into_pallet=False, side_shift=0.0):
+        """
+        Args:
+            xs, ys: path in world coordinates
+            back_mode: path driven in back mode, the robot heading is the tangent + pi
+            into_pallet: the forks enter a pallet at the end of the path, its points are not obstacles
+            side_shift: fork side-shift (m, robot y, left positive) while driving the path
+        Returns:
+            (path index, [x, y] obstacle point) of the first collision, (-1, None) if free or not checked
+        """
+        if not PathPlanningConfig.collision_check_enabled:
+            return -1, None
+        try:
+            extrinsics = mid360_cloud.sensor_extrinsics(GoodsAreaDetect.sensor_frame_devices,
+                                                        GoodsAreaDetect.calibration_file)
+        except (OSError, ValueError, KeyError) as e:
+            PathPlanningConfig.log(f"Collision check skipped, no extrinsics: {e}", "WARN")
+            return -1, None
+        if cls.cloud.fill(r.allCameraCloud()["allcloud"], GoodsAreaDetect.fuse_devices, extrinsics) == 0:
+            PathPlanningConfig.log(f"Collision check skipped, no camera cloud", "WARN")
+            return -1, None
+
+        # Obstacle points in world, floor and roof removed
+        loc = [r.loc()['x'], r.loc()['y'], r.loc()['angle']]
+        x, y, z = cls.cloud.x, cls.cloud.y, cls.cloud.z
+        band = (z > PathPlanningConfig.obstacle_z_min) & (z < PathPlanningConfig.obstacle_z_max)
+        c, s = math.cos(loc[2]), math.sin(loc[2])
+        px = loc[0] + c * x[band] - s * y[band]
+        py = loc[1] + s * x[band] + c * y[band]
+
+        margin = PathPlanningConfig.collision_margin
+        headings = mid360_cloud.path_headings(xs, ys, back_mode)
+        if into_pallet and len(xs):
+            # Pallet on the fork side at the end pose
+            end = [xs[-1], ys[-1], headings[-1]]
+            half = GoodsAreaDetect.pallet_width / 2 + margin
+            keep = ~mid360_cloud.footprint_mask(px, py, end, *cls.fork_side(-PathPlanningConfig.footprint_tail - margin,
+                                                                            margin),
+                                                side_shift - half, side_shift + half)
+            px, py = px[keep], py[keep]
+
+        hit, point = mid360_cloud.first_collision(xs, ys, headings, px, py, cls.footprint(side_shift, margin),
+                                                  PathPlanningConfig.collision_step)
+        if hit >= 0:
+            PathPlanningConfig.log(f"Path blocked at point {hit}/{len(xs)}, obstacle X={point[0]:.3f}, "
+                                  f"Y={point[1]:.3f}", "WARN")
+        return hit, point
+
+    @classmethod
+    def footprint(cls, side_shift=0.0, margin=0.0):
+        """Body and fork rectangles (x_min, x_max, y_min, y_max) in the robot frame, grown by margin"""
+        body_tail = PathPlanningConfig.footprint_tail - PathPlanningConfig.fork_length
+        body = PathPlanningConfig.footprint_width / 2 + margin
+        fork = PathPlanningConfig.fork_width / 2 + margin
+        return [(*cls.fork_side(-body_tail, PathPlanningConfig.footprint_head + margin), -body, body),
+                (*cls.fork_side(-PathPlanningConfig.footprint_tail - margin, -body_tail),
+                 side_shift - fork, side_shift + fork)]
+
+    @classmethod
+    def corridor(cls, xs, ys, back_mode, side_shift=0.0):
+        """
+        Swept footprint against the container walls
+        Returns:
+            (minimum wall clearance (m), path index where it occurs), (inf, -1) if not checked
+        """
+        if not PathPlanningConfig.corridor_check_enabled or len(xs) == 0:
+            return math.inf, -1
+        half = PathPlanningConfig.container_width / 2
+        headings = mid360_cloud.path_headings(xs, ys, back_mode)
+        gap = path_geometry.corridor_clearance(xs, ys, headings, cls.footprint(side_shift), (-half, half))
+        i = int(gap.argmin())
+        level = "WARN" if gap[i] < PathPlanningConfig.corridor_min_clearance else "INFO"
+        PathPlanningConfig.log(f"Wall clearance {gap[i]:.3f}m at point {i}/{len(xs)}", level)
+        return float(gap[i]), i
+
+    @staticmethod
+    def shift_left(cmd):
+        """Side-shifter command to fork offset along robot y"""
+        return cmd if PathPlanningConfig.sideshifter_positive_is_left else -cmd
+
+
 class ForwardBezierRetreat:
     """
     Forward Bezier Retreat - Move robot FORWARD (away from pallet) using Bezier curve
@@ -1552,64 +1681,40 @@ class ForwardBezierRetreat:
         if length == 0:
             return [P0[0]], [P0[1]]
         
-        factor = PathPlanningConfig.retreat_curve_factor
-        
-        # Control points for gentle curve
-        P1 = [P0[0] + dx * factor, P0[1] + dy * (factor * 0.5)]
-        P2 = [P3[0] - dx * factor, P3[1] - dy * (factor * 0.5)]
-        
-        xs = self._bezier_curve(P0[0], P1[0], P2[0], P3[0])
-        ys = self._bezier_curve(P0[1], P1[1], P2[1], P3[1])
+        if PathPlanningConfig.planner != "bezier":
+            # Pose-to-pose planner along the direction of travel, heading unchanged at both ends
+            heading = self.robot_start_pos[2] + (math.pi if PathPlanningConfig.forks_at_front else 0.0)
+            try:
+                path = path_geometry.plan_path(PathPlanningConfig.planner, [P0[0], P0[1], heading],
+                                               [P3[0], P3[1], heading], PathPlanningConfig.planner_radius)
+                PathPlanningConfig.log(f"  {PathPlanningConfig.planner} path, max curvature "
+                                      f"{abs(path.curvature).max():.3f}/m", "INFO")
+                return path.x.tolist(), path.y.tolist()
+            except ValueError as e:
+                PathPlanningConfig.log(f"  {PathPlanningConfig.planner} planner failed ({e}), using Bezier", "WARN")
+        
+        # Candidate curve factors: configured one first, then reduced by 0.7 each step
+        factors = PathPlanningConfig.retreat_curve_factor * 0.7 ** np.arange(4)
+        
+        # Control points for gentle curve, all candidates analyzed in one pass
+        ctrl = np.empty((len(factors), 4, 2))
+        ctrl[:, 0], ctrl[:, 3] = P0, P3
+        ctrl[:, 1, 0], ctrl[:, 1, 1] = P0[0] + dx * factors, P0[1] + dy * (factors * 0.5)
+        ctrl[:, 2, 0], ctrl[:, 2, 1] = P3[0] - dx * factors, P3[1] - dy * (factors * 0.5)
+        curves = path_geometry.evaluate(ctrl)
+        rotation = np.degrees(path_geometry.analyze(ctrl, path=curves).max_heading_change)
         
         # Verify rotation doesn't exceed limits
-        max_angle = self._calculate_max_rotation(xs, ys)
-        PathPlanningConfig.log(f"  Max rotation in curve: {max_angle:.1f}° (limit: {PathPlanningConfig.max_rotation_angle}°)", "INFO")
-        
-        if max_angle > PathPlanningConfig.max_rotation_angle:
-            PathPlanningConfig.log(f"  WARNING: Curve rotation {max_angle:.1f}° exceeds limit! Adjusting...", "WARN")
-            # Reduce curve factor to decrease rotation
-            factor = factor * 0.7
-            P1 = [P0[0] + dx * factor, P0[1] + dy * (factor * 0.5)]
-            P2 = [P3[0] - dx * factor, P3[1] - dy * (factor * 0.5)]
-            xs = self._bezier_curve(P0[0], P1[0], P2[0], P3[0])
-            ys = self._bezier_curve(P0[1], P1[1], P2[1], P3[1])
-            PathPlanningConfig.log(f"  Adjusted curve factor to {factor:.3f}", "INFO")
-        
-        return xs, ys
-    
-    def _calculate_max_rotation(self, xs, ys):
-        """Calculate maximum rotation angle in path"""
-        if len(xs) < 3:
-            return 0
-        
-        max_angle = 0
-        step = 50  # Check every 50 points
-        
-        for i in range(step, len(xs) - step, step):
-            # Calculate direction vectors
-            dx1 = xs[i] - xs[i - step]
-            dy1 = ys[i] - ys[i - step]
-            dx2 = xs[i + step] - xs[i]
-            dy2 = ys[i + step] - ys[i]
-            
-            # Calculate angle change
-            angle1 = math.atan2(dy1, dx1)
-            angle2 = math.atan2(dy2, dx2)
-            angle_change = abs(math.degrees(angle2 - angle1))
-            
-            # Normalize to 0-180
-            if angle_change > 180:
-                angle_change = 360 - angle_change
-            
-            max_angle = max(max_angle, angle_change)
-        
-        return max_angle
-    
-    def _bezier_curve(self, p0, p1, p2, p3):
-        """Cubic Bezier curve formula"""
-        return [p0 * (1 - t) ** 3 + 3 * p1 * (1 - t) ** 2 * t + 
-                3 * p2 * (1 - t) * t ** 2 + p3 * t ** 3
-                for t in (i * 0.001 for i in range(1001))]
+        PathPlanningConfig.log(f"  Max rotation in curve: {rotation[0]:.1f}° (limit: {PathPlanningConfig.max_rotation_angle}°)", "INFO")
+        ok = np.flatnonzero(rotation <= PathPlanningConfig.max_rotation_angle)
+        k = int(ok[0]) if len(ok) else len(factors) - 1
+        if k > 0:
+            PathPlanningConfig.log(f"  WARNING: Curve rotation {rotation[0]:.1f}° exceeds limit! Adjusting...", "WARN")
+            PathPlanningConfig.log(f"  Adjusted curve factor to {factors[k]:.3f}, rotation {rotation[k]:.1f}°", "INFO")
+        if rotation[k] > PathPlanningConfig.max_rotation_angle:
+            PathPlanningConfig.log(f"  WARNING: rotation still {rotation[k]:.1f}° at the smallest curve factor", "WARN")
+        
+        return curves.x[k].tolist(), curves.y[k].tolist()
     
     def run(self, r: SimModule, m: Module):
         """Execute forward retreat path"""
@@ -1623,9 +1728,20 @@ class ForwardBezierRetreat:
             r.setPathMaxSpeed(0.1)
             # If forks_at_front=True, retreat should drive backward to move away from pallet
             r.setPathBackMode(PathPlanningConfig.forks_at_front)
-            r.setPathOnWorld(self.xs, self.ys, self.target_world[2])
+            hit, point = PathGuard.check(r, self.xs, self.ys, PathPlanningConfig.forks_at_front)
+            if hit >= 0:
+                self.status = MoveStatus.FAILED
+                r.setError(f"Retreat path blocked at point {hit}, obstacle {point}")
+                return
+            gap, i = PathGuard.corridor(self.xs, self.ys, PathPlanningConfig.forks_at_front)
+            if gap < PathPlanningConfig.corridor_min_clearance:
+                self.status = MoveStatus.FAILED
+                r.setError(f"Retreat path leaves the container at point {i}, wall clearance {gap:.3f}m")
+                return
+            xs, ys = path_geometry.sparse_path(self.xs, self.ys, PathPlanningConfig.path_tolerance)
+            r.setPathOnWorld(xs, ys, self.target_world[2])
             
-            PathPlanningConfig.log(f"  Forward path set, points: {len(self.xs)}", "INFO")
+            PathPlanningConfig.log(f"  Forward path set, points: {len(xs)}/{len(self.xs)}", "INFO")
             self.init = True
         
         # Execute path
@@ -1648,10 +1764,191 @@ class ForwardBezierRetreat:
         self.status = MoveStatus.RUNNING
 
 
+class CuspPickup:
+    """
+    Single Cusp Pickup
+    Retreat and approach planned as one maneuver: away from the pallet, one cusp, straight into it
+
+    LOG: The robot only stops at the cusp, where the approach leg is sent at once. The side-shifter starts with
+    LOG: the retreat leg, so it is in place before the forks reach the pallet
+    """
+
+    def __init__(self, r: SimModule):
+        self.status = MoveStatus.NONE
+        self.init = False
+        self.legs = []  # [(xs, ys, back_mode)] retreat leg, approach leg
+        self.leg = 0
+        self.path_finished = False  # goPath reported the current leg finished
+        self.cusp_world = [0, 0, 0]
+        self.target_world = [0, 0, 0]
+        self.side_left = 0  # fork offset along robot y (m)
+        self.sideshifter_target = 0  # side-shifter command
+        self.side_motor = None
+        self.start_time = None
+        self.reatch = False
+
+        PathPlanningConfig.log("CuspPickup initialized", "INFO")
+
+    def calculate_pickup_path(self, pallet_pos, robot_pos, is_ramp_area=False):
+        """
+        Plan both legs
+        Args:
+            pallet_pos: [x, y, yaw] pallet position from recognition
+            robot_pos: [x, y, yaw] current robot position
+            is_ramp_area: check the target against the ramp safe range instead of the container one
+        Returns:
+            target_world: end of the approach leg
+            sideshifter_target: side-shifter command applied while driving
+        """
+        PathPlanningConfig.log(f"Planning single cusp pickup", "INFO")
+        pallet_to_robot = RBK.Pos2Base(pallet_pos, robot_pos)
+
+        # Side-shifter covers what it can, the robot moves sideways for the rest
+        max_shift = PathPlanningConfig.sideshifter_max
+        self.side_left = max(-max_shift, min(pallet_to_robot[1], max_shift))
+        self.sideshifter_target = PathGuard.shift_left(self.side_left)
+        lateral = pallet_to_robot[1] - self.side_left
+        target = RBK.Pos2World([pallet_to_robot[0] + CubicBezierPar.backDist, lateral, 0], robot_pos)
+        self.target_world = [target[0], target[1], robot_pos[2]]
+        y_min, y_max = ((PathPlanningConfig.ramp_safe_y_min, PathPlanningConfig.ramp_safe_y_max) if is_ramp_area else
+                        (PathPlanningConfig.safe_y_min, PathPlanningConfig.safe_y_max))
+        if not y_min <= target[1] <= y_max:
+            PathPlanningConfig.log(f"  Target Y {target[1]:.3f}m outside the safe range [{y_min:.3f}, {y_max:.3f}]", "WARN")
+
+        # Sideways move split between the legs, the one furthest from the walls
+        retreat_x = -PathPlanningConfig.retreat_distance if PathPlanningConfig.forks_at_front else PathPlanningConfig.retreat_distance
+        splits = PathPlanningConfig.cusp_lateral_splits if PathPlanningConfig.corridor_check_enabled else (1.0,)
+        best = None
+        for split in splits:
+            cusp = RBK.Pos2World([retreat_x, split * lateral, 0], robot_pos)
+            cusp = [cusp[0], cusp[1], robot_pos[2]]
+            first, second = self._plan(robot_pos, cusp)
+            gap = (min(self._clearance(first, PathPlanningConfig.forks_at_front),
+                       self._clearance(second, not PathPlanningConfig.forks_at_front)) if len(splits) > 1 else math.inf)
+            if best is None or gap > best[0] + 1e-3:
+                best = (gap, split, cusp, first, second)
+        gap, split, self.cusp_world, first, second = best
+        self.legs = [(first.x.tolist(), first.y.tolist(), PathPlanningConfig.forks_at_front),
+                     (second.x.tolist(), second.y.tolist(), not PathPlanningConfig.forks_at_front)]
+
+        PathPlanningConfig.log(f"  Cusp: X={self.cusp_world[0]:.3f}, Y={self.cusp_world[1]:.3f}, "
+                              f"{split:.0%} of the sideways move before it"
+                              f"{f', wall clearance {gap:.3f}m' if gap < math.inf else ''}", "INFO")
+        PathPlanningConfig.log(f"  Target: X={self.target_world[0]:.3f}, Y={self.target_world[1]:.3f}", "INFO")
+        PathPlanningConfig.log(f"  Sideshifter target: {self.sideshifter_target:.3f}m", "INFO")
+        return self.target_world, self.sideshifter_target
+
+    def _plan(self, robot_pos, cusp):
+        """Both legs through cusp with the configured planner, Bezier if it has no path"""
+        try:
+            return path_geometry.cusp_path(robot_pos, cusp, self.target_world, PathPlanningConfig.planner,
+                                           PathPlanningConfig.planner_radius,
+                                           reverse_first=PathPlanningConfig.forks_at_front,
+                                           straight_in=PathPlanningConfig.cusp_straight_in)
+        except ValueError as e:
+            PathPlanningConfig.log(f"  {PathPlanningConfig.planner} planner failed ({e}), using Bezier", "WARN")
+            return path_geometry.cusp_path(robot_pos, cusp, self.target_world,
+                                           reverse_first=PathPlanningConfig.forks_at_front,
+                                           straight_in=PathPlanningConfig.cusp_straight_in)
+
+    def _clearance(self, leg, back_mode):
+        """Smallest container wall clearance of the swept footprint along one leg (m)"""
+        half = PathPlanningConfig.container_width / 2
+        headings = leg.heading + (math.pi if back_mode else 0.0)
+        return float(path_geometry.corridor_clearance(leg.x, leg.y, headings, PathGuard.footprint(self.side_left),
+                                                      (-half, half)).min())
+
+    def run(self, r: SimModule, m: Module):
+        """Execute retreat leg, cusp and approach leg into the pallet"""
+        if not self.init:
+            PathPlanningConfig.log(f"Starting single cusp pickup", "INFO")
+            self.start_time = time.time()
+            r.resetPath()
+            if not self._check(r):
+                self.status = MoveStatus.FAILED
+                return
+            self.side_motor = ForkMotor(r, MotorName.side, self.sideshifter_target, 0.5)
+            r.setPathMaxSpeed(0.1)
+            r.setPathReachAngle(0.1)
+            self._set_leg(r, 0)
+            self.init = True
+
+        # Side-shifter moves while driving
+        if PathPlanningConfig.dynamic_sideshifter_enabled:
+            if self.side_motor.status == MoveStatus.FAILED:
+                self.status = MoveStatus.FAILED
+                PathPlanningConfig.log(f"Side-shifter failed!", "ERROR")
+                r.setError("Sideshifter adjustment failed during cusp pickup")
+                return
+            self.side_motor.run(r, m, self.sideshifter_target)
+
+        if self.leg == 0:
+            loc = r.loc()
+            miss = math.hypot(loc['x'] - self.cusp_world[0], loc['y'] - self.cusp_world[1])
+            if self.path_finished and miss > PathPlanningConfig.cusp_reach_dist:
+                self.status = MoveStatus.FAILED
+                r.setError(f"Retreat leg ended {miss:.3f}m from the cusp, more than {PathPlanningConfig.cusp_reach_dist}m")
+                return
+            if self.path_finished or miss < PathPlanningConfig.cusp_reach_dist:
+                PathPlanningConfig.log(f"Cusp reached after {time.time() - self.start_time:.2f}s, "
+                                      f"approaching the pallet", "INFO")
+                r.resetPath()
+                self._set_leg(r, 1)
+        else:
+            # Check for fork insertion signal (DI 16 or 17)
+            di_status = r.Di().get('node', [])
+            if any(node['status'] for node in di_status if node['id'] in (16, 17)):
+                self.reatch = True
+                PathPlanningConfig.log(f"Fork insertion detected (DI 16/17)", "INFO")
+
+        if self.reatch:
+            r.resetPath()
+            self.status = MoveStatus.FINISHED
+            PathPlanningConfig.log(f"Single cusp pickup finished, time: {time.time() - self.start_time:.2f}s", "INFO")
+            PathPlanningConfig.log(f"  Final pos: X={r.loc()['x']:.3f}, Y={r.loc()['y']:.3f}", "INFO")
+            return
+        self.path_finished = r.goPath() == MoveStatus.FINISHED
+        self.status = MoveStatus.RUNNING
+
+    def _check(self, r: SimModule):
+        """Both legs against the live cloud and the container walls before moving"""
+        for i, (xs, ys, back_mode) in enumerate(self.legs):
+            name = ("Retreat leg", "Approach leg")[i]
+            hit, point = PathGuard.check(r, xs, ys, back_mode, into_pallet=i == 1, side_shift=self.side_left)
+            if hit >= 0:
+                r.setError(f"{name} blocked at point {hit}, obstacle {point}")
+                return False
+            gap, j = PathGuard.corridor(xs, ys, back_mode, side_shift=self.side_left)
+            if gap < PathPlanningConfig.corridor_min_clearance:
+                r.setError(f"{name} leaves the container at point {j}, wall clearance {gap:.3f}m")
+                return False
+        return True
+
+    def _set_leg(self, r: SimModule, leg):
+        """Send one leg as the current path"""
+        xs, ys, back_mode = self.legs[leg]
+        self.leg = leg
+        self.path_finished = False
+        if leg == 0:
+            # The leg cannot end outside cusp_reach_dist
+            r.setPathReachDist(min(GOPAthPar.reachDist, PathPlanningConfig.cusp_reach_dist))
+        if leg == 1:
+            r.setPathReachDist(0.02)
+        r.setPathBackMode(back_mode)
+        sparse_xs, sparse_ys = path_geometry.sparse_path(xs, ys, PathPlanningConfig.path_tolerance)
+        r.setPathOnWorld(sparse_xs, sparse_ys, (self.target_world if leg else self.cusp_world)[2])
+        PathPlanningConfig.log(f"  Leg {leg + 1}/2 set ({'back' if back_mode else 'forward'}), "
+                              f"points: {len(sparse_xs)}/{len(xs)}", "INFO")
+
+    def reset(self, r: SimModule):
+        self.status = MoveStatus.RUNNING
+
+
 class PrecisePalletPickup:
     """
     Precise Pallet Pickup with Multi-Phase Approach
     Flow: Forward Bezier Retreat → Lateral Alignment → Sideshifter Adjust → Backward Straight Approach
+    With cusp_pickup_enabled: one CuspPickup maneuver, retreat and approach with a single stop at the cusp
     
     USER REQUIREMENT:
     1. After recognition, robot moves FORWARD (away from pallet) using Bezier curve
@@ -1667,13 +1964,14 @@ class PrecisePalletPickup:
         self.start_time = None
         
         # Phase tracking
-        self.current_phase = "none"  # none, forward_retreat, lateral_align, sideshifter_adjust, backward_approach
+        self.current_phase = "none"  # none, cusp, forward_retreat, lateral_align, sideshifter_adjust, backward_approach
         
         # Phase objects
         self.forward_retreat = None
         self.lateral_align = None
         self.sideshifter_motor = None
         self.backward_approach = None
+        self.cusp_pickup = None
         
         # Data
         self.pallet_pos = None
@@ -1793,6 +2091,19 @@ class PrecisePalletPickup:
             self._initialize_phases(r, m)
             self.init = True
         
+        # Single cusp: retreat and approach back to back, side-shifter moving throughout
+        if self.current_phase == "cusp":
+            self.cusp_pickup.run(r, m)
+            
+            if self.cusp_pickup.status == MoveStatus.FINISHED:
+                self._finish(r, m)
+            elif self.cusp_pickup.status == MoveStatus.FAILED:
+                self.status = MoveStatus.FAILED
+                PathPlanningConfig.log(f"Cusp pickup failed!", "ERROR")
+            else:
+                self.status = MoveStatus.RUNNING
+            return
+        
         # Phase 1: Forward Bezier Retreat
         if self.current_phase == "forward_retreat":
             if self.forward_retreat.status == MoveStatus.NONE:
@@ -1857,20 +2168,8 @@ class PrecisePalletPickup:
             self.backward_approach.run(r, m)
             
             if self.backward_approach.status == MoveStatus.FINISHED:
-                self.status = MoveStatus.FINISHED
-                elapsed = time.time() - self.start_time
-                current_pos = [r.loc()['x'], r.loc()['y']]
-                PathPlanningConfig.log(f"=" * 60, "INFO")
                 PathPlanningConfig.log(f"Phase 4 complete: Backward approach finished", "INFO")
-                PathPlanningConfig.log(f"Precise pickup complete! Total time: {elapsed:.2f}s", "INFO")
-                PathPlanningConfig.log(f"  Final robot position: X={current_pos[0]:.3f}, Y={current_pos[1]:.3f}", "INFO")
-                PathPlanningConfig.log(f"  Target was: X={self.target_world[0]:.3f}, Y={self.target_world[1]:.3f}", "INFO")
-                PathPlanningConfig.log(f"=" * 60, "INFO")
-                
-                # Switch to next pallet
-                m.GData.currentPoint_switch_nextPoint()
-                r.setGData(m.GData.to_dict())
-                PathPlanningConfig.log(f"Switched to next pallet in recognition data", "INFO")
+                self._finish(r, m)
             elif self.backward_approach.status == MoveStatus.FAILED:
                 self.status = MoveStatus.FAILED
                 PathPlanningConfig.log(f"Phase 4 failed: Backward approach failed!", "ERROR")
@@ -1879,6 +2178,22 @@ class PrecisePalletPickup:
                 self.status = MoveStatus.RUNNING
             return
     
+    def _finish(self, r: SimModule, m: Module):
+        """Pickup done: log the result and switch to the next pallet"""
+        self.status = MoveStatus.FINISHED
+        elapsed = time.time() - self.start_time
+        current_pos = [r.loc()['x'], r.loc()['y']]
+        PathPlanningConfig.log(f"=" * 60, "INFO")
+        PathPlanningConfig.log(f"Precise pickup complete! Total time: {elapsed:.2f}s", "INFO")
+        PathPlanningConfig.log(f"  Final robot position: X={current_pos[0]:.3f}, Y={current_pos[1]:.3f}", "INFO")
+        PathPlanningConfig.log(f"  Target was: X={self.target_world[0]:.3f}, Y={self.target_world[1]:.3f}", "INFO")
+        PathPlanningConfig.log(f"=" * 60, "INFO")
+        
+        # Switch to next pallet
+        m.GData.currentPoint_switch_nextPoint()
+        r.setGData(m.GData.to_dict())
+        PathPlanningConfig.log(f"Switched to next pallet in recognition data", "INFO")
+    
     def _initialize_phases(self, r: SimModule, m: Module):
         """Initialize all phases using recognition output data"""
         # LOG: Get recognition data
@@ -1918,6 +2233,14 @@ class PrecisePalletPickup:
             pallet_pos, robot_pos, self.pallet_number, self.is_ramp_area
         )
         
+        if PathPlanningConfig.cusp_pickup_enabled:
+            self.cusp_pickup = CuspPickup(r)
+            self.cusp_pickup.calculate_pickup_path(pallet_pos, robot_pos, self.is_ramp_area)
+            self.target_world = self.cusp_pickup.target_world
+            self.current_phase = "cusp"
+            PathPlanningConfig.log(f"Single cusp pickup initialized using recognition data", "INFO")
+            return
+        
         # Initialize Phase 1: Forward Bezier Retreat
         # Create a forward retreat Bezier path (moving away from pallet)
         self.forward_retreat = ForwardBezierRetreat(r)
@@ -2054,7 +2377,8 @@ class CubicBezier2Load:
         r.setPathReachAngle(0.1)
         r.setPathMaxSpeed(0.1)
         r.setPathBackMode(True)
-        r.setPathOnWorld(self.xs, self.ys, self.target_world[2])  # Fix: set Bezier curve path
+        xs, ys = path_geometry.sparse_path(self.xs, self.ys, PathPlanningConfig.path_tolerance)
+        r.setPathOnWorld(xs, ys, self.target_world[2])  # Fix: set Bezier curve path
 
         self.C_msg = {
             # "Pallet coordinates": pallet_pos, "Pallet to robot": pallet_to_lm,
@@ -2085,9 +2409,8 @@ class CubicBezier2Load:
 
     def _generate_bezier_curve(self, P0, P3, params):
         p1, p2 = self._compute_control_points(P0, P3, params)
-        xs = self._bezier_curve(P0[0], p1[0], p2[0], P3[0])
-        ys = self._bezier_curve(P0[1], p1[1], p2[1], P3[1])
-        return xs, ys, [P0, p1, p2, P3]
+        curve = path_geometry.cubic_bezier(P0, p1, p2, P3)
+        return curve.x.tolist(), curve.y.tolist(), [P0, p1, p2, P3]
 
     def _compute_control_points(self, P0, P3, params):
         dx, dy = P3[0] - P0[0], P3[1] - P0[1]
@@ -2101,10 +2424,6 @@ class CubicBezier2Load:
         P2 = [P2_base[0] - params["d"] * u_perp[0] * extend, P2_base[1] - params["d"] * u_perp[1] * extend]
         return P1, P2
 
-    def _bezier_curve(self, p0, p1, p2, p3):
-        return [p0 * (1 - t) ** 3 + 3 * p1 * (1 - t) ** 2 * t + 3 * p2 * (1 - t) * t ** 2 + p3 * t ** 3
-                for t in (i * 0.001 for i in range(1001))]
-
     def _execute_movement(self, r: SimModule, m: Module):
         if not self.init: return
         # Execute lateral movement
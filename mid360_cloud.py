@@ -0,0 +1,947 @@
+"""
+mid360 点云处理 Point cloud helpers for Mid360AreaDetect
+
+All functions work on column arrays (x, y, z) in the robot frame, the same
+frame r.allCameraCloud() reports. Search areas are passed as any object with
+x_min/x_max/y_min/y_max/z_up/z_down attributes, e.g. the GoodsAreaDetect class.
+"""
+import json
+import math
+import os
+import struct
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from itertools import chain
+from types import SimpleNamespace
+from operator import itemgetter
+import numpy as np
+
+_XYZ = itemgetter("x", "y", "z")
+_SUB_LEVELS = 1024  # |x| 在体素内的量化级数 in-voxel |x| quantization for the downsample sort
+
+
+class CloudBuffer:
+    """
+    Columnar point cloud: x/y/z rows of one preallocated float32 buffer
+    The buffer is reused from scan to scan and only grows, x/y/z are views, never copies
+    """
+
+    def __init__(self, capacity=100000):
+        self._data = np.empty((3, capacity), dtype=np.float32)
+        self.size = 0
+        self._pending = []  # 待拷贝的点云和外参 (cloud, extrinsic) left to copy, see begin_fill()
+        self._offset = 0
+        self.devices = {}  # 上一帧各设备点数 points per device of the last fill
+
+    @property
+    def capacity(self):
+        return self._data.shape[1]
+
+    @property
+    def x(self):
+        return self._data[0, :self.size]
+
+    @property
+    def y(self):
+        return self._data[1, :self.size]
+
+    @property
+    def z(self):
+        return self._data[2, :self.size]
+
+    def xyz(self):
+        """(3, size) view of the filled part"""
+        return self._data[:, :self.size]
+
+    def clear(self):
+        self.size = 0
+
+    def reserve(self, n):
+        """Make room for n points, keeps the points already stored"""
+        if n <= self.capacity:
+            return
+        data = np.empty((3, max(n, 2 * self.capacity)), dtype=np.float32)
+        data[:, :self.size] = self._data[:, :self.size]
+        self._data = data
+
+    def append_points(self, cloud):
+        """Append a list of point dicts, written straight into the buffer"""
+        k = len(cloud)
+        if k == 0:
+            return
+        self.reserve(self.size + k)
+        flat = np.fromiter(chain.from_iterable(map(_XYZ, cloud)), dtype=np.float32, count=3 * k)
+        self._data[:, self.size:self.size + k] = flat.reshape(k, 3).T
+        self.size += k
+
+    def begin_fill(self, all_cloud, device_names=None, extrinsics=None):
+        """
+        Start refilling from r.allCameraCloud()["allcloud"], the points are copied by fill_step()
+        Args:
+            all_cloud: list of {"device": {"device_name":}, "cloud": [...]}
+            device_names: devices to keep, e.g. ("DJI-mid360-TCP",), None merges every device
+            extrinsics: {device_name: (R, t)} for clouds reported in the sensor frame, they are
+                moved to the robot frame as soon as they are copied
+        Returns:
+            total: number of points to copy
+        """
+        extrinsics = extrinsics or {}
+        self._pending, self.devices = [], {}
+        for i in all_cloud:
+            name = i["device"]["device_name"]
+            if (device_names is None or name in device_names) and len(i["cloud"]):
+                self._pending.append((i["cloud"], extrinsics.get(name)))
+                self.devices[name] = self.devices.get(name, 0) + len(i["cloud"])
+        self._offset = 0
+        total = sum(len(c) for c, _ in self._pending)
+        self.clear()
+        self.reserve(total)
+        return total
+
+    @property
+    def pending(self):
+        """Points left to copy since begin_fill()"""
+        return sum(len(c) for c, _ in self._pending) - self._offset
+
+    def fill_step(self, max_points):
+        """Copy up to max_points pending points into the buffer, returns the number copied"""
+        done = 0
+        while self._pending and done < max_points:
+            cloud, extrinsic = self._pending[0]
+            k = min(len(cloud) - self._offset, max_points - done)
+            if self._offset == 0 and k == len(cloud):
+                self.append_points(cloud)
+            else:
+                self.append_points(cloud[self._offset:self._offset + k])
+            self._offset += k
+            done += k
+            if self._offset == len(cloud):
+                if extrinsic is not None:
+                    self.transform(self.size - len(cloud), self.size, *extrinsic)
+                self._pending.pop(0)
+                self._offset = 0
+        return done
+
+    def fill(self, all_cloud, device_names=None, extrinsics=None):
+        """Refill in place in one go, see begin_fill(), returns the number of points stored"""
+        self.fill_step(self.begin_fill(all_cloud, device_names, extrinsics))
+        return self.size
+
+    def transform(self, start, stop, rot, trans):
+        """Apply p' = rot @ p + trans to the points [start, stop) in one matrix product"""
+        block = self._data[:, start:stop]
+        block[:] = rot @ block + trans[:, None]
+
+    def keep(self, idx):
+        """Compact the buffer in place to the points at ascending indices idx"""
+        n = len(idx)
+        self._data[:, :n] = self._data[:, idx]
+        self.size = n
+
+    def crop(self, area, polygon, frame=None):
+        """Keep only the goods points in place, see goods_crop(), returns the new size"""
+        if self.size > 0:
+            self.keep(goods_crop(self.x, self.y, self.z, area, polygon, frame))
+        return self.size
+
+    def band(self, z_min, z_max):
+        """Keep only the points with z_min < z < z_max in place, returns the new size"""
+        if self.size > 0:
+            self.keep(np.flatnonzero((self.z > z_min) & (self.z < z_max)))
+        return self.size
+
+    def voxel_downsample(self, voxel_size):
+        """Voxel-grid downsample in place, see voxel_downsample(), returns the new size"""
+        if voxel_size > 0 and self.size > 0:
+            self.keep(voxel_downsample(self.x, self.y, self.z, voxel_size))
+        return self.size
+
+
+def box_mask(x, y, z, area):
+    """Points strictly inside the detection box (x_max is the far end, x is negative behind the robot)"""
+    return ((z < area.z_up) & (z > area.z_down) &
+            (x > area.x_max) & (x < area.x_min) &
+            (y > area.y_min) & (y < area.y_max))
+
+
+def polygon_mask(x, y, polygon):
+    """
+    Vectorized rectangle test for the container polygon
+    The rectangle test is inclusive on its bounding box, points on the edge count as inside
+    """
+    px = [p[0] for p in polygon]
+    py = [p[1] for p in polygon]
+    return (x >= min(px)) & (x <= max(px)) & (y >= min(py)) & (y <= max(py))
+
+
+def goods_mask(x, y, z, area, polygon):
+    """Box and container polygon test in one boolean mask"""
+    return box_mask(x, y, z, area) & polygon_mask(x, y, polygon)
+
+
+def goods_crop(x, y, z, area, polygon, frame=None):
+    """
+    Indices of the points inside the box and polygon, the cloud is cropped with it before voxel_downsample()
+    Args:
+        x, y, z: cloud arrays in robot frame
+        area, polygon: see detect_goods()
+        frame: [x, y, yaw] of the frame area and polygon are given in, relative to the robot
+            (the container frame after a fit), None when they are in the robot frame
+    Returns:
+        ascending indices of the goods points
+    """
+    if frame is not None:
+        c, s = math.cos(frame[2]), math.sin(frame[2])
+        dx, dy = x - frame[0], y - frame[1]
+        x, y = c * dx + s * dy, c * dy - s * dx
+    return np.flatnonzero(goods_mask(x, y, z, area, polygon))
+
+
+def detect_goods(x, y, z, area, polygon):
+    """
+    Count goods points and find the one nearest to the robot (smallest |x|)
+    Args:
+        x, y, z: cloud arrays in robot frame
+        area: detection box, see GoodsAreaDetect
+        polygon: container projection, four (x, y) vertices
+    Returns:
+        point_num: number of points inside the box and polygon
+        point: [x, y, z] of the nearest point, [] if none
+    """
+    mask = goods_mask(x, y, z, area, polygon)
+    point_num = int(np.count_nonzero(mask))
+    if point_num == 0:
+        return 0, []
+    idx = np.flatnonzero(mask)
+    # argmin keeps the first of equal |x|, same as the old strict "<" loop
+    i = idx[np.argmin(np.abs(x[idx]))]
+    return point_num, [float(x[i]), float(y[i]), float(z[i])]
+
+
+def voxel_downsample(x, y, z, voxel_size):
+    """
+    Voxel-grid downsampling, one point per occupied voxel
+    The kept point is the one nearest to the robot (smallest |x|) in its voxel, so the
+    nearest goods point of the whole cloud always survives. Crop the cloud to the goods
+    first (goods_crop()), otherwise a point outside the box can win the voxel of a goods point.
+    Counts taken afterwards are occupied voxels, not points.
+    Args:
+        x, y, z: cloud arrays
+        voxel_size: voxel edge length (m)
+    Returns:
+        idx: ascending indices of the kept points
+    """
+    if len(x) == 0:
+        return np.empty(0, dtype=np.intp)
+    fx = x / voxel_size
+    ix = np.floor(fx).astype(np.int64)
+    iy = np.floor(y / voxel_size).astype(np.int64)
+    iz = np.floor(z / voxel_size).astype(np.int64)
+    # 体素不会跨越 x=0，体素内 |x| 的排序可以用 x 在体素内的位置表示
+    # a voxel never straddles x=0, so |x| order inside a voxel is the position of x in it
+    frac = fx - ix
+    near = np.where(ix < 0, 1.0 - frac, frac)
+    sub = np.minimum((near * _SUB_LEVELS).astype(np.int64), _SUB_LEVELS - 1)
+    ix -= ix.min()
+    iy -= iy.min()
+    iz -= iz.min()
+    ny, nz = int(iy.max()) + 1, int(iz.max()) + 1
+    key = (ix * ny + iy) * nz + iz
+    order = np.argsort(key * _SUB_LEVELS + sub)
+    k = key[order]
+    first = np.empty(len(k), dtype=bool)
+    first[0] = True
+    np.not_equal(k[1:], k[:-1], out=first[1:])
+    return np.sort(order[first])
+
+
+class FrameRing:
+    """
+    Ring buffer of the last N clouds, stored in the odometry frame
+    Frames taken at different robot poses line up, so evidence can be accumulated while
+    the robot settles or moves, and one sparse frame no longer decides alone
+    """
+
+    def __init__(self, frames=3, capacity=100000):
+        self.buffers = [CloudBuffer(capacity) for _ in range(frames)]
+        self.stamps = [0.0] * frames
+        self.head = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def points(self):
+        """Points over all stored frames"""
+        return sum(self.buffers[(self.head - k - 1) % len(self.buffers)].size for k in range(self.count))
+
+    def resize(self, frames):
+        """Change the ring length, drops the stored frames"""
+        if frames != len(self.buffers):
+            self.buffers = [CloudBuffer(self.buffers[0].capacity) for _ in range(frames)]
+            self.stamps = [0.0] * frames
+        self.clear()
+
+    def clear(self):
+        self.head = 0
+        self.count = 0
+
+    def push(self, x, y, z, pose, stamp):
+        """
+        Store one robot-frame cloud in the odometry frame, overwriting the oldest frame
+        Args:
+            x, y, z: cloud arrays in robot frame
+            pose: [x, y, angle] robot pose when the cloud was taken
+            stamp: capture time (s)
+        """
+        buf = self.buffers[self.head]
+        n = len(x)
+        buf.clear()
+        buf.reserve(n)
+        c, s = math.cos(pose[2]), math.sin(pose[2])
+        d = buf._data
+        d[0, :n] = pose[0] + c * x - s * y
+        d[1, :n] = pose[1] + s * x + c * y
+        d[2, :n] = z
+        buf.size = n
+        self.stamps[self.head] = stamp
+        self.head = (self.head + 1) % len(self.buffers)
+        self.count = min(self.count + 1, len(self.buffers))
+
+    def expire(self, oldest):
+        """Forget frames taken before the time stamp oldest"""
+        for _ in range(self.count):
+            tail = (self.head - self.count) % len(self.buffers)
+            if self.stamps[tail] >= oldest:
+                break
+            self.count -= 1
+
+    def frames(self, pose):
+        """Yield the stored frames, oldest first, as x, y, z arrays in the robot frame at pose"""
+        c, s = math.cos(pose[2]), math.sin(pose[2])
+        for k in range(self.count):
+            buf = self.buffers[(self.head - self.count + k) % len(self.buffers)]
+            dx, dy = buf.x - pose[0], buf.y - pose[1]
+            yield c * dx + s * dy, c * dy - s * dx, buf.z
+
+    def stack(self, pose):
+        """All stored frames as one x, y, z cloud in the robot frame at pose"""
+        frames = list(self.frames(pose))
+        if not frames:
+            empty = np.empty(0, dtype=np.float32)
+            return empty, empty, empty
+        return tuple(np.concatenate(c) for c in zip(*frames))
+
+    def detect(self, pose, area, polygon, min_points):
+        """
+        Goods detection over all stored frames
+        Args:
+            pose: current robot pose [x, y, angle], the area and polygon are relative to it
+            area, polygon: see detect_goods()
+            min_points: points a frame needs to count as seeing goods
+        Returns:
+            point_num: goods points over all frames
+            hits: frames that see goods
+            point: [x, y, z] nearest goods point, median over the frames that see goods
+        """
+        point_num, nearest = 0, []
+        for x, y, z in self.frames(pose):
+            n, p = detect_goods(x, y, z, area, polygon)
+            point_num += n
+            if n >= min_points:
+                nearest.append(p)
+        point = sorted(nearest, key=lambda p: abs(p[0]))[len(nearest) // 2] if nearest else []
+        return point_num, len(nearest), point
+
+
+class SearchArea:
+    """Goods search box with the same attributes as GoodsAreaDetect, x is negative behind the robot"""
+
+    def __init__(self, x_min, x_max, y_min, y_max, z_up, z_down):
+        self.x_min, self.x_max = x_min, x_max
+        self.y_min, self.y_max = y_min, y_max
+        self.z_up, self.z_down = z_up, z_down
+
+    def polygon(self):
+        """Four (x, y) corners, the same layout as Mid360AreaDetect.polygon1"""
+        return ((self.x_min, self.y_max), (self.x_min, self.y_min),
+                (self.x_max, self.y_max), (self.x_max, self.y_min))
+
+    def to_dict(self):
+        return {"x_min": self.x_min, "x_max": self.x_max, "y_min": self.y_min,
+                "y_max": self.y_max, "z_up": self.z_up, "z_down": self.z_down}
+
+
+def search_window(area, x_next, depth, margin):
+    """
+    Narrow a search area along x to the slab where the next goods row can be
+    Args:
+        area: search area to narrow, y/z are kept
+        x_next: expected x of the next row face in the detection frame (x < 0 behind the robot)
+        depth: how far behind x_next goods may still be, e.g. two pallet rows
+        margin: tolerance on both sides of the slab
+    Returns:
+        SearchArea, never closer to the robot than area.x_min
+    """
+    near = min(area.x_min, x_next + margin)
+    far = min(near - margin, x_next - depth - margin)
+    return SearchArea(near, far, area.y_min, area.y_max, area.z_up, area.z_down)
+
+
+class ContainerFit:
+    """Result of fit_container()"""
+
+    def __init__(self, frame, width, floor_z, area, inliers, door=None):
+        self.frame = frame  # [x, y, yaw] container centre line at the robot, in robot frame
+        self.width = width  # wall to wall (m)
+        self.floor_z = floor_z  # floor height under the robot (m)
+        self.area = area  # SearchArea in the container frame
+        self.inliers = inliers  # [floor, left wall, right wall] inlier counts
+        self.door = door  # x of the door in the container frame, None when the walls reach the robot
+
+    def to_dict(self):
+        return {"frame": self.frame, "width": self.width, "floor_z": self.floor_z,
+                "area": self.area.to_dict(), "inliers": self.inliers, "door": self.door}
+
+
+def _ransac_floor(x, y, z, iterations, tol, max_tilt, rng):
+    """Batched 3-point RANSAC for a near horizontal plane, returns the inlier mask or None"""
+    n = len(x)
+    if n < 3:
+        return None
+    idx = rng.integers(0, n, size=(iterations, 3))
+    p = np.stack((x[idx], y[idx], z[idx]), axis=-1)  # (K, 3 points, xyz)
+    normal = np.cross(p[:, 1] - p[:, 0], p[:, 2] - p[:, 0])
+    length = np.linalg.norm(normal, axis=1)
+    ok = length > 1e-9
+    normal[ok] /= length[ok, None]
+    ok &= np.abs(normal[:, 2]) > math.cos(max_tilt)
+    if not ok.any():
+        return None
+    normal, p0 = normal[ok], p[ok, 0]
+    d = -np.einsum("ij,ij->i", normal, p0)
+    dist = np.abs(normal[:, 0, None] * x + normal[:, 1, None] * y + normal[:, 2, None] * z + d[:, None])
+    best = np.argmax(np.count_nonzero(dist < tol, axis=1))
+    return dist[best] < tol
+
+
+def _ransac_wall(x, y, iterations, tol, max_yaw, rng):
+    """Batched 2-point RANSAC for a vertical plane along the x axis, returns the inlier mask or None"""
+    n = len(x)
+    if n < 2:
+        return None
+    idx = rng.integers(0, n, size=(iterations, 2))
+    dx, dy = x[idx[:, 1]] - x[idx[:, 0]], y[idx[:, 1]] - y[idx[:, 0]]
+    length = np.hypot(dx, dy)
+    ok = (length > 1e-6) & (np.abs(dy) <= np.abs(dx) * math.tan(max_yaw))
+    if not ok.any():
+        return None
+    ux, uy = dx[ok] / length[ok], dy[ok] / length[ok]
+    x0, y0 = x[idx[ok, 0]], y[idx[ok, 0]]
+    dist = np.abs(ux[:, None] * (y - y0[:, None]) - uy[:, None] * (x - x0[:, None]))
+    best = np.argmax(np.count_nonzero(dist < tol, axis=1))
+    return dist[best] < tol
+
+
+def _outermost(x, y, bin_size, band):
+    """
+    Points within band of the largest y in their x bin, pass -y for the right wall
+    Goods standing next to a wall are closer to the centre line than the wall above them,
+    so only the wall survives in bins where both are seen
+    """
+    if len(x) == 0:
+        return np.zeros(0, dtype=bool)
+    b = np.floor(x / bin_size).astype(np.int64)
+    b -= b.min()
+    top = np.full(int(b.max()) + 1, -np.inf)
+    np.maximum.at(top, b, y)
+    return y >= top[b] - band
+
+
+def _wall_extent(x, y, frame):
+    """Near and far x (2 % / 98 % quantiles) of wall inliers in the container frame"""
+    c, s = math.cos(frame[2]), math.sin(frame[2])
+    xc = c * (x - frame[0]) + s * (y - frame[1])
+    far, near = np.percentile(xc, [2, 98])
+    return float(near), float(far)
+
+
+def fit_container(x, y, z, par, rng=None):
+    """
+    Fit the container floor and both side walls and derive the goods search volume
+    The search volume runs from the door (where the walls start, x_min when the robot is inside)
+    to the far end of the walls that are seen, never closer than x_min/x_max.
+    Args:
+        x, y, z: cloud arrays in robot frame, the container behind the robot (x < 0)
+        par: settings, see GoodsAreaDetect (a, fit_*, wall_*, x_min, x_max, z_up, z_down)
+    Returns:
+        ContainerFit, or None when no plausible container is found
+    """
+    rng = rng or np.random.default_rng()
+    if len(x) > par.fit_max_points:
+        pick = rng.choice(len(x), par.fit_max_points, replace=False)
+        x, y, z = x[pick], y[pick], z[pick]
+    behind = x < 0
+    x, y, z = x[behind], y[behind], z[behind]
+
+    # 地面 floor: lowest band of the cloud
+    low = np.abs(z) < par.fit_floor_band
+    floor = _ransac_floor(x[low], y[low], z[low], par.fit_iterations, par.fit_tolerance,
+                          math.radians(par.fit_max_angle), rng)
+    if floor is None or np.count_nonzero(floor) < par.fit_min_inliers:
+        return None
+    fx, fy, fz = x[low][floor], y[low][floor], z[low][floor]
+    a = np.column_stack((fx, fy, np.ones_like(fx)))
+    floor_z = float(np.linalg.lstsq(a, fz, rcond=None)[0][2])
+
+    # 两侧墙面 side walls: vertical planes left (y > 0) and right (y < 0) of the robot
+    band = (z > floor_z + par.wall_band[0]) & (z < floor_z + par.wall_band[1])
+    walls, extent = [], []
+    for sign in (1, -1):
+        sel = band & (sign * y > 0)
+        wx, wy = x[sel], y[sel]
+        outer = _outermost(wx, sign * wy, par.wall_bin, par.wall_outer)
+        wx, wy = wx[outer], wy[outer]
+        wall = _ransac_wall(wx, wy, par.fit_iterations, par.fit_tolerance,
+                            math.radians(par.fit_max_angle), rng)
+        if wall is None or np.count_nonzero(wall) < par.fit_min_inliers:
+            return None
+        k, b = np.polyfit(wx[wall], wy[wall], 1)  # y = k x + b
+        walls.append((float(k), float(b), int(np.count_nonzero(wall))))
+        extent.append((wx[wall], wy[wall]))
+    (k_l, b_l, n_l), (k_r, b_r, n_r) = walls
+
+    yaw = (math.atan(k_l) + math.atan(k_r)) / 2
+    width = (b_l - b_r) * math.cos(yaw)
+    if abs(width - par.a) > par.fit_width_tol:
+        return None
+    frame = [0.0, (b_l + b_r) / 2, yaw]
+    # 门口在两侧墙都开始的地方，墙一直延伸到机器人旁边时机器人已在货箱内
+    # the door is where both walls have started, walls reaching the robot mean it is inside
+    (near_l, far_l), (near_r, far_r) = (_wall_extent(wx, wy, frame) for wx, wy in extent)
+    door = min(near_l, near_r)
+    if door > -par.wall_bin:
+        door = None
+    near = par.x_min if door is None else min(par.x_min, door)
+    far = min(par.x_max, max(far_l, far_r))
+    half = width / 2 - par.wall_margin
+    area = SearchArea(near, far, -half, half, floor_z + par.z_up, floor_z + par.z_down)
+    return ContainerFit(frame, width, floor_z, area, [int(np.count_nonzero(floor)), n_l, n_r], door)
+
+
+def extract_front_face(x, y, z, area, polygon, bin_size=0.05, face_depth=0.15, min_points=3,
+                       pallet_width=1.1, column_gap=0.1):
+    """
+    Nearest goods face and the pallet columns of that row
+    The goods points are binned along |x|, the first bin with min_points opens the face
+    and everything within face_depth behind it belongs to the face. The face is then
+    binned along y, runs of occupied bins split by gaps >= column_gap are columns,
+    a run wider than one pallet counts round(width / pallet_width) columns.
+    Args:
+        x, y, z: cloud arrays
+        area, polygon: see detect_goods()
+        bin_size: bin width along x and y (m)
+        face_depth: depth of the face slab (m)
+        min_points: points the nearest bin needs
+        pallet_width: pallet width across the container (m)
+        column_gap: smallest free gap between two columns (m)
+    Returns:
+        {"x", "y", "y_min", "y_max", "columns", "centers", "num"}, None when no face is found
+        x is the face distance (median of the slab), y the centre of its lateral extent
+    """
+    mask = goods_mask(x, y, z, area, polygon)
+    gx, gy = x[mask], y[mask]
+    if len(gx) < min_points:
+        return None
+    depth = np.abs(gx)
+    d0 = depth.min()
+    counts = np.bincount(((depth - d0) / bin_size).astype(np.intp))
+    first = np.flatnonzero(counts >= min_points)
+    if len(first) == 0:
+        return None
+    near = d0 + first[0] * bin_size
+    slab = (depth >= near) & (depth < near + face_depth)
+    fx, fy = gx[slab], gy[slab]
+
+    y0 = fy.min()
+    occupied = np.bincount(((fy - y0) / bin_size).astype(np.intp)) > 0
+    # 连续占用的 y 段 runs of occupied y bins, split where the gap is wide enough
+    edges = np.diff(np.r_[0, occupied.astype(np.int8), 0])
+    starts, ends = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+    gap_bins = max(1, int(round(column_gap / bin_size)))
+    runs = [[starts[0], ends[0]]]
+    for s, e in zip(starts[1:], ends[1:]):
+        if s - runs[-1][1] < gap_bins:
+            runs[-1][1] = e
+        else:
+            runs.append([s, e])
+    centers = []
+    for s, e in runs:
+        lo, hi = y0 + s * bin_size, y0 + e * bin_size
+        n = max(1, int(round((hi - lo) / pallet_width)))
+        step = (hi - lo) / n
+        centers += [float(lo + step * (k + 0.5)) for k in range(n)]
+    y_min, y_max = float(fy.min()), float(fy.max())
+    return {"x": float(np.median(fx)), "y": (y_min + y_max) / 2, "y_min": y_min, "y_max": y_max,
+            "columns": len(centers), "centers": centers, "num": int(len(fx))}
+
+
+class TickBudget:
+    """
+    Per-tick time budget for cloud work
+    Every stage measures its own throughput (points/s) and the next chunk is sized to the
+    time left in the tick, so a scan finishes in as few ticks as the controller allows
+    without running past the budget. The first chunk of a tick always runs so work
+    never stalls.
+    """
+
+    def __init__(self, budget, default_rate=2e5, smoothing=0.3):
+        self.budget = budget  # s per tick
+        self.default_rate = default_rate  # points/s assumed before a stage has been measured
+        self.smoothing = smoothing
+        self.rates = {}
+        self.t0 = time.perf_counter()
+        self.used = False
+
+    def start(self):
+        """Call once at the start of every tick"""
+        self.t0 = time.perf_counter()
+        self.used = False
+
+    def left(self):
+        return self.budget - (time.perf_counter() - self.t0)
+
+    def chunk(self, stage):
+        """Points of stage that fit in the time left, at least 1 for the first chunk of a tick"""
+        n = int(self.left() * self.rates.get(stage, self.default_rate))
+        return max(n, 0 if self.used else 1)
+
+    def fits(self, stage, points):
+        """Whether an unsplittable stage of points fits, always true for the first work of a tick"""
+        return not self.used or points <= self.chunk(stage)
+
+    def record(self, stage, points, elapsed):
+        """Feed back a finished chunk"""
+        self.used = True
+        if points <= 0 or elapsed <= 0:
+            return
+        rate = points / elapsed
+        old = self.rates.get(stage)
+        self.rates[stage] = rate if old is None else old + self.smoothing * (rate - old)
+
+
+_executors = {}
+
+
+def snapshot(par):
+    """Plain copy of the settings of a config class such as GoodsAreaDetect, safe to hand to a worker"""
+    return SimpleNamespace(**{k: v for k, v in vars(par).items()
+                              if not k.startswith("_") and not callable(v)})
+
+
+def load_frame(all_cloud, device_names, voxel_size, crop, fit_par=None, extrinsics=None, scan=None):
+    """
+    Build one frame: copy, optionally fit the container, crop to the goods and downsample, meant to run in a worker
+    Args:
+        all_cloud: r.allCameraCloud()["allcloud"]
+        device_names: devices to keep, e.g. ("DJI-mid360-TCP",), None merges every device
+        voxel_size: see voxel_downsample(), 0 keeps every point
+        crop: (area, polygon, frame) goods region, see goods_crop(), replaced by the whole fitted area when the fit
+            succeeds, the caller narrows it again in the container frame
+        fit_par: settings for fit_container(), None skips the fit
+        extrinsics: see CloudBuffer.begin_fill()
+        scan: write_scan() keyword arguments other than the points, the raw frame is saved when given
+    Returns:
+        (xyz (3, n) float32, ContainerFit or None, {device name: raw point count}, goods point count,
+         scan path or write error or None)
+    """
+    cloud = CloudBuffer(1)
+    raw_num = cloud.fill(all_cloud, device_names, extrinsics)
+    saved = None
+    if scan is not None and raw_num:
+        try:
+            saved = write_scan(x=cloud.x, y=cloud.y, z=cloud.z, **scan)
+        except OSError as e:
+            saved = f"scan not saved: {e}"
+    fit = fit_container(cloud.x, cloud.y, cloud.z, fit_par) if fit_par is not None and cloud.size else None
+    area, polygon, frame = crop
+    if fit is not None:
+        area, frame = fit.area, fit.frame
+        polygon = area.polygon()
+    crop_num = cloud.crop(area, polygon, frame)
+    cloud.voxel_downsample(voxel_size)
+    return cloud.xyz(), fit, cloud.devices, crop_num, saved
+
+
+def submit_frame(mode, all_cloud, device_names, voxel_size, crop, fit_par=None, extrinsics=None, scan=None):
+    """
+    Run load_frame() off the tick and return its Future, poll it with done()
+    mode "thread" shares memory and only holds the GIL in the point copy, "process" also runs
+    the copy in parallel but the raw cloud has to be pickled to the child. One worker per mode,
+    so frames come back in order.
+    """
+    pool = _executors.get(mode)
+    if pool is None:
+        if mode == "thread":
+            pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mid360")
+        elif mode == "process":
+            pool = ProcessPoolExecutor(max_workers=1)
+        else:
+            raise ValueError(f"unknown cloud worker mode {mode!r}")
+        _executors[mode] = pool
+    return pool.submit(load_frame, all_cloud, device_names, voxel_size, crop, fit_par, extrinsics, scan)
+
+
+# 诊断点云格式 diagnostic scan format:
+# 44 byte header "<4sBBHI4d": magic, version, flags, reserved, point count, pose x/y/yaw, timestamp,
+# then the x, y and z columns as little-endian int16 millimetres, optionally delta coded per column
+# (wrapping int16 differences, lossless). The zlib stage splits each column into its low and high
+# byte planes first, which compresses better than interleaved bytes.
+SCAN_MAGIC = b"M3SC"
+SCAN_VERSION = 1
+SCAN_DELTA = 1
+SCAN_ZLIB = 2
+_SCAN_HEADER = struct.Struct("<4sBBHI4d")
+_SCAN_LIMIT = 32767  # int16 能表示的最大毫米数 largest coordinate in int16 mm
+
+
+def quantize_scan(x, y, z):
+    """
+    int16 millimetre copy (3, n) of a cloud, the only part of saving a scan that needs the live buffer
+    Points farther than 32.767 m on any axis are dropped, not clipped, so they cannot turn into fake walls
+    """
+    q = np.rint(np.vstack((x, y, z)) * 1000.0)
+    keep = (np.abs(q) <= _SCAN_LIMIT).all(axis=0)
+    if not keep.all():
+        q = q[:, keep]
+    return q.astype("<i2")
+
+
+def pack_scan(q, pose, stamp, delta=False, compress=False):
+    """
+    Pack a quantize_scan() result with its pose, 6 bytes per point before compression
+    Args:
+        pose: robot pose [x, y, yaw] in world when the cloud was taken
+        stamp: time.time() of the cloud
+        delta: store per-column differences, smaller after zlib for scan-ordered clouds
+        compress: zlib the payload (level 1, fast), releases the GIL so it can run in a writer thread
+    """
+    flags = 0
+    if delta:
+        q = q.copy()
+        q[:, 1:] = np.diff(q, axis=1)  # int16 回绕差分 wrapping difference, undone by cumsum
+        flags |= SCAN_DELTA
+    if compress:
+        planes = q.view(np.uint8).reshape(3, -1, 2).transpose(0, 2, 1)  # 低/高字节面 low/high byte planes
+        payload = zlib.compress(planes.tobytes(), 1)
+        flags |= SCAN_ZLIB
+    else:
+        payload = q.tobytes()
+    header = _SCAN_HEADER.pack(SCAN_MAGIC, SCAN_VERSION, flags, 0, q.shape[1],
+                               float(pose[0]), float(pose[1]), float(pose[2]), float(stamp))
+    return header + payload
+
+
+def encode_scan(x, y, z, pose, stamp, delta=False, compress=False):
+    """Quantize and pack a cloud in one go, see quantize_scan() and pack_scan()"""
+    return pack_scan(quantize_scan(x, y, z), pose, stamp, delta, compress)
+
+
+def decode_scan(data):
+    """
+    Rebuild a cloud packed by pack_scan()
+    Returns:
+        (xyz (3, n) float32 in m, pose [x, y, yaw], stamp)
+    """
+    magic, version, flags, _, n, px, py, pyaw, stamp = _SCAN_HEADER.unpack_from(data)
+    if magic != SCAN_MAGIC or version != SCAN_VERSION:
+        raise ValueError(f"not a version {SCAN_VERSION} mid360 scan")
+    payload = data[_SCAN_HEADER.size:]
+    if flags & SCAN_ZLIB:
+        planes = np.frombuffer(zlib.decompress(payload), dtype=np.uint8).reshape(3, 2, n)
+        q = np.ascontiguousarray(planes.transpose(0, 2, 1)).view("<i2").reshape(3, n)
+    else:
+        q = np.frombuffer(payload, dtype="<i2").reshape(3, n)
+    if flags & SCAN_DELTA:
+        q = np.cumsum(q, axis=1, dtype=np.int16)
+    return q.astype(np.float32) / np.float32(1000.0), [px, py, pyaw], stamp
+
+
+def _write_scan(directory, q, pose, stamp, compress, keep):
+    os.makedirs(directory, exist_ok=True)
+    name = datetime.fromtimestamp(stamp).strftime("mid360_%Y-%m-%d_%H-%M-%S.%f") + ".scan"
+    path = os.path.join(directory, name)
+    with open(path + ".tmp", "wb") as f:
+        f.write(pack_scan(q, pose, stamp, compress, compress))
+    os.replace(path + ".tmp", path)  # 读到的文件总是完整的 readers never see half a scan
+    if keep > 0:
+        scans = sorted(f for f in os.listdir(directory) if f.startswith("mid360_") and f.endswith(".scan"))
+        for old in scans[:-keep]:
+            os.remove(os.path.join(directory, old))
+    return path
+
+
+def write_scan(directory, x, y, z, pose, stamp, compress=False, keep=0):
+    """
+    Save one scan as <directory>/mid360_<time>.scan, delta coding goes with compress
+    Args:
+        keep: oldest scans beyond this many are removed, 0 keeps all
+    Returns:
+        path of the file written, OSError is left to the caller
+    """
+    return _write_scan(directory, quantize_scan(x, y, z), pose, stamp, compress, keep)
+
+
+def submit_scan(directory, x, y, z, pose, stamp, compress=False, keep=0):
+    """
+    write_scan() with only the quantization on the caller's thread, packing and file IO run on one
+    writer thread, so x/y/z may be refilled as soon as this returns
+    Returns:
+        Future of the path, its exception is the OSError of the write
+    """
+    pool = _executors.get("scan")
+    if pool is None:
+        pool = _executors["scan"] = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mid360-scan")
+    return pool.submit(_write_scan, directory, quantize_scan(x, y, z), pose, stamp, compress, keep)
+
+
+def read_scan(path):
+    """Load a file written by write_scan(), see decode_scan()"""
+    with open(path, "rb") as f:
+        return decode_scan(f.read())
+
+
+_calibrations = {}
+
+
+def rotation(roll, pitch, yaw):
+    """Rotation matrix R = Rz(yaw) Ry(pitch) Rx(roll), angles in degrees as in robot_calibrationfile.cp"""
+    cr, sr = math.cos(math.radians(roll)), math.sin(math.radians(roll))
+    cp, sp = math.cos(math.radians(pitch)), math.sin(math.radians(pitch))
+    cy, sy = math.cos(math.radians(yaw)), math.sin(math.radians(yaw))
+    return np.array([[cy * cp, cy * sp * sr - sy * cr, cy * sp * cr + sy * sr],
+                     [sy * cp, sy * sp * sr + cy * cr, sy * sp * cr - cy * sr],
+                     [-sp, cp * sr, cp * cr]], dtype=np.float32)
+
+
+def load_calibration(path):
+    """
+    Sensor extrinsics of the enabled devices in robot_calibrationfile.cp, the file is read once per path
+    Returns:
+        {device name: (R (3, 3), t (3,))}, e.g. "frontLidar", "palletCamera"
+    """
+    if path not in _calibrations:
+        with open(path, encoding="utf-8") as f:
+            cal = json.load(f)
+        extrinsics = {}
+        for device_type in cal.get("deviceTypes", []):
+            for device in device_type.get("devices", []):
+                if not device.get("isEnabled", True):
+                    continue
+                for param in device.get("deviceParams", []):
+                    if param.get("key") == "basic" and "arrayParam" in param:
+                        v = {p["key"]: p.get("doubleValue", 0.0) for p in param["arrayParam"]["params"]}
+                        t = np.array([v.get("x", 0.0), v.get("y", 0.0), v.get("z", 0.0)], dtype=np.float32)
+                        extrinsics[device["name"]] = (rotation(v.get("roll", 0.0), v.get("pitch", 0.0),
+                                                               v.get("yaw", 0.0)), t)
+        _calibrations[path] = extrinsics
+    return _calibrations[path]
+
+
+def load_pallet_model(path):
+    """
+    Parameters of a pallet model such as p0001.palletobject
+    Returns:
+        {key: value} of the basic parameters, e.g. "pallet_width", "pallet_length" (m)
+    """
+    with open(path, encoding="utf-8") as f:
+        model = json.load(f)
+    for param in model.get("deviceParams", []):
+        if param.get("key") == "basic" and "arrayParam" in param:
+            return {p["key"]: p.get("doubleValue", p.get("int32Value")) for p in param["arrayParam"]["params"]}
+    raise ValueError(f"no basic parameters in {path}")
+
+
+def sensor_extrinsics(devices, calibration_file):
+    """
+    Extrinsics of the clouds allCameraCloud reports in the sensor frame
+    Args:
+        devices: {allCameraCloud device name: device name in the calibration file}
+        calibration_file: robot_calibrationfile.cp, relative paths are next to this module
+    Returns:
+        {allCameraCloud device name: (R, t)}, None when devices is empty
+    Raises:
+        OSError/ValueError if the file cannot be read, KeyError if a device is missing or disabled
+    """
+    if not devices:
+        return None
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), calibration_file)
+    calibration = load_calibration(path)
+    missing = [n for n in devices.values() if n not in calibration]
+    if missing:
+        raise KeyError(f"no enabled device {missing} in {path}")
+    return {d: calibration[n] for d, n in devices.items()}
+
+
+def path_headings(xs, ys, reverse=False):
+    """Robot heading at every path point from the path tangent, reverse adds pi for back mode paths"""
+    xs, ys = np.asarray(xs, dtype=np.float64), np.asarray(ys, dtype=np.float64)
+    if len(xs) < 2:
+        return np.zeros(len(xs))
+    heading = np.arctan2(np.gradient(ys), np.gradient(xs))
+    return heading + math.pi if reverse else heading
+
+
+def footprint_mask(px, py, pose, x_min, x_max, y_min, y_max):
+    """Points inside the rectangle [x_min, x_max] x [y_min, y_max] in the frame of pose [x, y, yaw]"""
+    c, s = math.cos(pose[2]), math.sin(pose[2])
+    dx, dy = px - pose[0], py - pose[1]
+    lx, ly = c * dx + s * dy, -s * dx + c * dy
+    return (lx > x_min) & (lx < x_max) & (ly > y_min) & (ly < y_max)
+
+
+def first_collision(xs, ys, headings, px, py, footprint, step=0.05, chunk=64):
+    """
+    Sweep the robot footprint along a path and find the first station that contains an obstacle point
+    Args:
+        xs, ys, headings: path in world, headings are the robot heading, see path_headings()
+        px, py: obstacle points in world
+        footprint: rectangles (x_min, x_max, y_min, y_max) in the robot frame, e.g. body and
+            side-shifted forks, margins included
+        step: stations are taken every step metres of arc length, plus the last point, so sparse
+            paths such as a two-point straight line are checked along their whole length
+        chunk: stations tested per broadcast, bounds memory to chunk x len(px)
+    Returns:
+        (index into xs of the first colliding station, [x, y] of the hit point), (-1, None) if the path is free
+    """
+    xs, ys = np.asarray(xs, dtype=np.float64), np.asarray(ys, dtype=np.float64)
+    headings = np.asarray(headings, dtype=np.float64)
+    if len(xs) == 0 or len(px) == 0:
+        return -1, None
+    # 只保留路径包围盒附近的点 keep points near the path bounding box
+    reach = max(math.hypot(max(abs(x0), abs(x1)), max(abs(y0), abs(y1))) for x0, x1, y0, y1 in footprint)
+    near = ((px > xs.min() - reach) & (px < xs.max() + reach) &
+            (py > ys.min() - reach) & (py < ys.max() + reach))
+    px, py = np.asarray(px, dtype=np.float64)[near], np.asarray(py, dtype=np.float64)[near]
+    if len(px) == 0:
+        return -1, None
+    arc = np.concatenate(([0.0], np.cumsum(np.hypot(np.diff(xs), np.diff(ys)))))
+    a = np.append(np.arange(0.0, arc[-1], step), arc[-1])
+    seg = np.clip(np.searchsorted(arc, a, side="right") - 1, 0, len(xs) - 1)  # 每个站点所在的路径点
+    sx, sy, sh = np.interp(a, arc, xs), np.interp(a, arc, ys), headings[seg]
+    for i in range(0, len(a), chunk):
+        c, s = np.cos(sh[i:i + chunk])[:, None], np.sin(sh[i:i + chunk])[:, None]
+        dx, dy = px[None, :] - sx[i:i + chunk, None], py[None, :] - sy[i:i + chunk, None]
+        lx, ly = c * dx + s * dy, -s * dx + c * dy
+        hit = np.zeros(lx.shape, dtype=bool)
+        for x0, x1, y0, y1 in footprint:
+            hit |= (lx > x0) & (lx < x1) & (ly > y0) & (ly < y1)
+        rows = np.flatnonzero(hit.any(axis=1))
+        if len(rows):
+            k = rows[0]
+            j = np.flatnonzero(hit[k])[0]
+            return int(seg[i + k]), [float(px[j]), float(py[j])]
+    return -1, None
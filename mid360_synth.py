@@ -0,0 +1,266 @@
+"""
+合成货箱点云与基准测试 Synthetic container clouds and a Mid360AreaDetect benchmark
+
+ContainerScene lays out the ramp, container and up to 22 pallets from
+length_width_container_ramp_pallets.png, scan() ray casts a Mid360-like
+scan of it (range noise, occlusion by pallets and walls) in the robot frame.
+benchmark() runs Mid360AreaDetect on those scans through the rbk runtime:
+
+    python mid360_synth.py --sizes 10000 100000 500000
+"""
+import argparse
+import math
+import time
+import numpy as np
+
+
+class ContainerScene:
+    """
+    场景坐标系：x 从斜坡起点指向货箱内部，y 向左，z 向上，原点在斜坡起点地面中线
+    Scene frame: x from the foot of the ramp into the container, z up, origin on the ground
+    Pallets stand in two columns from the door inwards, pallet 1 and 2 are the first row.
+    """
+    ramp_length = 4.0
+    ramp_width = 1.85
+    ramp_low = 0.005                # 斜坡起点高度 height at the foot of the ramp
+    ramp_high = 0.1                 # 斜坡末端高度 = 货箱地板 height at the door = container floor
+    container_length = 16.0
+    container_width = 2.48
+    container_height = 2.39
+    pallet_length = 1.2             # 沿货箱方向 along the container, 1.0 for the square pallet
+    pallet_width = 1.0
+    load_height = 1.3               # 栈板加货物高度 pallet plus goods
+    column_gap = 0.1
+    door_gap = 0.1                  # 第一排到门口的距离 first row to the door
+    pallets = 22
+
+    def pallet_boxes(self, picked=0):
+        """
+        Boxes of the pallets still in the container, pallets are picked in order from the door
+        Returns:
+            (k, 6) array of [x0, x1, y0, y1, z0, z1]
+        """
+        boxes = []
+        for i in range(picked, self.pallets):
+            row, col = divmod(i, 2)
+            x0 = self.ramp_length + self.door_gap + row * self.pallet_length
+            yc = (self.pallet_width + self.column_gap) / 2 * (1 if col == 0 else -1)
+            boxes.append([x0, x0 + self.pallet_length, yc - self.pallet_width / 2, yc + self.pallet_width / 2,
+                          self.ramp_high, self.ramp_high + self.load_height])
+        return np.array(boxes, dtype=np.float64).reshape(-1, 6)
+
+    def next_face(self, picked=0):
+        """Scene x of the goods face nearest the door, None when the container is empty"""
+        boxes = self.pallet_boxes(picked)
+        return float(boxes[:, 0].min()) if len(boxes) else None
+
+    def robot_pose(self, picked=0, standoff=3.0):
+        """Robot pose [x, y, yaw] in the scene, forks (robot -x) towards the next face, standoff metres away"""
+        face = self.next_face(picked)
+        if face is None:
+            face = self.ramp_length + self.door_gap
+        return [face - standoff, 0.0, math.pi]
+
+    def ground(self, x, y):
+        """Floor height under scene points"""
+        x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+        slope = (self.ramp_high - self.ramp_low) / self.ramp_length
+        on_ramp = (x >= 0) & (x < self.ramp_length) & (np.abs(y) < self.ramp_width / 2)
+        in_box = (x >= self.ramp_length) & (np.abs(y) < self.container_width / 2)
+        return np.where(in_box, self.ramp_high, np.where(on_ramp, self.ramp_low + slope * x, 0.0))
+
+    def cast(self, o, d, picked=0, max_range=40.0):
+        """
+        Nearest hit distance of rays from o along unit directions d, inf when nothing is hit
+        Args:
+            o: (3,) ray origin, d: (n, 3) unit directions, both in the scene frame
+        """
+        t = np.full(len(d), np.inf)
+        x1 = self.ramp_length + self.container_length
+        hw = self.container_width / 2
+        top = self.ramp_high + self.container_height
+        # 地面、货箱地板/墙/顶/后墙 ground, container floor, walls, roof and back wall
+        t = np.minimum(t, _rect_hit(o, d, 2, 0.0, (-max_range, max_range), (-max_range, max_range)))
+        t = np.minimum(t, _rect_hit(o, d, 2, self.ramp_high, (self.ramp_length, x1), (-hw, hw)))
+        t = np.minimum(t, _rect_hit(o, d, 2, top, (self.ramp_length, x1), (-hw, hw)))
+        for y in (-hw, hw):
+            t = np.minimum(t, _rect_hit(o, d, 1, y, (self.ramp_length, x1), (0.0, top)))
+        t = np.minimum(t, _rect_hit(o, d, 0, x1, (-hw, hw), (0.0, top)))
+        # 斜坡平面 z = low + slope * x the ramp plate
+        slope = (self.ramp_high - self.ramp_low) / self.ramp_length
+        with np.errstate(divide="ignore", invalid="ignore"):
+            tr = (self.ramp_low + slope * o[0] - o[2]) / (d[:, 2] - slope * d[:, 0])
+        hx, hy = o[0] + tr * d[:, 0], o[1] + tr * d[:, 1]
+        ok = (tr > 1e-6) & (hx >= 0) & (hx <= self.ramp_length) & (np.abs(hy) <= self.ramp_width / 2)
+        t = np.minimum(t, np.where(ok, tr, np.inf))
+        # 栈板 slab 求交 pallets, slab test
+        with np.errstate(divide="ignore", invalid="ignore"):
+            inv = 1.0 / d
+        for box in self.pallet_boxes(picked):
+            lo = (box[0::2] - o) * inv
+            hi = (box[1::2] - o) * inv
+            t0 = np.nanmax(np.minimum(lo, hi), axis=1)
+            t1 = np.nanmin(np.maximum(lo, hi), axis=1)
+            t = np.minimum(t, np.where((t0 <= t1) & (t0 > 1e-6), t0, np.inf))
+        t[t > max_range] = np.inf
+        return t
+
+
+def _rect_hit(o, d, axis, value, lo, hi):
+    """Ray distance to the axis-aligned rectangle {p[axis] = value, lo/hi bound the other two axes in order}"""
+    a, b = [i for i in range(3) if i != axis]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = (value - o[axis]) / d[:, axis]
+    pa, pb = o[a] + t * d[:, a], o[b] + t * d[:, b]
+    ok = (t > 1e-6) & (pa >= lo[0]) & (pa <= lo[1]) & (pb >= hi[0]) & (pb <= hi[1])
+    return np.where(ok, t, np.inf)
+
+
+def scan(scene, pose, n, picked=0, sensor=(-0.2, 0.0, 2.0), elevation=(-52.0, 7.0), noise=0.01, seed=None):
+    """
+    Mid360-like scan of the scene: rays uniform in solid angle over 360 deg x elevation, nearest hit only,
+    so pallets and walls occlude what is behind them and the density falls off with range
+    Args:
+        pose: robot pose [x, y, yaw] in the scene, see ContainerScene.robot_pose()
+        n: points returned, rays are cast until that many hit
+        sensor: sensor position in the robot frame (m)
+        elevation: vertical field of view (deg), the default is a Mid360 mounted upside down
+        noise: range noise sigma (m)
+    Returns:
+        x, y, z float32 columns in the robot frame, z from the floor under the robot
+    """
+    rng = np.random.default_rng(seed)
+    c, s = math.cos(pose[2]), math.sin(pose[2])
+    floor = float(scene.ground(pose[0], pose[1]))
+    o = np.array([pose[0] + c * sensor[0] - s * sensor[1], pose[1] + s * sensor[0] + c * sensor[1],
+                  floor + sensor[2]])
+    s0, s1 = math.sin(math.radians(elevation[0])), math.sin(math.radians(elevation[1]))
+    hits = []
+    found = 0
+    while found < n:
+        k = max(int((n - found) * 1.3), 1000)
+        az = rng.uniform(0, 2 * math.pi, k)
+        sz = rng.uniform(s0, s1, k)
+        cz = np.sqrt(1 - sz * sz)
+        d = np.column_stack((cz * np.cos(az), cz * np.sin(az), sz))
+        t = scene.cast(o, d, picked)
+        ok = np.isfinite(t)
+        t = t[ok] + rng.normal(0, noise, ok.sum())
+        hits.append(o + d[ok] * t[:, None])
+        found += len(t)
+    p = np.vstack(hits)[:n]
+    dx, dy = p[:, 0] - pose[0], p[:, 1] - pose[1]
+    x = c * dx + s * dy
+    y = -s * dx + c * dy
+    return x.astype(np.float32), y.astype(np.float32), (p[:, 2] - floor).astype(np.float32)
+
+
+def as_cloud(x, y, z, device_name="DJI-mid360-TCP"):
+    """r.allCameraCloud()["allcloud"] layout of one device"""
+    return [{"device": {"device_name": device_name},
+             "cloud": [{"x": a, "y": b, "z": c} for a, b, c in zip(x.tolist(), y.tolist(), z.tolist())]}]
+
+
+class SynthRobot:
+    """The part of the robot interface Mid360AreaDetect uses, backed by a synthetic scan"""
+
+    def __init__(self, all_cloud, pose):
+        self.all_cloud = all_cloud
+        self.pose = pose
+        self.gdata = {}
+        self.errors = []
+
+    def allCameraCloud(self):
+        return {"allcloud": self.all_cloud}
+
+    def loc(self):
+        return {"x": self.pose[0], "y": self.pose[1], "angle": self.pose[2]}
+
+    def setGData(self, data):
+        self.gdata = data
+
+    def getGData(self):
+        return self.gdata
+
+    def setError(self, msg):
+        self.errors.append(msg)
+
+    def setWarning(self, msg):
+        pass
+
+    def logInfo(self, msg):
+        pass
+
+
+def detect_once(TKC, scene, n, picked, max_ticks=500, seed=0):
+    """
+    Run one Mid360AreaDetect on a fresh scan, ticks back to back
+    Returns:
+        dict of the run, face_err is the detected minus the true face position (m)
+    """
+    pose = scene.robot_pose(picked)
+    robot = SynthRobot(as_cloud(*scan(scene, pose, n, picked, seed=seed)), pose)
+    m = TKC.Module(robot, {})
+    task = TKC.Mid360AreaDetect(robot)
+    m.task_list = [task]
+    busy = 0.0
+    worst = 0.0
+    ticks = 0
+    while ticks < max_ticks and task.status not in (TKC.MoveStatus.FINISHED, TKC.MoveStatus.FAILED):
+        t = time.perf_counter()
+        task.run(robot, m)
+        dt = time.perf_counter() - t
+        busy += dt
+        worst = max(worst, dt)
+        ticks += 1
+    face = scene.next_face(picked)
+    has_goods = bool(m.GData.has_goods)
+    face_err = None
+    if has_goods and face is not None and m.GData.good_location:
+        face_err = m.GData.good_location[0] - face
+    return dict(points=n, picked=picked, status=task.status, ticks=ticks, frames=task.frame_num,
+                busy=busy, worst=worst, has_goods=has_goods, correct=has_goods == (face is not None),
+                face_err=face_err, errors=robot.errors)
+
+
+def benchmark(sizes=(10000, 50000, 100000, 200000, 500000), picks=(0, 5, 12, 21, 22), seed=0):
+    """
+    Mid360AreaDetect over synthetic scans of each size and each number of pallets already picked
+    Needs the rbk runtime for TKC. Frames are taken back to back (frame_interval 0) and scans are not saved.
+    Returns:
+        one summary dict per size
+    """
+    import TKC
+    scene = ContainerScene()
+    saved = TKC.GoodsAreaDetect.frame_interval, TKC.GoodsAreaDetect.scan_dir
+    TKC.GoodsAreaDetect.frame_interval, TKC.GoodsAreaDetect.scan_dir = 0, ""
+    rows = []
+    try:
+        for n in sizes:
+            runs = [detect_once(TKC, scene, n, p, seed=seed + i) for i, p in enumerate(picks)]
+            frames = sum(r["frames"] for r in runs)
+            errs = [abs(r["face_err"]) for r in runs if r["face_err"] is not None]
+            rows.append(dict(points=n,
+                             points_per_s=n * frames / max(sum(r["busy"] for r in runs), 1e-9),
+                             ticks_per_scan=sum(r["ticks"] for r in runs) / max(frames, 1),
+                             worst_tick_ms=1000 * max(r["worst"] for r in runs),
+                             face_err_mm=1000 * float(np.mean(errs)) if errs else None,
+                             correct=sum(r["correct"] for r in runs) / len(runs),
+                             runs=runs))
+    finally:
+        TKC.GoodsAreaDetect.frame_interval, TKC.GoodsAreaDetect.scan_dir = saved
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mid360AreaDetect benchmark on synthetic container scans")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 50000, 100000, 200000, 500000])
+    parser.add_argument("--picks", type=int, nargs="+", default=[0, 5, 12, 21, 22],
+                        help="pallets already picked, 22 is an empty container")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    print(f"{'points':>8} {'points/s':>10} {'ticks/scan':>10} {'worst ms':>9} {'face err mm':>11} {'correct':>8}")
+    for row in benchmark(args.sizes, args.picks, args.seed):
+        err = "-" if row["face_err_mm"] is None else f"{row['face_err_mm']:.0f}"
+        print(f"{row['points']:>8} {row['points_per_s']:>10.0f} {row['ticks_per_scan']:>10.1f} "
+              f"{row['worst_tick_ms']:>9.1f} {err:>11} {row['correct']:>8.0%}")
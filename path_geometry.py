@@ -0,0 +1,747 @@
+"""
+路径几何 Path geometry shared by the planners in TKC.py
+
+Cubic Beziers are evaluated as one matrix product of a cached Bernstein basis
+(n, 4) with the control points (4, 2), together with the analytic first and
+second derivatives, so position, heading and curvature come from one call.
+Control points may carry leading batch dimensions, e.g. (k, 4, 2) evaluates
+k candidate curves at once.
+"""
+import hashlib, json, math, os, time
+from collections import OrderedDict, namedtuple
+import numpy as np
+
+BezierPath = namedtuple("BezierPath", "x y heading curvature")
+BezierPath.__doc__ = """Samples of a curve: x, y (m), heading = tangent direction (rad), curvature (1/m, left positive)
+Also returned by the other planners of plan_path()"""
+SpeedProfile = namedtuple("SpeedProfile", "x y s v")
+SpeedProfile.__doc__ = """velocity_profile() result: stations x, y (m) every step along the path, arc length s (m), speed limit v (m/s)"""
+CurveStats = namedtuple("CurveStats", "max_heading_change max_curvature min_radius")
+CurveStats.__doc__ = """analyze() result: largest |heading - start heading| (rad), max |curvature| (1/m), min radius (m)"""
+
+_bases = {}
+_maps = {}
+
+
+def bernstein(n):
+    """
+    Cubic Bernstein basis and its derivatives at n samples t = 0..1, built once per n
+    Returns:
+        (b, d1, d2), each (n, 4), so points = b @ control_points, velocity = d1 @ control_points
+    """
+    bases = _bases.get(n)
+    if bases is None:
+        t = np.linspace(0.0, 1.0, n)[:, None]
+        s = 1.0 - t
+        b = np.hstack((s ** 3, 3 * s ** 2 * t, 3 * s * t ** 2, t ** 3))
+        d1 = np.hstack((-3 * s ** 2, 3 * s ** 2 - 6 * s * t, 6 * s * t - 3 * t ** 2, 3 * t ** 2))
+        d2 = np.hstack((6 * s, 6 * t - 12 * s, 6 * s - 12 * t, 6 * t))
+        bases = _bases[n] = (b, d1, d2)
+        for a in bases:
+            a.setflags(write=False)
+    return bases
+
+
+def cubic_bezier(p0, p1, p2, p3, n=1001):
+    """
+    Sample a cubic Bezier curve
+    Args:
+        p0..p3: control points [x, y], or arrays (..., 2) for a batch of curves
+        n: samples including both ends, 1001 matches the planners' 1 mm-per-mille step
+    Returns:
+        BezierPath of arrays (..., n); curvature is 0 where the curve has no tangent
+    """
+    ctrl = np.stack(np.broadcast_arrays(*(np.asarray(p, dtype=np.float64) for p in (p0, p1, p2, p3))), axis=-2)
+    return evaluate(ctrl, n)
+
+
+def evaluate(ctrl, n=1001):
+    """cubic_bezier() for control points stacked as (..., 4, 2)"""
+    b, d1, d2 = bernstein(n)
+    pts, vel, acc = b @ ctrl, d1 @ ctrl, d2 @ ctrl
+    vx, vy = vel[..., 0], vel[..., 1]
+    speed2 = vx * vx + vy * vy
+    cross = vx * acc[..., 1] - vy * acc[..., 0]
+    moving = speed2 > 1e-18
+    curvature = np.divide(cross, speed2 ** 1.5, out=np.zeros_like(cross), where=moving)
+    heading = np.arctan2(vy, vx)
+    if not moving.all():
+        # 端点切向为零(P1 = P0 或 P2 = P3)时，切线方向是 +B''(起点) / -B''(终点)
+        # a vanishing end tangent points along +B'' at the start and -B'' at the end
+        sign = np.where(np.arange(n) < n / 2, 1.0, -1.0)
+        heading = np.where(moving, heading, np.arctan2(sign * acc[..., 1], sign * acc[..., 0]))
+    return BezierPath(pts[..., 0], pts[..., 1], heading, curvature)
+
+
+def offset_controls(p0, p3, t, offset):
+    """
+    Control points of the chord-offset cubic used by CubicBezier2Load, batched over t and offset
+    P1 = P0 + (0.5 - t) * chord + offset * n, P2 = P3 - (0.5 - t) * chord - offset * n, n = left normal of the chord
+    Args:
+        p0, p3: end points [x, y], must differ
+        t, offset: scalars or arrays of the same shape (...)
+    Returns:
+        (..., 4, 2) control points
+    """
+    p0, p3 = np.asarray(p0, dtype=np.float64), np.asarray(p3, dtype=np.float64)
+    chord = p3 - p0
+    normal = np.array([-chord[1], chord[0]]) / np.hypot(chord[0], chord[1])
+    t, offset = np.broadcast_arrays(np.asarray(t, dtype=np.float64), np.asarray(offset, dtype=np.float64))
+    along = (0.5 - t)[..., None] * chord
+    side = offset[..., None] * normal
+    ctrl = np.empty(t.shape + (4, 2))
+    ctrl[..., 0, :], ctrl[..., 3, :] = p0, p3
+    ctrl[..., 1, :] = p0 + along + side
+    ctrl[..., 2, :] = p3 - along - side
+    return ctrl
+
+
+def travel_time(path, v_max, lateral_acc):
+    """
+    Time to drive sampled curves at v_max, slowed to sqrt(lateral_acc / |curvature|) in bends
+    Returns:
+        (time (s), length (m)) arrays (...)
+    """
+    ds = np.hypot(np.diff(path.x, axis=-1), np.diff(path.y, axis=-1))
+    k = np.abs(path.curvature)
+    k = np.maximum(k[..., 1:], k[..., :-1])
+    v = np.minimum(v_max, np.sqrt(lateral_acc / np.maximum(k, 1e-12)))
+    return (ds / v).sum(axis=-1), ds.sum(axis=-1)
+
+
+def footprint_extent(headings, footprint):
+    """
+    Lateral extent of footprint rectangles turned to the given headings
+    Args:
+        headings: robot headings (rad), any shape (...)
+        footprint: rectangles (x_min, x_max, y_min, y_max) in the robot frame
+    Returns:
+        (low, high) arrays (...), world y of the outermost corners relative to the robot centre
+    """
+    h = np.asarray(headings, dtype=np.float64)
+    s, c = np.sin(h), np.cos(h)
+    low = high = None
+    for x0, x1, y0, y1 in footprint:
+        # 角点 y = x sin(h) + y cos(h)，x、y 两项各自取极值 corner y separates into an x and a y term
+        xs, ys = (x0 * s, x1 * s), (y0 * c, y1 * c)
+        lo = np.minimum(*xs) + np.minimum(*ys)
+        hi = np.maximum(*xs) + np.maximum(*ys)
+        low = lo if low is None else np.minimum(low, lo)
+        high = hi if high is None else np.maximum(high, hi)
+    return low, high
+
+
+def corridor_clearance(xs, ys, headings, footprint, y_band):
+    """
+    Gap between the footprint and the walls of a corridor along world x, at every path sample
+    Args:
+        xs, ys, headings: path samples (..., n), headings are the robot heading, not the tangent in back mode
+        footprint: rectangles (x_min, x_max, y_min, y_max) in the robot frame
+        y_band: (y_min, y_max) wall positions
+    Returns:
+        array (..., n) of the distance to the nearer wall (m), negative where the footprint crosses it
+    """
+    ys = np.asarray(ys, dtype=np.float64)
+    low, high = footprint_extent(headings, footprint)
+    return np.minimum(y_band[1] - (ys + high), (ys + low) - y_band[0])
+
+
+def search_offset_curve(p0, p3, ts, offsets, y_band, min_radius, v_max, lateral_acc, heading=None, heading_tol=0.05,
+                        n=201, budget=None, chunk=64, footprint=None, reverse=False):
+    """
+    Fastest feasible chord-offset cubic among candidate (t, offset) pairs, evaluated chunk by chunk
+    Feasible: minimum turning radius >= min_radius, every sample inside y_band (the whole footprint when
+    given) and, when heading is given, both end tangents within heading_tol of it
+    Args:
+        ts, offsets: 1-D candidates, put the current setting first so it is always scored
+        y_band: (y_min, y_max) allowed lateral range in the same frame as the points, the walls with a footprint
+        heading: tangent direction required at both ends (rad), e.g. the insertion direction
+        budget: seconds, remaining chunks are skipped once it is used up
+        footprint: robot rectangles for corridor_clearance(), reverse: driven in back mode
+    Returns:
+        (index of the best candidate or -1, dict of its time/length/radius/clearance, candidates scored)
+    """
+    start = time.perf_counter()
+    ts, offsets = np.asarray(ts, dtype=np.float64), np.asarray(offsets, dtype=np.float64)
+    best, best_time, info = -1, np.inf, {}
+    done = 0
+    for i in range(0, len(ts), chunk):
+        ctrl = offset_controls(p0, p3, ts[i:i + chunk], offsets[i:i + chunk])
+        path = evaluate(ctrl, n)
+        stats = analyze(ctrl, path=path)
+        duration, length = travel_time(path, v_max, lateral_acc)
+        if footprint is None:
+            clearance = np.minimum(y_band[1] - path.y.max(axis=-1), path.y.min(axis=-1) - y_band[0])
+        else:
+            headings = path.heading + np.pi if reverse else path.heading
+            clearance = corridor_clearance(path.x, path.y, headings, footprint, y_band).min(axis=-1)
+        ok = (stats.min_radius >= min_radius) & (clearance >= 0)
+        if heading is not None:
+            for end in (path.heading[..., 0], path.heading[..., -1]):
+                ok &= np.abs((end - heading + np.pi) % (2 * np.pi) - np.pi) <= heading_tol
+        score = np.where(ok, duration, np.inf)
+        k = int(np.argmin(score))
+        if score[k] < best_time:
+            best, best_time = i + k, score[k]
+            info = dict(time=float(duration[k]), length=float(length[k]), radius=float(stats.min_radius[k]),
+                        clearance=float(clearance[k]))
+        done = i + len(ctrl)
+        if budget is not None and time.perf_counter() - start > budget:
+            break
+    return best, info, done
+
+
+class CurveCache:
+    """
+    LRU of planner results keyed by quantized relative geometry, kept in a JSON file across script runs
+    Entries are small JSON values (e.g. curve parameters); callers re-validate a hit on the exact geometry
+    """
+
+    def __init__(self, path, size=256, grid=0.01):
+        """
+        Args:
+            path: cache file, "" keeps the cache in memory only
+            size: entries kept, the least recently used are dropped
+            grid: quantization step of the key values (m)
+        """
+        self.path, self.size, self.grid = path, size, grid
+        self.entries = None
+        self.hits = self.misses = 0
+
+    def key(self, params, *values):
+        """Key of values rounded to the grid under the planner settings params (any repr-able value)"""
+        signature = hashlib.sha1(repr(params).encode()).hexdigest()[:12]
+        return signature + ":" + ",".join(str(int(round(v / self.grid))) for v in values)
+
+    def _load(self):
+        self.entries = OrderedDict()
+        if not self.path or not os.path.isfile(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                self.entries.update(json.load(f)["entries"])
+        except (OSError, ValueError, KeyError, TypeError):
+            # 文件损坏时从空缓存开始 start empty from a damaged file
+            self.entries.clear()
+
+    def get(self, key):
+        if self.entries is None:
+            self._load()
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        """
+        Store and write the file (tmp + rename, so a crash never leaves half a file)
+        Returns:
+            False if the file could not be written, the entry is still kept in memory
+        """
+        if self.entries is None:
+            self._load()
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+        if not self.path:
+            return True
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump({"entries": list(self.entries.items())}, f)
+            os.replace(self.path + ".tmp", self.path)
+        except OSError:
+            return False
+        return True
+
+    def discard(self, key):
+        if self.entries is not None:
+            self.entries.pop(key, None)
+
+
+def _cross(u, v):
+    return u[..., 0] * v[..., 1] - u[..., 1] * v[..., 0]
+
+
+def _unit_roots(a, b, c):
+    """Real roots in (0, 1) of a t^2 + b t + c, (..., 2) with nan for missing roots"""
+    scale = np.abs(a) + np.abs(b) + np.abs(c) + 1e-300
+    quad = np.abs(a) > 1e-12 * scale
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sq = np.sqrt(b * b - 4 * a * c)
+        r = np.stack((np.where(quad, (-b - sq) / (2 * a), -c / b),
+                      np.where(quad, (-b + sq) / (2 * a), np.nan)), axis=-1)
+    return np.where((r > 0) & (r < 1), r, np.nan)
+
+
+def analyze(ctrl, n=1001, path=None):
+    """
+    Turning of cubic Beziers in one vectorized pass
+    The heading of a cubic only turns back where B' x B'' = 0, a quadratic in t, so the extreme heading
+    change is taken exactly at its roots and the ends rather than at sampled points. Curvature uses the
+    analytic derivatives at the n samples.
+    Args:
+        ctrl: control points (..., 4, 2), e.g. [P0, P1, P2, P3]
+        path: evaluate(ctrl, n) when the caller already has it
+    Returns:
+        CurveStats of arrays (...)
+    """
+    ctrl = np.asarray(ctrl, dtype=np.float64)
+    if path is None:
+        path = evaluate(ctrl, n)
+    n = path.heading.shape[-1]
+    h = np.unwrap(path.heading, axis=-1)
+    h0 = h[..., 0]
+    change = np.abs(h - h0[..., None]).max(axis=-1)
+    # B' = a t^2 + b t + c, B'' = 2 a t + b, B' x B'' = -(a x b) t^2 + 2 (c x a) t + c x b
+    p0, p1, p2, p3 = (ctrl[..., i, :] for i in range(4))
+    a = 3 * (-p0 + 3 * p1 - 3 * p2 + p3)
+    b = 6 * (p0 - 2 * p1 + p2)
+    c = 3 * (p1 - p0)
+    roots = _unit_roots(-_cross(a, b), 2 * _cross(c, a), _cross(c, b))
+    for k in range(2):
+        t = roots[..., k]
+        found = ~np.isnan(t)
+        if not found.any():
+            continue
+        t = np.where(found, t, 0.0)[..., None]
+        vel = a * t * t + b * t + c
+        hr = np.arctan2(vel[..., 1], vel[..., 0])
+        # 就近采样点展开 unwrap next to the nearest sample
+        i = np.rint(t[..., 0] * (n - 1)).astype(int)[..., None]
+        hs = np.take_along_axis(h, i, axis=-1)[..., 0]
+        hr = hs + (hr - hs + np.pi) % (2 * np.pi) - np.pi
+        change = np.where(found, np.maximum(change, np.abs(hr - h0)), change)
+    kappa = np.abs(path.curvature).max(axis=-1)
+    radius = np.divide(1.0, kappa, out=np.full_like(kappa, np.inf), where=kappa > 0)
+    return CurveStats(change[()], kappa[()], radius[()])
+
+
+def velocity_profile(xs, ys, v_max, v_min, lateral_acc, acc, dec, jerk, slow_tail=0.0, step=0.02, tail_speed=None):
+    """
+    Speed limits along a path from curvature, acceleration/deceleration and jerk bounds
+    Starts and ends at v_min. Reachable speeds follow from v^2 <= v0^2 + 2 a ds, which is a running minimum
+    over the stations in each direction. Jerk is bounded by eroding then averaging the limit over the distance
+    covered at top speed while the acceleration ramps up (v_max * acc / jerk), which never raises it or the
+    acceleration.
+    Args:
+        xs, ys: path points, any spacing, they are resampled every step metres
+        v_max: top speed (m/s), or a function of the station arrays (x, y) giving one per station,
+            e.g. MapAreas.speed
+        v_min: speed at the ends and in the tightest bends (m/s), area limits below it still apply
+        lateral_acc: bends are limited to sqrt(lateral_acc / |curvature|)
+        acc, dec (m/s^2), jerk (m/s^3): longitudinal bounds
+        slow_tail: the last metres run at tail_speed (v_min if None), e.g. forks entering a pallet
+    Returns:
+        SpeedProfile on the resampled stations
+    """
+    xs, ys = np.asarray(xs, dtype=np.float64), np.asarray(ys, dtype=np.float64)
+    seg = np.hypot(np.diff(xs), np.diff(ys))
+    s0 = np.concatenate(([0.0], np.cumsum(seg)))
+    length = s0[-1]
+    s = np.append(np.arange(0.0, length, step), length) if length > 0 else np.zeros(1)
+    x, y = np.interp(s, s0, xs), np.interp(s, s0, ys)
+    if len(s) < 3:
+        top = np.asarray(v_max(x, y) if callable(v_max) else v_max, dtype=np.float64)
+        return SpeedProfile(x, y, s, np.minimum(np.full(len(s), float(v_min)), top))
+
+    # 曲率 = 航向变化 / 弧长 curvature from the heading change per metre
+    heading = np.unwrap(np.arctan2(np.diff(y), np.diff(x)))
+    ds = np.diff(s)
+    kappa = np.zeros(len(s))
+    kappa[1:-1] = np.abs(np.diff(heading)) / (0.5 * (ds[1:] + ds[:-1]))
+    top = np.broadcast_to(np.asarray(v_max(x, y) if callable(v_max) else v_max, dtype=np.float64), s.shape)
+    v2 = np.minimum(top, np.sqrt(lateral_acc / np.maximum(kappa, 1e-12))) ** 2
+    floor = np.full(len(s), float(v_min))
+    if slow_tail > 0:
+        tail = s >= length - slow_tail
+        floor[tail] = v_min if tail_speed is None else tail_speed
+        v2[tail] = floor[tail] ** 2
+    v2[0], v2[-1] = v_min ** 2, floor[-1] ** 2
+
+    # 前向加速、后向减速约束 forward acceleration and backward deceleration passes
+    v2 = np.minimum(v2, top ** 2)
+    v2 = np.minimum(v2, 2 * acc * s + np.minimum.accumulate(v2 - 2 * acc * s))
+    r = length - s
+    v2 = np.minimum(v2, 2 * dec * r + np.minimum.accumulate((v2 - 2 * dec * r)[::-1])[::-1])
+
+    # 在 v^2 上平滑，斜率(2a)的上限保持不变 smoothing v^2 keeps its slope, 2 a, within bounds
+    w = int(np.ceil(top.max() * acc / jerk / step / 2)) if jerk > 0 else 0
+    if w > 0:
+        eroded = np.lib.stride_tricks.sliding_window_view(np.pad(v2, w, mode="edge"), 2 * w + 1).min(axis=-1)
+        c = np.concatenate(([0.0], np.cumsum(np.pad(eroded, w, mode="edge"))))
+        v2 = (c[2 * w + 1:] - c[:-2 * w - 1]) / (2 * w + 1)
+    return SpeedProfile(x, y, s, np.minimum(np.maximum(np.sqrt(v2), floor), top))
+
+
+def profile_time(profile):
+    """Seconds to drive a SpeedProfile at its limits"""
+    return float((np.diff(profile.s) / (0.5 * (profile.v[1:] + profile.v[:-1]))).sum())
+
+
+class MapAreas:
+    """
+    Polygon index of the advancedAreaList areas of a .smap map, for per-point area properties
+    Build with MapAreas.load(), which parses each file once and reuses it until the file changes
+    """
+
+    def __init__(self, areas):
+        """
+        Args:
+            areas: [(name, class name, vertices (m, 2), {property key: value})]
+        """
+        self.names = [a[0] for a in areas]
+        self.kinds = [a[1] for a in areas]
+        self.polygons = [np.asarray(a[2], dtype=np.float64).reshape(-1, 2) for a in areas]
+        self.properties = [a[3] for a in areas]
+        self.boxes = np.array([np.concatenate((p.min(axis=0), p.max(axis=0))) for p in self.polygons]).reshape(-1, 4)
+
+    @classmethod
+    def load(cls, path):
+        """Areas of a .smap file, cached by path and modification time; raises OSError / ValueError / KeyError"""
+        mtime = os.path.getmtime(path)
+        cached = _maps.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        with open(path, encoding="utf-8") as f:
+            smap = json.load(f)
+        areas = []
+        for area in smap.get("advancedAreaList", []):
+            props = {}
+            for p in area.get("property", []):
+                # 值在 type 对应的 xxxValue 字段 the value sits in the field named after its type
+                value = p.get(p.get("type", "") + "Value")
+                if value is not None and p["key"] != "TextFontSize":
+                    props[p["key"]] = value
+            if props and len(area.get("posGroup", [])) >= 3:
+                areas.append((area.get("instanceName", ""), area.get("className", ""),
+                              [(q.get("x", 0.0), q.get("y", 0.0)) for q in area["posGroup"]], props))
+        index = cls(areas)
+        _maps[path] = (mtime, index)
+        return index
+
+    def inside(self, x, y):
+        """(areas, points) bool matrix, point in polygon by the crossing rule"""
+        x, y = np.atleast_1d(np.asarray(x, dtype=np.float64)), np.atleast_1d(np.asarray(y, dtype=np.float64))
+        hit = np.zeros((len(self.polygons), len(x)), dtype=bool)
+        for k, poly in enumerate(self.polygons):
+            x0, y0, x1, y1 = self.boxes[k]
+            near = np.flatnonzero((x >= x0) & (x <= x1) & (y >= y0) & (y <= y1))
+            if len(near) == 0:
+                continue
+            px, py = x[near, None], y[near, None]
+            ax, ay = poly[:, 0], poly[:, 1]
+            bx, by = np.roll(ax, -1), np.roll(ay, -1)
+            crosses = (ay > py) != (by > py)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                xc = ax + (py - ay) * (bx - ax) / (by - ay)
+            hit[k, near] = (crosses & (px < xc)).sum(axis=1) % 2 == 1
+        return hit
+
+    def speed(self, x, y, default, loaded=False):
+        """
+        Allowed speed at each point: the lowest maxspeed (loadMaxSpeed when loaded) of the areas it lies in
+        Args:
+            default: speed where no area sets a limit, area limits replace it even when higher
+        """
+        hit = self.inside(x, y)
+        v = np.full(hit.shape[1], np.inf)
+        for k, props in enumerate(self.properties):
+            limit = props.get("loadMaxSpeed" if loaded else "maxspeed", props.get("maxspeed"))
+            if limit is not None and hit[k].any():
+                v[hit[k]] = np.minimum(v[hit[k]], limit)
+        return np.where(np.isinf(v), float(default), v)
+
+    def flag(self, x, y, key):
+        """
+        Bool property key (e.g. virtualLaser, 3DCameraObstacle) at each point
+        Returns:
+            int8 array: 1 / 0 where an area containing the point sets it (0 if any sets it off), -1 where none does
+        """
+        hit = self.inside(x, y)
+        out = np.full(hit.shape[1], -1, dtype=np.int8)
+        for k, props in enumerate(self.properties):
+            if key in props and hit[k].any():
+                cur = out[hit[k]]
+                out[hit[k]] = np.where(cur == -1, int(bool(props[key])), np.minimum(cur, int(bool(props[key]))))
+        return out
+
+    def areas_on(self, x, y):
+        """Names and properties of the areas a path passes through"""
+        hit = self.inside(x, y).any(axis=1)
+        return [(self.names[k], self.properties[k]) for k in np.flatnonzero(hit)]
+
+
+def progress(profile, x, y, start=0):
+    """Index of the profile station nearest to (x, y), searched from start on so the progress never goes back"""
+    d = np.hypot(profile.x[start:] - x, profile.y[start:] - y)
+    return start + int(np.argmin(d))
+
+
+def _to_frame(start, goal):
+    """goal pose in the frame of start: (x, y, heading change)"""
+    c, s = math.cos(start[2]), math.sin(start[2])
+    dx, dy = goal[0] - start[0], goal[1] - start[1]
+    return c * dx + s * dy, -s * dx + c * dy, (goal[2] - start[2] + math.pi) % (2 * math.pi) - math.pi
+
+
+def _from_frame(start, x, y, heading, curvature):
+    c, s = math.cos(start[2]), math.sin(start[2])
+    return BezierPath(start[0] + c * x - s * y, start[1] + s * x + c * y, heading + start[2], curvature)
+
+
+def bezier_path(start, goal, radius=None, n=1001, handle=0.4):
+    """
+    Cubic between two poses, control points handle x chord length along each end heading
+    Args:
+        start, goal: [x, y, heading], heading is the direction of travel (robot heading + pi in back mode)
+        radius: unused, kept for the plan_path() signature
+    """
+    chord = math.hypot(goal[0] - start[0], goal[1] - start[1]) * handle
+    p1 = (start[0] + chord * math.cos(start[2]), start[1] + chord * math.sin(start[2]))
+    p2 = (goal[0] - chord * math.cos(goal[2]), goal[1] - chord * math.sin(goal[2]))
+    return cubic_bezier(start[:2], p1, p2, goal[:2], n)
+
+
+def _lane_change(length, peak, n):
+    """Clothoid lane change in its own frame: curvature 0 -> peak -> 0 -> -peak -> 0 linearly in four equal parts"""
+    s = np.linspace(0.0, length, n)
+    q = length / 4
+    kappa = peak * np.interp(s, (0.0, q, 2 * q, 3 * q, length), (0.0, 1.0, 0.0, -1.0, 0.0))
+    ds = np.diff(s)
+    heading = np.concatenate(([0.0], np.cumsum(0.5 * (kappa[1:] + kappa[:-1]) * ds)))
+    c, sn = np.cos(heading), np.sin(heading)
+    x = np.concatenate(([0.0], np.cumsum(0.5 * (c[1:] + c[:-1]) * ds)))
+    y = np.concatenate(([0.0], np.cumsum(0.5 * (sn[1:] + sn[:-1]) * ds)))
+    return x, y, heading, kappa
+
+
+def clothoid_path(start, goal, radius=None, n=1001, tol=1e-9, max_iter=30):
+    """
+    Curvature-continuous lane change between parallel poses, four clothoid arcs
+    Length and peak curvature are solved by Newton so the samples end exactly on the goal.
+    Args:
+        start, goal: [x, y, heading] with the same heading (direction of travel)
+        radius: unused, check analyze() / the curvature against the minimum radius
+    Raises:
+        ValueError if the headings differ or there is no solution
+    """
+    gx, gy, turn = _to_frame(start, goal)
+    if abs(turn) > 1e-6 or gx <= 0:
+        raise ValueError("clothoid lane change needs parallel poses with the goal ahead")
+    n = (n - 1) // 4 * 4 + 1  # 分段点落在采样点上 segment ends on samples, so the heading is exact
+    if abs(gy) < 1e-12:
+        x, y, heading, kappa = _lane_change(gx, 0.0, n)
+        return _from_frame(start, x, y, heading, kappa)
+    x, y, _, _ = _lane_change(gx, 1e-3, n)
+    v = np.array([gx, gy / (y[-1] / 1e-3)])  # 小角度近似起步 small-angle start
+    for _ in range(max_iter):
+        x, y, heading, kappa = _lane_change(v[0], v[1], n)
+        err = np.array([x[-1] - gx, y[-1] - gy])
+        if np.abs(err).max() < tol:
+            return _from_frame(start, x, y, heading, kappa)
+        jac = np.empty((2, 2))
+        for j, h in enumerate((1e-7 * v[0], 1e-7 * max(abs(v[1]), 1e-3))):
+            w = v.copy()
+            w[j] += h
+            xj, yj, _, _ = _lane_change(w[0], w[1], n)
+            jac[:, j] = (np.array([xj[-1] - gx, yj[-1] - gy]) - err) / h
+        v = v - np.linalg.solve(jac, err)
+        if v[0] <= 0 or abs(v[1]) * v[0] / 4 >= math.pi / 2:
+            break
+    raise ValueError(f"no clothoid lane change to ({gx:.3f}, {gy:.3f})")
+
+
+def _dubins_words(d, a, b):
+    """Candidate (word, t, p, q) of the six Dubins words, unit radius, from the standard closed forms"""
+    sa, sb, ca, cb, cab = math.sin(a), math.sin(b), math.cos(a), math.cos(b), math.cos(a - b)
+    tau = 2 * math.pi
+    out = []
+    tmp = 2 + d * d - 2 * cab + 2 * d * (sa - sb)
+    if tmp >= 0:
+        th = math.atan2(cb - ca, d + sa - sb)
+        out.append(("LSL", (th - a) % tau, math.sqrt(tmp), (b - th) % tau))
+    tmp = 2 + d * d - 2 * cab + 2 * d * (sb - sa)
+    if tmp >= 0:
+        th = math.atan2(ca - cb, d - sa + sb)
+        out.append(("RSR", (a - th) % tau, math.sqrt(tmp), (th - b) % tau))
+    tmp = -2 + d * d + 2 * cab + 2 * d * (sa + sb)
+    if tmp >= 0:
+        p = math.sqrt(tmp)
+        th = math.atan2(-ca - cb, d + sa + sb) - math.atan2(-2.0, p)
+        out.append(("LSR", (th - a) % tau, p, (th - b) % tau))
+    tmp = -2 + d * d + 2 * cab - 2 * d * (sa + sb)
+    if tmp >= 0:
+        p = math.sqrt(tmp)
+        th = math.atan2(ca + cb, d - sa - sb) - math.atan2(2.0, p)
+        out.append(("RSL", (a - th) % tau, p, (b - th) % tau))
+    tmp = (6 - d * d + 2 * cab + 2 * d * (sa - sb)) / 8
+    if abs(tmp) <= 1:
+        p = (tau - math.acos(tmp)) % tau
+        t = (a - math.atan2(ca - cb, d - sa + sb) + p / 2) % tau
+        out.append(("RLR", t, p, (a - b - t + p) % tau))
+    tmp = (6 - d * d + 2 * cab + 2 * d * (sb - sa)) / 8
+    if abs(tmp) <= 1:
+        p = (tau - math.acos(tmp)) % tau
+        t = (-a - math.atan2(ca - cb, d + sa - sb) + p / 2) % tau
+        out.append(("LRL", t, p, (b - a - t + p) % tau))
+    return out
+
+
+def _segments_end(pose, segments):
+    """Pose after driving (curvature, length) segments from pose"""
+    x, y, h = pose
+    for k, l in segments:
+        if k == 0:
+            x, y = x + l * math.cos(h), y + l * math.sin(h)
+        else:
+            x, y = x + (math.sin(h + k * l) - math.sin(h)) / k, y + (math.cos(h) - math.cos(h + k * l)) / k
+        h += k * l
+    return x, y, h
+
+
+def _sample_segments(pose, segments, n):
+    """BezierPath samples every total/(n-1) metres along (curvature, length) segments"""
+    segments = [seg for seg in segments if seg[1] > 1e-12] or [(0.0, 0.0)]
+    lengths = np.array([l for _, l in segments])
+    ks = np.array([k for k, _ in segments], dtype=np.float64)
+    starts = [pose]
+    for seg in segments[:-1]:
+        starts.append(_segments_end(starts[-1], [seg]))
+    starts = np.array(starts)
+    edges = np.concatenate(([0.0], np.cumsum(lengths)))
+    s = np.linspace(0.0, edges[-1], n)
+    i = np.clip(np.searchsorted(edges, s, side="right") - 1, 0, len(segments) - 1)
+    l, k = s - edges[i], ks[i]
+    x0, y0, h0 = starts[i, 0], starts[i, 1], starts[i, 2]
+    h = h0 + k * l
+    curved = k != 0
+    kk = np.where(curved, k, 1.0)
+    x = np.where(curved, x0 + (np.sin(h) - np.sin(h0)) / kk, x0 + l * np.cos(h0))
+    y = np.where(curved, y0 + (np.cos(h0) - np.cos(h)) / kk, y0 + l * np.sin(h0))
+    return BezierPath(x, y, h, k)
+
+
+def dubins_path(start, goal, radius, n=1001):
+    """
+    Shortest forward path of arcs of the given radius and straight lines (Dubins)
+    Args:
+        start, goal: [x, y, heading], heading is the direction of travel
+        radius: turning radius (m)
+    """
+    dx, dy = goal[0] - start[0], goal[1] - start[1]
+    phi = math.atan2(dy, dx)
+    d = math.hypot(dx, dy) / radius
+    a, b = (start[2] - phi) % (2 * math.pi), (goal[2] - phi) % (2 * math.pi)
+    turn = {"L": 1.0 / radius, "S": 0.0, "R": -1.0 / radius}
+    best = None
+    for word, *units in _dubins_words(d, a, b):
+        segments = [(turn[c], u * radius) for c, u in zip(word, units)]
+        # 只保留终点对得上的解 keep words that actually reach the goal
+        x, y, h = _segments_end(start, segments)
+        if math.hypot(x - goal[0], y - goal[1]) > 1e-6 * max(radius, 1.0) or \
+                abs((h - goal[2] + math.pi) % (2 * math.pi) - math.pi) > 1e-6:
+            continue
+        length = sum(l for _, l in segments)
+        if best is None or length < best[0]:
+            best = (length, segments)
+    if best is None:
+        raise ValueError("no Dubins path")
+    return _sample_segments(start, best[1], n)
+
+
+PLANNERS = {"bezier": bezier_path, "clothoid": clothoid_path, "dubins": dubins_path}
+
+
+def plan_path(planner, start, goal, radius, n=1001, **params):
+    """
+    Path between two poses from one of PLANNERS
+    Args:
+        planner: "bezier", "clothoid" or "dubins"
+        start, goal: [x, y, heading], heading is the direction of travel (robot heading + pi in back mode)
+        radius: turning radius for dubins, the others ignore it
+        params: planner specific, e.g. handle for bezier
+    Returns:
+        BezierPath samples
+    Raises:
+        ValueError for an unknown planner or when it has no path
+    """
+    if planner not in PLANNERS:
+        raise ValueError(f"unknown planner {planner}, use one of {sorted(PLANNERS)}")
+    return PLANNERS[planner](start, goal, radius, n, **params)
+
+
+def cusp_path(start, cusp, goal, planner="bezier", radius=None, n=1001, reverse_first=False, straight_in=0.0):
+    """
+    Drive to cusp, stop and reverse to goal: one maneuver with a single direction change
+    Both legs come from plan_path with the robot heading kept through the cusp, so the second leg leaves the
+    cusp along the line the first arrived on.
+    Args:
+        start, cusp, goal: [x, y, heading], heading is the robot heading (not the direction of travel)
+        reverse_first: the first leg runs in back mode and the second forward, else the other way round
+        straight_in: the second leg ends with this long a straight run into goal (m), e.g. forks entering a pallet
+    Returns:
+        (first leg, second leg) BezierPath samples along each leg's direction of travel, first ends where second starts
+    Raises:
+        ValueError as plan_path
+    """
+    flip = math.pi if reverse_first else 0.0
+    first = plan_path(planner, [start[0], start[1], start[2] + flip], [cusp[0], cusp[1], cusp[2] + flip], radius, n)
+    flip = math.pi - flip
+    heading = goal[2] + flip
+    chord = math.hypot(goal[0] - cusp[0], goal[1] - cusp[1])
+    straight_in = straight_in if 0.0 < straight_in < chord else 0.0
+    c, s = math.cos(heading), math.sin(heading)
+    entry = [goal[0] - straight_in * c, goal[1] - straight_in * s, heading]
+    second = plan_path(planner, [cusp[0], cusp[1], cusp[2] + flip], entry, radius, n)
+    if straight_in:
+        m = max(2, int(round(n * straight_in / chord)))
+        run = np.linspace(0.0, straight_in, m)[1:]
+        second = BezierPath(np.concatenate((second.x, entry[0] + run * c)),
+                            np.concatenate((second.y, entry[1] + run * s)),
+                            np.concatenate((second.heading, np.full(m - 1, heading))),
+                            np.concatenate((second.curvature, np.zeros(m - 1))))
+    return first, second
+
+
+def simplify(xs, ys, tolerance):
+    """
+    Douglas-Peucker: indices of the fewest points whose polyline stays within tolerance of every sample
+    Args:
+        tolerance: max lateral deviation (m), 0 keeps every point
+    Returns:
+        sorted index array, always including both ends
+    """
+    xs, ys = np.asarray(xs, dtype=np.float64), np.asarray(ys, dtype=np.float64)
+    n = len(xs)
+    if n <= 2 or tolerance <= 0:
+        return np.arange(n)
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        i, j = stack.pop()
+        if j - i < 2:
+            continue
+        dx, dy = xs[j] - xs[i], ys[j] - ys[i]
+        px, py = xs[i + 1:j] - xs[i], ys[i + 1:j] - ys[i]
+        chord = np.hypot(dx, dy)
+        # 到弦的距离，弦长为 0(首尾重合)时用到端点的距离 distance to the chord, or to its end when it has no length
+        dist = np.abs(dx * py - dy * px) / chord if chord > 1e-12 else np.hypot(px, py)
+        k = int(np.argmax(dist))
+        if dist[k] > tolerance:
+            k += i + 1
+            keep[k] = True
+            stack.append((i, k))
+            stack.append((k, j))
+    return np.flatnonzero(keep)
+
+
+def sparse_path(xs, ys, tolerance):
+    """The points of simplify() as lists, ready for r.setPathOnWorld"""
+    idx = simplify(xs, ys, tolerance)
+    return np.asarray(xs)[idx].tolist(), np.asarray(ys)[idx].tolist()
@@ -0,0 +1,102 @@
+"""
+规划器对比 Pickup curves of each planner in path_geometry.PLANNERS on the same pallet offsets
+
+For each pallet offset the CubicBezier2Load target is computed as in TKC.py, then every planner drives from the
+robot (container centreline, backing in) to it. Reported per path: length, peak curvature, traverse time under
+the TKC speed profile and the swept-footprint clearance to the container walls.
+
+    python planner_bench.py --offsets -0.6 -0.3 0 0.3 0.6 --depth 4
+"""
+import argparse
+import math
+import numpy as np
+import path_geometry
+
+
+def pickup_paths(TKC, lateral, depth):
+    """
+    Pickup paths of every planner for a pallet lateral (m, robot y) and depth (m, behind the robot)
+    Returns:
+        {name: BezierPath or ValueError}, target pose, side-shift
+    """
+    task = TKC.CubicBezier2Load.__new__(TKC.CubicBezier2Load)
+    task.pallet_number = TKC.PathPlanningConfig.first_n_pallets_use_old_logic + 1
+    task.side = task._calculate_side_offset(lateral)
+    pallet_to_robot = [-depth, lateral, 0.0]
+    P0 = [0.0, 0.0]
+    P3 = [-depth + TKC.CubicBezierPar.backDist, task._calculate_y_offset(lateral)]
+    task.target_world = [P3[0], P3[1], 0.0]
+    heading = math.pi  # 倒车进叉 backing in
+    paths = {}
+    for name, params in (("bezier", task._get_curve_params(pallet_to_robot)),
+                         ("bezier-search", task._optimize_curve_params(P0, P3, pallet_to_robot))):
+        ctrl = path_geometry.offset_controls(P0, P3, params["t"], params["d"] * params["c_extend_factor"])
+        paths[name] = path_geometry.evaluate(ctrl)
+    for name in ("clothoid", "dubins"):
+        try:
+            paths[name] = path_geometry.plan_path(name, [*P0, heading], [*P3, heading],
+                                                  TKC.PathPlanningConfig.planner_radius)
+        except ValueError as e:
+            paths[name] = e
+    return paths, P3, task.side
+
+
+def measure(TKC, path, side, ramp=False):
+    """Length, peak curvature, profile time and wall clearance of one pickup path"""
+    cfg = TKC.PathPlanningConfig
+    profile = path_geometry.velocity_profile(path.x, path.y, cfg.path_max_speed, cfg.path_min_speed,
+                                             cfg.path_lateral_acc, cfg.path_acc, cfg.path_dec, cfg.path_jerk,
+                                             cfg.insert_slow_dist, tail_speed=cfg.insert_speed)
+    clearance = path_geometry.corridor_clearance(path.x, path.y, path.heading + math.pi,
+                                                 TKC.PathGuard.footprint(side), TKC.PathGuard.walls(ramp))
+    kappa = float(np.abs(path.curvature).max())
+    return dict(length=float(profile.s[-1]), peak_curvature=kappa,
+                min_radius=1.0 / kappa if kappa > 0 else math.inf,
+                time=path_geometry.profile_time(profile), clearance=float(clearance.min()))
+
+
+def benchmark(offsets=(-0.6, -0.45, -0.3, 0.0, 0.3, 0.45, 0.6), depth=4.0):
+    """
+    Every planner on every pallet offset
+    Needs the rbk runtime for TKC. The curve cache is kept in memory so the file next to TKC is not touched.
+    Returns:
+        one dict per (offset, planner)
+    """
+    import TKC
+    saved = TKC.CubicBezier2Load.curve_cache
+    TKC.CubicBezier2Load.curve_cache = path_geometry.CurveCache("")
+    verbose, TKC.PathPlanningConfig.verbose_logging = TKC.PathPlanningConfig.verbose_logging, False
+    rows = []
+    try:
+        for lateral in offsets:
+            paths, target, side = pickup_paths(TKC, lateral, depth)
+            for name, path in paths.items():
+                row = dict(offset=lateral, planner=name, target=target)
+                if isinstance(path, ValueError):
+                    row["error"] = str(path)
+                else:
+                    row.update(measure(TKC, path, side))
+                    row["feasible"] = (row["min_radius"] >= TKC.CubicBezierPar.min_radius and
+                                       row["clearance"] >= TKC.PathPlanningConfig.corridor_min_clearance)
+                rows.append(row)
+    finally:
+        TKC.CubicBezier2Load.curve_cache = saved
+        TKC.PathPlanningConfig.verbose_logging = verbose
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pickup path planners compared on the same pallet offsets")
+    parser.add_argument("--offsets", type=float, nargs="+", default=[-0.6, -0.45, -0.3, 0.0, 0.3, 0.45, 0.6],
+                        help="pallet lateral offsets from the robot (m)")
+    parser.add_argument("--depth", type=float, default=4.0, help="pallet distance behind the robot (m)")
+    args = parser.parse_args()
+    print(f"{'offset':>7} {'planner':<14} {'length m':>9} {'peak 1/m':>9} {'radius m':>9} {'time s':>7} "
+          f"{'clear m':>8} {'ok':>3}")
+    for row in benchmark(args.offsets, args.depth):
+        if "error" in row:
+            print(f"{row['offset']:>7.2f} {row['planner']:<14} {row['error']}")
+            continue
+        print(f"{row['offset']:>7.2f} {row['planner']:<14} {row['length']:>9.3f} {row['peak_curvature']:>9.3f} "
+              f"{row['min_radius']:>9.2f} {row['time']:>7.1f} {row['clearance']:>8.3f} "
+              f"{'yes' if row['feasible'] else 'no':>3}")